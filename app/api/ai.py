@@ -1,12 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException
+import asyncio
+import json
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import get_async_db
-from app.schemas.notes import NoteSummary
+from app.database import AsyncSessionLocal, get_async_db
+from app.schemas.notes import NoteSummary, SummaryBatchRequest
 from app.services import notes as notes_service
 from app.services import ai as ai_service
+from app.services import summaries as summaries_service
+from app.services import precompute
+from app.services import summarizers
+
+
+async def bind_client(request: Request):
+    """Tag model calls made while handling this request with the caller"""
+    if request.client is not None:
+        ai_service.current_client.set(request.client.host)
 
-router = APIRouter(prefix="/ai", tags=["ai"])
+
+router = APIRouter(prefix="/ai", tags=["ai"], dependencies=[Depends(bind_client)])
 
 
 @router.get("/notes/{note_id}/summary", response_model=NoteSummary)
@@ -15,12 +29,79 @@ async def summarize_note(
 ):
     """Generate a summary for a note using AI"""
     note = await notes_service.get_note_async(db, note_id)
-    summary = await ai_service.summarize_text_async(note.content, note.title)
+    summary = await summaries_service.get_summary_async(db, note)
 
     return {"note_id": note.id, "summary": summary}
 
 
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.get("/notes/{note_id}/summary/stream")
+async def stream_note_summary(
+    note_id: int, db: AsyncSession = Depends(get_async_db)
+):
+    """Stream a note summary as Server-Sent Events while it is generated"""
+    note = await notes_service.get_note_async(db, note_id)
+
+    # On client disconnect Starlette cancels this generator, which closes
+    # the upstream model stream. The request's session is closed before
+    # the body is sent, so the summary is stored through a session of its own.
+    async def events():
+        async with AsyncSessionLocal() as session:
+            try:
+                async for chunk in summaries_service.stream_summary_async(session, note):
+                    yield _sse("chunk", {"text": chunk})
+            except HTTPException as e:
+                yield _sse("error", {"detail": e.detail, "status_code": e.status_code})
+                return
+        yield _sse("done", {"note_id": note_id})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/summaries")
+async def summarize_notes(
+    batch: SummaryBatchRequest, db: AsyncSession = Depends(get_async_db)
+):
+    """Summarize several notes, streaming one NDJSON line per note as it completes"""
+    notes = await notes_service.get_notes_by_ids_async(db, batch.note_ids)
+    client = ai_service.current_client.get()
+
+    # The request's session is closed before the body is sent, so results
+    # are stored through a session of their own. Model calls count against
+    # the caller's per-client cap.
+    async def lines():
+        ai_service.current_client.set(client)
+        async with AsyncSessionLocal() as session:
+            async for item in summaries_service.summarize_notes_async(
+                session, batch.note_ids, notes, batch.concurrency
+            ):
+                yield json.dumps(item) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
 @router.get("/models")
 async def get_available_models():
     """Get list of available AI models"""
-    return {"models": ai_service.list_available_models()}
+    # A cold or expired cache fetches from the API, so keep it off the loop
+    return {"models": await asyncio.to_thread(ai_service.list_available_models)}
+
+
+@router.get("/stats")
+async def get_ai_stats():
+    """Get concurrency, queue-depth and cache counters of the AI service"""
+    return {
+        **ai_service.get_stats(),
+        "summarizer_backend": summarizers.SUMMARIZER_BACKEND,
+        "summary_cache": summaries_service.lru.stats(),
+        "single_flight": summaries_service.flight.stats(),
+        "fallbacks": summaries_service.fallback_stats,
+        "precompute": precompute.precomputer.stats(),
+    }
@@ -1,9 +1,11 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Query
 from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
 
 from app.database import get_async_db
-from app.schemas.notes import AnalyticsResponse
+from app.schemas.notes import AnalyticsResponse, DuplicatesReport
 from app.services import analytics as analytics_service
+from app.services.duplicates import DEFAULT_THRESHOLD
 
 router = APIRouter(prefix="/analytics", tags=["analytics"])
 
@@ -12,3 +14,13 @@ router = APIRouter(prefix="/analytics", tags=["analytics"])
 async def get_notes_analytics(db: AsyncSession = Depends(get_async_db)):
     """Get analytics for all notes"""
     return await analytics_service.analyze_notes_async(db)
+
+
+@router.get("/duplicates", response_model=DuplicatesReport)
+async def get_duplicates_report(
+    threshold: float = Query(DEFAULT_THRESHOLD, ge=0.0, le=1.0),
+):
+    """Get groups of near-duplicate notes"""
+    # Grouping compares every pair within each LSH bucket, so it runs in
+    # the threadpool rather than on the event loop
+    return await run_in_threadpool(analytics_service.duplicates_report, threshold)
@@ -0,0 +1,72 @@
+import os
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import get_async_db
+from app.schemas.notes import AttachmentResponse
+from app.services import attachments as attachments_service
+from app.utils.file_response import BlobResponse
+
+router = APIRouter(prefix="/notes", tags=["attachments"])
+
+
+@router.post(
+    "/{note_id}/attachments", response_model=AttachmentResponse, status_code=201
+)
+async def create_attachment(
+    note_id: int,
+    request: Request,
+    filename: str = Query(..., min_length=1, max_length=255),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """
+    Attach a file to a note. The request body is the file itself, streamed
+    to disk as it arrives; its Content-Type is kept for downloads, which
+    show only images and PDFs inline.
+    """
+    length = request.headers.get("content-length")
+    if length is not None and length.isdigit():
+        if int(length) > attachments_service.ATTACHMENT_MAX_BYTES:
+            raise HTTPException(status_code=413, detail="Attachment too large")
+    content_type = request.headers.get("content-type", "application/octet-stream")
+    return await attachments_service.create_attachment_async(
+        db, note_id, filename, content_type, request.stream()
+    )
+
+
+@router.get("/{note_id}/attachments", response_model=List[AttachmentResponse])
+async def get_attachments(note_id: int, db: AsyncSession = Depends(get_async_db)):
+    """Get the attachments of a note"""
+    return await attachments_service.get_attachments_async(db, note_id)
+
+
+@router.get("/{note_id}/attachments/{attachment_id}")
+async def download_attachment(
+    note_id: int, attachment_id: int, db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Download an attachment. Supports single byte ranges, If-Range and
+    If-None-Match; the ETag is the SHA-256 of the content.
+    """
+    attachment = await attachments_service.get_attachment_async(db, note_id, attachment_id)
+    path = attachments_service.blob_path(attachment["sha256"])
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Attachment content not found")
+    return BlobResponse(
+        path,
+        size=attachment["size"],
+        etag=attachment["sha256"],
+        media_type=attachment["content_type"],
+        filename=attachment["filename"],
+    )
+
+
+@router.delete("/{note_id}/attachments/{attachment_id}", status_code=204)
+async def delete_attachment(
+    note_id: int, attachment_id: int, db: AsyncSession = Depends(get_async_db)
+):
+    """Remove an attachment from a note"""
+    await attachments_service.delete_attachment_async(db, note_id, attachment_id)
+    return None
@@ -0,0 +1,111 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.middleware import admission
+from app.services import ai as ai_service
+from app.services import duplicates, precompute, similarity
+from app.services import summaries as summaries_service
+from app.utils.metrics import registry
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+router = APIRouter(tags=["metrics"])
+
+
+# State the services already keep is read at scrape time rather than
+# mirrored into metrics on every update
+registry.callback(
+    "summary_cache_entries", "Summaries held in the in-memory LRU cache",
+    lambda: len(summaries_service.lru),
+)
+registry.callback(
+    "summary_cache_lookups", "Summary cache lookups by result",
+    lambda: {
+        ("hit",): summaries_service.lru.hits,
+        ("miss",): summaries_service.lru.misses,
+    },
+    ("result",), kind="counter",
+)
+registry.callback(
+    "summary_single_flight_coalesced",
+    "Summary requests served by joining an identical in-flight request",
+    lambda: summaries_service.flight.coalesced, kind="counter",
+)
+registry.callback(
+    "summary_fallbacks", "Summaries served from a fallback by source",
+    lambda: {(source,): count for source, count in summaries_service.fallback_stats.items()},
+    ("source",), kind="counter",
+)
+registry.callback(
+    "gemini_in_flight", "Gemini calls holding a concurrency slot",
+    lambda: ai_service.limiter.in_flight,
+)
+registry.callback(
+    "gemini_waiting", "Gemini calls queued for a concurrency slot",
+    lambda: ai_service.limiter.waiting,
+)
+registry.callback(
+    "gemini_rejected", "Gemini calls refused for lack of a slot or by the open circuit",
+    lambda: {
+        ("busy",): ai_service.limiter.rejected,
+        ("unavailable",): ai_service.breaker.rejected,
+    },
+    ("reason",), kind="counter",
+)
+registry.callback(
+    "gemini_circuit_open", "1 while the Gemini circuit breaker is not closed",
+    lambda: 0 if ai_service.breaker.state == "closed" else 1,
+)
+registry.callback(
+    "gemini_attempts", "Extra Gemini attempts by kind",
+    lambda: {
+        ("retry",): ai_service.attempt_stats["retries"],
+        ("hedge",): ai_service.attempt_stats["hedged"],
+    },
+    ("kind",), kind="counter",
+)
+registry.callback(
+    "precompute_queue_depth", "Notes waiting for a background summary",
+    lambda: precompute.precomputer.stats()["depth"],
+)
+registry.callback(
+    "precompute_in_progress", "Background summaries being generated",
+    lambda: precompute.precomputer.in_progress,
+)
+registry.callback(
+    "precompute_dropped", "Background summaries dropped because the queue was full",
+    lambda: precompute.precomputer.dropped, kind="counter",
+)
+registry.callback(
+    "precompute_lag_seconds", "Seconds between the last write and its summary",
+    lambda: precompute.precomputer.last_lag,
+)
+registry.callback(
+    "admission_in_flight", "Requests holding an admission slot by route class",
+    lambda: {(c.name,): c.in_flight for c in admission.controller.classes},
+    ("route_class",),
+)
+registry.callback(
+    "admission_waiting", "Requests queued for an admission slot by route class",
+    lambda: {(c.name,): c.waiting for c in admission.controller.classes},
+    ("route_class",),
+)
+registry.callback(
+    "admission_decisions", "Admission decisions by route class",
+    lambda: dict(admission.controller.decisions),
+    ("route_class", "decision"), kind="counter",
+)
+registry.callback(
+    "similarity_index_notes", "Notes in the TF-IDF similarity index",
+    lambda: len(similarity.index),
+)
+registry.callback(
+    "duplicates_index_notes", "Notes in the MinHash duplicates index",
+    lambda: len(duplicates.index),
+)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Expose metrics in the Prometheus text format"""
+    return PlainTextResponse(registry.render(), media_type=CONTENT_TYPE)
@@ -1,11 +1,23 @@
 from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import ORJSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
+from datetime import datetime
+from typing import List, Literal, Optional
 
 from app.database import get_async_db, get_db
-from app.schemas.notes import NoteCreate, NoteUpdate, NoteResponse, NoteWithHistory
+from app.schemas.notes import (
+    MAX_TAGS,
+    NoteCreate,
+    NoteUpdate,
+    NoteResponse,
+    NoteWithHistory,
+    RelatedNote,
+    DuplicateNote,
+)
 from app.services import notes as notes_service
+from app.services.duplicates import DEFAULT_THRESHOLD
+from app.utils.serialization import json_response
 
 router = APIRouter(prefix="/notes", tags=["notes"])
 
@@ -13,23 +25,61 @@ router = APIRouter(prefix="/notes", tags=["notes"])
 @router.post("/", response_model=NoteResponse, status_code=201)
 async def create_note(note: NoteCreate, db: AsyncSession = Depends(get_async_db)):
     """Create a new note"""
-    return await notes_service.create_note_async(db, note)
+    db_note = await notes_service.create_note_async(db, note)
+    return json_response(NoteResponse, db_note, status_code=201)
 
 
 @router.get("/{note_id}", response_model=NoteResponse)
 async def get_note(note_id: int, db: AsyncSession = Depends(get_async_db)):
     """Get a note by ID"""
-    return await notes_service.get_note_async(db, note_id)
+    note = await notes_service.get_note_async(db, note_id)
+    return json_response(NoteResponse, note)
 
 
 @router.get("/", response_model=List[NoteResponse])
 async def get_all_notes(
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=100),
+    tag: List[str] = Query([]),
+    match: Literal["all", "any"] = Query("all"),
+    sort: Literal["id", "updated_at", "created_at", "title"] = Query("id"),
+    order: Literal["asc", "desc"] = Query("asc"),
+    updated_since: Optional[datetime] = Query(None),
+    created_before: Optional[datetime] = Query(None),
+    content: bool = Query(True),
+    cursor: Optional[str] = Query(None),
     db: AsyncSession = Depends(get_async_db),
 ):
-    """Get all notes with pagination"""
-    return await notes_service.get_all_notes_async(db, skip, limit)
+    """
+    Get all notes with pagination, sorted by `sort` in `order`, optionally
+    only those with all (or any) of the given tags or in a time range.
+    `content=false` leaves out the note content, which the listing then
+    reads from an index alone. Unless it is the last page, the response
+    carries an X-Next-Cursor header; pass it as `cursor`, with the same
+    sort, to get the next one.
+    """
+    tag_names = sorted({name.strip().lower() for name in tag if name.strip()})
+    if len(tag_names) > MAX_TAGS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_TAGS} tags")
+
+    # Rows come straight from typed columns, so they are rendered as-is
+    rows, next_cursor = await notes_service.list_note_rows_async(
+        db,
+        skip,
+        limit,
+        tag_names,
+        match_all=match == "all",
+        sort=sort,
+        descending=order == "desc",
+        cursor=cursor,
+        updated_since=updated_since,
+        created_before=created_before,
+        with_content=content,
+    )
+    response = ORJSONResponse(rows)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
 
 
 @router.put("/{note_id}", response_model=NoteResponse)
@@ -37,7 +87,8 @@ async def update_note(
     note_id: int, note_update: NoteUpdate, db: AsyncSession = Depends(get_async_db)
 ):
     """Update a note"""
-    return await notes_service.update_note_async(db, note_id, note_update)
+    note = await notes_service.update_note_async(db, note_id, note_update)
+    return json_response(NoteResponse, note)
 
 
 @router.delete("/{note_id}", status_code=204)
@@ -63,4 +114,24 @@ async def get_note_with_history(note_id: int, db: AsyncSession = Depends(get_asy
         "history": history,
     }
 
-    return note_dict
+    return json_response(NoteWithHistory, note_dict)
+
+
+@router.get("/{note_id}/related", response_model=List[RelatedNote])
+async def get_related_notes(
+    note_id: int,
+    k: int = Query(10, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Get the notes most similar to a note"""
+    return await notes_service.get_related_notes_async(db, note_id, k)
+
+
+@router.get("/{note_id}/duplicates", response_model=List[DuplicateNote])
+async def get_duplicate_notes(
+    note_id: int,
+    threshold: float = Query(DEFAULT_THRESHOLD, ge=0.0, le=1.0),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Get the near duplicates of a note"""
+    return await notes_service.get_duplicate_notes_async(db, note_id, threshold)
@@ -0,0 +1,88 @@
+import os
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import FileResponse
+from starlette.concurrency import run_in_threadpool
+
+from app.utils import profiling
+
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Only callers presenting PROFILING_TOKEN may profile"""
+    if not profiling.token_valid(x_admin_token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+router = APIRouter(
+    prefix="/profiling", tags=["profiling"], dependencies=[Depends(require_admin)]
+)
+
+# The process-wide sampling run, if one was started
+session = {"sampler": None, "file": None}
+
+
+def _status() -> dict:
+    sampler = session["sampler"]
+    return {
+        "running": sampler is not None and sampler.running,
+        "file": session["file"],
+        "samples": sum(sampler.samples.values()) if sampler is not None else 0,
+    }
+
+
+@router.post("/sample", status_code=202)
+async def start_sampling(
+    seconds: float = Query(10, gt=0, le=profiling.PROFILE_MAX_SECONDS),
+    interval: float = Query(profiling.PROFILE_SAMPLE_INTERVAL, ge=0.001, le=1),
+):
+    """Sample the stacks of every thread for `seconds`, then write a speedscope profile"""
+    sampler = session["sampler"]
+    if sampler is not None and sampler.running:
+        raise HTTPException(status_code=409, detail="Sampling is already running")
+
+    path = profiling.profile_path("process", ".speedscope.json")
+    sampler = profiling.StackSampler(interval=interval, duration=seconds)
+    sampler.on_finish = lambda: sampler.dump_speedscope(path, "process")
+    session.update(sampler=sampler, file=os.path.basename(path))
+    sampler.start()
+    return {**_status(), "seconds": seconds, "interval": interval}
+
+
+@router.get("/sample")
+async def get_sampling():
+    """Get the state of the current or last sampling run"""
+    return _status()
+
+
+@router.delete("/sample")
+async def stop_sampling():
+    """Stop sampling early and write the profile collected so far"""
+    sampler = session["sampler"]
+    if sampler is None or not sampler.running:
+        raise HTTPException(status_code=404, detail="Sampling is not running")
+    await run_in_threadpool(sampler.stop)
+    return _status()
+
+
+@router.get("/profiles")
+async def list_profiles():
+    """List the profiles written so far, newest first"""
+    if not os.path.isdir(profiling.PROFILE_DIR):
+        return []
+    entries = [
+        entry for entry in os.scandir(profiling.PROFILE_DIR) if entry.is_file()
+    ]
+    entries.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)
+    return [
+        {"file": entry.name, "bytes": entry.stat().st_size} for entry in entries
+    ]
+
+
+@router.get("/profiles/{name}")
+async def download_profile(name: str):
+    """Download a profile by file name"""
+    path = os.path.join(profiling.PROFILE_DIR, os.path.basename(name))
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, filename=os.path.basename(path))
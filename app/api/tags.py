@@ -0,0 +1,19 @@
+from typing import List
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import get_async_db
+from app.schemas.notes import TagCount
+from app.services import tags as tags_service
+
+router = APIRouter(prefix="/tags", tags=["tags"])
+
+
+@router.get("", response_model=List[TagCount])
+async def get_tags(
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Get the tags in use with their note counts, most used first"""
+    return await tags_service.get_tag_counts_async(db, limit)
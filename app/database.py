@@ -1,34 +1,241 @@
-from sqlalchemy import create_engine
+import logging
+import time
+from collections import deque
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 import os
 from dotenv import load_dotenv
 
+from app import sharding
+from app.utils import query_stats, tracing
+from app.utils.metrics import registry
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Use SQLite for simplicity, but can be changed to any other database
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./notes.db")
 # Convert the URL to async format for SQLAlchemy 2.0
 ASYNC_DATABASE_URL = DATABASE_URL.replace("sqlite:///", "sqlite+aiosqlite:///")
 
+# Log every SQL statement; set to 0 for load tests
+SQL_ECHO = os.getenv("SQL_ECHO", "1") == "1"
+
+# Number of SQLite files notes are spread across by note id. With 1 every
+# table lives in DATABASE_URL; otherwise it is shard 0 and also holds the
+# shard map, and shard 2 of notes.db is notes.shard2.db
+DATABASE_SHARDS = int(os.getenv("DATABASE_SHARDS", "1"))
+
 # Create async engine
-async_engine = create_async_engine(ASYNC_DATABASE_URL, echo=True, future=True)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, echo=SQL_ECHO, future=True)
 
 # Create sync engine for creating tables and testing
 engine = create_engine(
     DATABASE_URL, connect_args={"check_same_thread": False}, future=True
 )
 
+# Engines of every shard; shard 0 uses the engines above
+shard_engines = [engine] + [
+    create_engine(
+        sharding.shard_url(DATABASE_URL, shard),
+        connect_args={"check_same_thread": False},
+        future=True,
+    )
+    for shard in range(1, DATABASE_SHARDS)
+]
+async_shard_engines = [async_engine] + [
+    create_async_engine(
+        sharding.shard_url(ASYNC_DATABASE_URL, shard), echo=SQL_ECHO, future=True
+    )
+    for shard in range(1, DATABASE_SHARDS)
+]
+
 # Session factories
-AsyncSessionLocal = sessionmaker(
-    bind=async_engine, class_=AsyncSession, expire_on_commit=False
+if DATABASE_SHARDS > 1:
+    shard_catalog = sharding.ShardCatalog(shard_engines)
+    AsyncSessionLocal = sessionmaker(
+        class_=AsyncSession,
+        sync_session_class=sharding.ShardedNotesSession,
+        shards={i: e.sync_engine for i, e in enumerate(async_shard_engines)},
+        catalog=shard_catalog,
+        expire_on_commit=False,
+    )
+    SessionLocal = sessionmaker(
+        class_=sharding.ShardedNotesSession,
+        shards=dict(enumerate(shard_engines)),
+        catalog=shard_catalog,
+        autocommit=False,
+        autoflush=False,
+    )
+else:
+    shard_catalog = None
+    AsyncSessionLocal = sessionmaker(
+        bind=async_engine, class_=AsyncSession, expire_on_commit=False
+    )
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# SQL metrics, fed by engine events
+DB_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0
+)
+db_statements = registry.counter(
+    "db_statements", "SQL statements executed", ("engine", "operation")
+)
+db_statement_duration = registry.histogram(
+    "db_statement_duration_seconds",
+    "Time spent executing SQL statements",
+    ("engine", "operation"),
+    buckets=DB_BUCKETS,
+)
+db_errors = registry.counter("db_errors", "SQL statements that failed", ("engine",))
+
+_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE"}
+
+
+def _operation(statement: str) -> str:
+    # Every tracked keyword is six letters long
+    word = statement.lstrip()[:6].upper()
+    return word if word in _OPERATIONS else "OTHER"
+
+
+def instrument_engine(sync_engine, name: str) -> None:
+    """Count and time the statements run by an engine under `name`"""
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        operation = _operation(statement)
+        db_statements.labels(name, operation).inc()
+        db_statement_duration.labels(name, operation).observe(elapsed)
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("query_start"):
+            conn.info["query_start"].pop()
+        db_errors.labels(name).inc()
+
+
+instrument_engine(engine, "sync")
+instrument_engine(async_engine.sync_engine, "async")
+for shard in range(1, DATABASE_SHARDS):
+    instrument_engine(shard_engines[shard], f"sync.shard{shard}")
+    instrument_engine(async_shard_engines[shard].sync_engine, f"async.shard{shard}")
+
+# Statements slower than this many milliseconds are logged with their query
+# plan; 0 disables the slow-query log
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+
+# Most recent slow statements kept in memory
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "100"))
+
+slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+db_slow_statements = registry.counter(
+    "db_slow_statements", "SQL statements slower than SLOW_QUERY_MS"
 )
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def _row_count(cursor) -> int:
+    # Drivers that buffer results, like aiosqlite, know the rows a SELECT
+    # returned; otherwise only rows changed by writes are known
+    rows = getattr(cursor, "_rows", None)
+    if cursor.description is not None and isinstance(rows, list):
+        return len(rows)
+    return max(cursor.rowcount, 0)
+
+
+def _query_plan(conn, statement: str, parameters) -> list:
+    """EXPLAIN QUERY PLAN of a statement, or [] where it is unavailable"""
+    if conn.dialect.name != "sqlite":
+        return []
+    try:
+        # A raw cursor, so the EXPLAIN itself is neither counted nor timed
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+            return [row[-1] for row in cursor.fetchall()]
+        finally:
+            cursor.close()
+    except Exception:
+        return []
+
+
+def log_slow_query(conn, statement: str, parameters, seconds: float, many: bool):
+    plan = [] if many else _query_plan(conn, statement, parameters)
+    slow_queries.append(
+        {"statement": statement, "ms": round(seconds * 1000, 3), "plan": plan}
+    )
+    db_slow_statements.inc()
+    logger.warning(
+        "Slow query (%.1f ms): %s\nPlan: %s",
+        seconds * 1000,
+        statement,
+        "; ".join(plan) or "n/a",
+    )
+
+
+# Longest statement text attached to a tracing span
+TRACE_STATEMENT_CHARS = 500
+
+
+# Per-request accounting, tracing spans and the slow-query log cover every
+# engine, including the ones tests create
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_query(conn, cursor, statement, parameters, context, many):
+    conn.info.setdefault("query_stats_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _end_query(conn, cursor, statement, parameters, context, many):
+    start = conn.info["query_stats_start"].pop()
+    end = time.perf_counter()
+    seconds = end - start
+    rows = _row_count(cursor)
+    query_stats.record(statement, seconds, rows)
+    tracing.record_span(
+        f"db.{_operation(statement).lower()}",
+        "db",
+        start,
+        end,
+        **{"db.statement": statement[:TRACE_STATEMENT_CHARS], "db.rows": rows},
+    )
+    if SLOW_QUERY_MS > 0 and seconds * 1000 >= SLOW_QUERY_MS:
+        log_slow_query(conn, statement, parameters, seconds, many)
+
+
+@event.listens_for(Engine, "handle_error")
+def _query_failed(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_stats_start"):
+        conn.info["query_stats_start"].pop()
 
 Base = declarative_base()
 
+
+def create_schema(bind=None) -> None:
+    """
+    Create missing tables, and the missing indexes of existing tables,
+    which create_all only adds together with their table. Without `bind`
+    this covers every shard and sets up the shard map.
+    """
+    for target in [bind] if bind is not None else shard_engines:
+        Base.metadata.create_all(bind=target)
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(bind=target, checkfirst=True)
+    if bind is None and shard_catalog is not None:
+        shard_catalog.shard_map
+
 # Dependency to get async DB session
 
 
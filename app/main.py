@@ -1,19 +1,87 @@
+import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 
-from app.database import engine, Base
-from app.api import notes, ai, analytics
+from app import warmup
+from app.database import SessionLocal, create_schema
+from app.api import notes, ai, analytics, attachments, metrics, profiling, tags
+from app.middleware import admission
+from app.middleware.metrics import MetricsMiddleware
+from app.middleware.profiling import ProfilingMiddleware
+from app.middleware.query_stats import QueryStatsMiddleware
+from app.middleware.tracing import TracingMiddleware
+from app.services import attachments as attachments_service
+from app.services import duplicates, index_sync, precompute, similarity
+from app.utils import profiling as profiling_settings
+from app.utils import tracing
+
+# Debug mode adds per-request SQL accounting headers to responses
+DEBUG = os.getenv("DEBUG", "0") == "1"
+
+# Create database tables, unless app.server already did before starting
+# its workers
+if os.getenv("SCHEMA_CREATED") != "1":
+    create_schema()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the in-memory indexes before serving, then keep them up to date
+    # with the writes of other workers
+    db = SessionLocal()
+    try:
+        index_sync.follower.mark(db)
+        similarity.load_index(db)
+        duplicates.load_index(db)
+    finally:
+        db.close()
+    await index_sync.follower.start()
+
+    if precompute.SUMMARY_PRECOMPUTE:
+        await precompute.precomputer.start()
+
+    await attachments_service.collector.start()
+
+    if warmup.WARMUP:
+        await warmup.warm_up()
+
+    yield
+
+    await index_sync.follower.stop()
+    await attachments_service.collector.stop()
+    await precompute.precomputer.stop()
+    similarity.save_index()
+    if tracing.exporter is not None:
+        tracing.exporter.flush()
 
-# Create database tables
-Base.metadata.create_all(bind=engine)
 
 app = FastAPI(
     title="AI-Enhanced Notes Management System",
     description="A RESTful API for managing notes with AI capabilities",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
+if DEBUG:
+    app.add_middleware(QueryStatsMiddleware)
+
+# Profiling is opt-in; when off, neither the middleware nor its routes exist
+if profiling_settings.enabled():
+    app.add_middleware(ProfilingMiddleware)
+
+# Admission control; added before CORS so CORS headers also reach rejections
+app.add_middleware(admission.AdmissionMiddleware)
+
+# Tracing is opt-in; outside admission control so queueing counts too
+if tracing.TRACING:
+    app.add_middleware(TracingMiddleware)
+
+# Request metrics; outside admission control so rejections are counted too
+app.add_middleware(MetricsMiddleware)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -27,6 +95,11 @@ app.add_middleware(
 app.include_router(notes.router)
 app.include_router(ai.router)
 app.include_router(analytics.router)
+app.include_router(tags.router)
+app.include_router(attachments.router)
+app.include_router(metrics.router)
+if profiling_settings.enabled():
+    app.include_router(profiling.router)
 
 
 @app.get("/", tags=["root"])
@@ -34,5 +107,11 @@ async def root():
     return {"message": "Welcome to the AI-Enhanced Notes Management System"}
 
 
+@app.get("/admission/stats", tags=["root"])
+async def admission_stats():
+    """Get in-flight, queue and decision counters of admission control"""
+    return admission.controller.stats()
+
+
 if __name__ == "__main__":
     uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
@@ -0,0 +1,303 @@
+import asyncio
+import math
+import os
+import re
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.utils.cache import LRUCache
+from app.utils.workers import WEB_WORKERS, per_worker
+
+# The limits below are for the whole server; each of its WEB_WORKERS
+# processes admits its share
+
+# Requests handled at once per route class, and requests allowed to wait
+# for a free slot beyond that
+ADMISSION_CRUD_CONCURRENCY = per_worker(
+    int(os.getenv("ADMISSION_CRUD_CONCURRENCY", "64"))
+)
+ADMISSION_CRUD_QUEUE = per_worker(int(os.getenv("ADMISSION_CRUD_QUEUE", "256")))
+ADMISSION_ANALYTICS_CONCURRENCY = per_worker(
+    int(os.getenv("ADMISSION_ANALYTICS_CONCURRENCY", "4"))
+)
+ADMISSION_ANALYTICS_QUEUE = per_worker(int(os.getenv("ADMISSION_ANALYTICS_QUEUE", "8")))
+ADMISSION_AI_CONCURRENCY = per_worker(int(os.getenv("ADMISSION_AI_CONCURRENCY", "16")))
+ADMISSION_AI_QUEUE = per_worker(int(os.getenv("ADMISSION_AI_QUEUE", "32")))
+# Attachment uploads can take as long as the client needs to send 100 MiB,
+# so they are kept out of the CRUD slots
+ADMISSION_UPLOAD_CONCURRENCY = per_worker(
+    int(os.getenv("ADMISSION_UPLOAD_CONCURRENCY", "8"))
+)
+ADMISSION_UPLOAD_QUEUE = per_worker(int(os.getenv("ADMISSION_UPLOAD_QUEUE", "16")))
+
+# Seconds a request may wait for a slot before it is rejected
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "2"))
+
+# Requests in flight across all classes, 0 for the sum of the class
+# limits; analytics, AI and upload requests are shed once the total
+# reaches ADMISSION_LOW_PRIORITY_SHARE of it, keeping the rest for CRUD
+_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "0"))
+ADMISSION_MAX_IN_FLIGHT = per_worker(_MAX_IN_FLIGHT) if _MAX_IN_FLIGHT > 0 else 0
+ADMISSION_LOW_PRIORITY_SHARE = float(
+    os.getenv("ADMISSION_LOW_PRIORITY_SHARE", "0.75")
+)
+
+# Per-client token bucket: sustained requests per second and burst size.
+# A rate of 0 disables rate limiting.
+ADMISSION_CLIENT_RATE = float(os.getenv("ADMISSION_CLIENT_RATE", "0")) / WEB_WORKERS
+ADMISSION_CLIENT_BURST = per_worker(int(os.getenv("ADMISSION_CLIENT_BURST", "40")))
+
+# Seconds clients are told to wait after a 503
+ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "1"))
+
+HIGH, LOW = "high", "low"
+
+
+class RouteClass:
+    def __init__(
+        self,
+        name: str,
+        prefix: Union[str, Tuple[str, ...]],
+        limit: int,
+        queue: int,
+        priority: str,
+        methods: Optional[Tuple[str, ...]] = None,
+        pattern: Optional[str] = None,
+    ):
+        self.name = name
+        # Routes under any of these prefixes share the class's slots
+        self.prefixes = (prefix,) if isinstance(prefix, str) else tuple(prefix)
+        # Narrow the class to some methods, or to paths matching a pattern
+        self.methods = methods
+        self.pattern = re.compile(pattern) if pattern is not None else None
+        self.limit = limit
+        self.queue = queue
+        self.priority = priority
+        self.in_flight = 0
+        self.waiting = 0
+        self._loop = None
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    def slots(self) -> asyncio.Semaphore:
+        # Bound to the running loop, as with the AI concurrency limiter
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._slots = asyncio.Semaphore(self.limit)
+        return self._slots
+
+    def matches(self, path: str, method: Optional[str] = None) -> bool:
+        if self.methods is not None and method not in self.methods:
+            return False
+        if self.pattern is not None and not self.pattern.fullmatch(path):
+            return False
+        return any(
+            path == prefix or path.startswith(prefix + "/") for prefix in self.prefixes
+        )
+
+
+class Rejected(Exception):
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def default_classes() -> List[RouteClass]:
+    # The first class that matches a request takes it
+    return [
+        RouteClass(
+            "upload",
+            "/notes",
+            ADMISSION_UPLOAD_CONCURRENCY,
+            ADMISSION_UPLOAD_QUEUE,
+            LOW,
+            methods=("POST",),
+            pattern=r"/notes/[^/]+/attachments/?",
+        ),
+        RouteClass(
+            "crud",
+            ("/notes", "/tags"),
+            ADMISSION_CRUD_CONCURRENCY,
+            ADMISSION_CRUD_QUEUE,
+            HIGH,
+        ),
+        RouteClass(
+            "analytics",
+            "/analytics",
+            ADMISSION_ANALYTICS_CONCURRENCY,
+            ADMISSION_ANALYTICS_QUEUE,
+            LOW,
+        ),
+        RouteClass("ai", "/ai", ADMISSION_AI_CONCURRENCY, ADMISSION_AI_QUEUE, LOW),
+    ]
+
+
+class AdmissionController:
+    """
+    Decides whether a request runs now, waits for a slot or is rejected.
+
+    Each route class has its own concurrency limit and bounded wait queue,
+    so slow analytics, AI or upload requests cannot starve CRUD. On top of
+    that, low-priority classes are shed once the process as a whole is
+    busy, and each client draws from a token bucket. Every decision is
+    counted.
+    """
+
+    def __init__(
+        self,
+        classes: Optional[List[RouteClass]] = None,
+        max_in_flight: int = ADMISSION_MAX_IN_FLIGHT,
+        low_priority_share: float = ADMISSION_LOW_PRIORITY_SHARE,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+        client_rate: float = ADMISSION_CLIENT_RATE,
+        client_burst: int = ADMISSION_CLIENT_BURST,
+        retry_after: int = ADMISSION_RETRY_AFTER,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.classes = classes if classes is not None else default_classes()
+        # The sum of the class limits unless set. In flight requests never
+        # add up to more, so a larger total would never shed anything
+        self.max_in_flight = max_in_flight or sum(c.limit for c in self.classes)
+        self.low_priority_limit = int(self.max_in_flight * low_priority_share)
+        self.queue_timeout = queue_timeout
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.retry_after = retry_after
+        self._clock = clock
+        # client -> [tokens, time of last refill]; least recent clients go first
+        self._buckets = LRUCache(maxsize=10000)
+        self.decisions: Dict[Tuple[str, str], int] = defaultdict(int)
+
+    @property
+    def in_flight(self) -> int:
+        return sum(route_class.in_flight for route_class in self.classes)
+
+    def classify(self, path: str, method: Optional[str] = None) -> Optional[RouteClass]:
+        for route_class in self.classes:
+            if route_class.matches(path, method):
+                return route_class
+        return None
+
+    def _take_token(self, client: str) -> Optional[int]:
+        """Spend one token; if none is left, the seconds until one is"""
+        now = self._clock()
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = [float(self.client_burst), now]
+            self._buckets.set(client, bucket)
+        refill = (now - bucket[1]) * self.client_rate
+        tokens = min(self.client_burst, bucket[0] + refill)
+        bucket[1] = now
+        if tokens < 1:
+            bucket[0] = tokens
+            return max(1, math.ceil((1 - tokens) / self.client_rate))
+        bucket[0] = tokens - 1
+        return None
+
+    async def acquire(self, route_class: RouteClass, client: Optional[str]) -> None:
+        """Wait for a slot in route_class, raising Rejected if none is granted"""
+        name = route_class.name
+        if self.client_rate > 0 and client is not None:
+            wait = self._take_token(client)
+            if wait is not None:
+                self.decisions[(name, "rate_limited")] += 1
+                raise Rejected(429, "Too many requests", wait)
+
+        total = self.in_flight
+        if total >= self.max_in_flight or (
+            route_class.priority == LOW and total >= self.low_priority_limit
+        ):
+            self.decisions[(name, "shed")] += 1
+            raise Rejected(503, "Server is overloaded", self.retry_after)
+
+        slots = route_class.slots()
+        if not slots.locked():
+            # A free slot is taken without suspending
+            await slots.acquire()
+        elif route_class.waiting >= route_class.queue:
+            self.decisions[(name, "queue_full")] += 1
+            raise Rejected(503, "Server is overloaded", self.retry_after)
+        else:
+            self.decisions[(name, "queued")] += 1
+            route_class.waiting += 1
+            try:
+                await asyncio.wait_for(slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.decisions[(name, "queue_timeout")] += 1
+                raise Rejected(503, "Server is overloaded", self.retry_after)
+            finally:
+                route_class.waiting -= 1
+        route_class.in_flight += 1
+        self.decisions[(name, "admitted")] += 1
+
+    def release(self, route_class: RouteClass) -> None:
+        route_class.in_flight -= 1
+        route_class.slots().release()
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        stats = {}
+        for route_class in self.classes:
+            stats[route_class.name] = {
+                "limit": route_class.limit,
+                "queue": route_class.queue,
+                "in_flight": route_class.in_flight,
+                "waiting": route_class.waiting,
+                **{
+                    decision: count
+                    for (name, decision), count in self.decisions.items()
+                    if name == route_class.name
+                },
+            }
+        return stats
+
+
+controller = AdmissionController()
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware applying admission control to classified routes.
+
+    A slot is held until the response has been sent, streaming bodies
+    included. Rejections are answered immediately with 429 or 503 and a
+    Retry-After header.
+    """
+
+    def __init__(
+        self, app: ASGIApp, controller: Optional[AdmissionController] = None
+    ):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        admission = self.controller or controller
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route_class = admission.classify(scope["path"], scope["method"])
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        client = scope["client"][0] if scope.get("client") else None
+        try:
+            await admission.acquire(route_class, client)
+        except Rejected as e:
+            response = JSONResponse(
+                {"detail": e.reason},
+                status_code=e.status_code,
+                headers={"Retry-After": str(e.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission.release(route_class)
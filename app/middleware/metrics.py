@@ -0,0 +1,69 @@
+import time
+
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.utils.metrics import registry
+
+http_requests = registry.counter(
+    "http_requests",
+    "HTTP requests by method, route template and status code",
+    ("method", "route", "status"),
+)
+http_request_duration = registry.histogram(
+    "http_request_duration_seconds",
+    "Time from receiving an HTTP request to sending the end of its response",
+    ("method", "route"),
+)
+http_requests_in_flight = registry.gauge(
+    "http_requests_in_flight", "HTTP requests being handled"
+)
+
+# Label for requests no route matches, so unknown paths add no series
+UNMATCHED = "unmatched"
+
+
+def route_template(scope: Scope) -> str:
+    """The path template of the route handling a request, e.g. /notes/{note_id}"""
+    route = scope.get("route")
+    if route is not None:
+        return route.path
+    # Not routed, e.g. rejected by admission control: match it here
+    app = scope.get("app")
+    for candidate in getattr(app, "routes", ()):
+        match, _ = candidate.matches(scope)
+        if match == Match.FULL:
+            return candidate.path
+    return UNMATCHED
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request counts and latencies per route"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_flight.dec()
+            method, route = scope["method"], route_template(scope)
+            http_request_duration.labels(method, route).observe(
+                time.perf_counter() - start
+            )
+            http_requests.labels(method, route, str(status)).inc()
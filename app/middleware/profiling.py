@@ -0,0 +1,75 @@
+import cProfile
+import os
+import threading
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.utils import profiling
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling requests that ask for it.
+
+    A request with `X-Profile: 1` (or `pstats`) runs under cProfile, and
+    with `X-Profile: speedscope` under the stack sampler; either way it must
+    carry the admin token in `X-Admin-Token`. The profile is written to
+    PROFILE_DIR and its file name returned in `X-Profile-File`. Both
+    profilers see everything the event loop runs meanwhile, so concurrent
+    requests show up too. One request is profiled at a time; others run
+    unprofiled.
+
+    The middleware is only installed when profiling is enabled.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self._busy = threading.Lock()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        mode = headers.get("x-profile")
+        if (
+            mode is None
+            or not profiling.token_valid(headers.get("x-admin-token"))
+            or not self._busy.acquire(blocking=False)
+        ):
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self._profiled(mode.lower(), scope, receive, send)
+        finally:
+            self._busy.release()
+
+    async def _profiled(self, mode: str, scope: Scope, receive: Receive, send: Send):
+        label = f"{scope['method']} {scope['path']}"
+        speedscope = mode == "speedscope"
+        path = profiling.profile_path(label, ".speedscope.json" if speedscope else ".prof")
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message)["X-Profile-File"] = os.path.basename(path)
+            await send(message)
+
+        if speedscope:
+            sampler = profiling.StackSampler(thread_ids={threading.get_ident()})
+            sampler.start()
+            try:
+                await self.app(scope, receive, send_wrapper)
+            finally:
+                sampler.stop()
+                await run_in_threadpool(sampler.dump_speedscope, path, label)
+            return
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            profiler.disable()
+            await run_in_threadpool(profiler.dump_stats, path)
@@ -0,0 +1,34 @@
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.utils.query_stats import track_queries
+
+
+class QueryStatsMiddleware:
+    """
+    ASGI middleware reporting the SQL a request ran in response headers.
+
+    X-DB-Queries, X-DB-Time (milliseconds) and X-DB-Rows cover the
+    statements run until the response headers are sent, so the body of a
+    streaming response is not included.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        with track_queries() as stats:
+
+            async def send_wrapper(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    headers = MutableHeaders(scope=message)
+                    headers["X-DB-Queries"] = str(stats.queries)
+                    headers["X-DB-Time"] = f"{stats.seconds * 1000:.3f}"
+                    headers["X-DB-Rows"] = str(stats.rows)
+                await send(message)
+
+            await self.app(scope, receive, send_wrapper)
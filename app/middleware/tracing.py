@@ -0,0 +1,59 @@
+import time
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.middleware.metrics import route_template
+from app.utils import tracing
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware running each request in a trace.
+
+    The request is the root span, named after its route. Every response
+    gets a Server-Timing header with the time spent so far in total and
+    per span kind (service, db, ai), and sampled ones an X-Trace-Id header
+    naming their exported trace. Spans finished while a streaming body is
+    sent are exported but not in the header.
+
+    The middleware is only installed when tracing is enabled.
+    """
+
+    def __init__(self, app: ASGIApp, exporter: Optional[tracing.TraceExporter] = None):
+        self.app = app
+        self.exporter = exporter or tracing.exporter
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = tracing.start_trace(Headers(scope=scope).get("traceparent"))
+        start = time.perf_counter()
+
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                root.attributes["http.status_code"] = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers["Server-Timing"] = tracing.server_timing(
+                    trace, time.perf_counter() - start
+                )
+                if trace.sampled:
+                    headers["X-Trace-Id"] = trace.trace_id_hex
+            await send(message)
+
+        try:
+            with tracing.activate(trace):
+                with tracing.span(scope["method"], "server") as root:
+                    root.attributes["http.method"] = scope["method"]
+                    try:
+                        await self.app(scope, receive, send_wrapper)
+                    finally:
+                        route = route_template(scope)
+                        root.name = f"{scope['method']} {route}"
+                        root.attributes["http.route"] = route
+        finally:
+            if trace.sampled and self.exporter is not None:
+                self.exporter.export(trace)
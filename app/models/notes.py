@@ -1,5 +1,15 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
-from sqlalchemy.orm import relationship
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Integer,
+    String,
+    DateTime,
+    ForeignKey,
+    Index,
+    LargeBinary,
+    Text,
+)
+from sqlalchemy.orm import query_expression, relationship
 from sqlalchemy.sql import func
 from app.database import Base
 
@@ -20,6 +30,20 @@ class Note(Base):
         "NoteHistory", back_populates="note", cascade="all, delete-orphan"
     )
 
+    # Comma-separated tag names, loaded in the same query as the note with
+    # with_expression(Note.tags, tags.tag_names); None when not loaded
+    tags = query_expression()
+
+    # One index per sort order of note listings. Each leads with its sort
+    # column and the id that breaks ties, so pages and cursors are ranges of
+    # the index, and holds the other listed columns, so listings without
+    # content are answered from the index alone
+    __table_args__ = (
+        Index("ix_notes_updated_at", "updated_at", "id", "created_at", "title"),
+        Index("ix_notes_created_at", "created_at", "id", "updated_at", "title"),
+        Index("ix_notes_title", "title", "id", "created_at", "updated_at"),
+    )
+
 
 class NoteHistory(Base):
     __tablename__ = "note_history"
@@ -32,3 +56,93 @@ class NoteHistory(Base):
 
     # Relationship with note
     note = relationship("Note", back_populates="history")
+
+
+class NoteSignature(Base):
+    __tablename__ = "note_signatures"
+
+    # MinHash signature of the note content, packed as little-endian uint32
+    note_id = Column(Integer, ForeignKey("notes.id"), primary_key=True)
+    signature = Column(LargeBinary, nullable=False)
+
+
+class NoteChange(Base):
+    __tablename__ = "note_changes"
+
+    # Log of writes to note content, read by every worker process to keep
+    # its in-memory indexes up to date. SQLite has one writer at a time and
+    # AUTOINCREMENT never reuses a number, so readers see seq grow without
+    # gaps until old entries are pruned
+    seq = Column(Integer, primary_key=True)
+    note_id = Column(Integer, nullable=False)
+    deleted = Column(Boolean, nullable=False, default=False)
+    # The process that made the change, which has already applied it
+    origin = Column(String(32), nullable=False)
+    created_at = Column(DateTime, server_default=func.now(), index=True)
+
+    __table_args__ = {"sqlite_autoincrement": True}
+
+
+class CachedSummary(Base):
+    __tablename__ = "note_summaries"
+
+    # SHA-256 of (title, content, model, prompt version), so editing a note
+    # or changing the model or prompt never hits a stale entry
+    key = Column(String(64), primary_key=True)
+    note_id = Column(Integer, ForeignKey("notes.id"), nullable=False, index=True)
+    model = Column(String(255), nullable=False)
+    summary = Column(Text, nullable=False)
+    created_at = Column(DateTime, server_default=func.now())
+
+
+class ChunkSummary(Base):
+    __tablename__ = "chunk_summaries"
+
+    # SHA-256 of (chunk text, model, prompt version); content-addressed, so
+    # notes that share a chunk also share its summary
+    key = Column(String(64), primary_key=True)
+    summary = Column(Text, nullable=False)
+    created_at = Column(DateTime, server_default=func.now())
+
+
+class Tag(Base):
+    __tablename__ = "tags"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String(64), nullable=False, unique=True)
+    # Notes with this tag, kept up to date as notes are tagged and deleted
+    note_count = Column(Integer, nullable=False, default=0)
+
+
+class NoteTag(Base):
+    __tablename__ = "note_tags"
+
+    # The primary key finds a note's tags and checks a note has a tag; the
+    # index below lists a tag's notes in id order
+    note_id = Column(Integer, ForeignKey("notes.id"), primary_key=True)
+    tag_id = Column(Integer, ForeignKey("tags.id"), primary_key=True)
+
+    __table_args__ = (Index("ix_note_tags_tag_id_note_id", "tag_id", "note_id"),)
+
+
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    # SHA-256 of the content, which is stored on disk under this name by
+    # app.services.attachments rather than in the database
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(Integer, nullable=False)
+    # Refreshed on every upload of the content, so garbage collection
+    # spares blobs whose reference is still being written
+    last_used_at = Column(DateTime, server_default=func.now(), nullable=False)
+
+
+class NoteAttachment(Base):
+    __tablename__ = "note_attachments"
+
+    id = Column(Integer, primary_key=True)
+    note_id = Column(Integer, ForeignKey("notes.id"), nullable=False, index=True)
+    sha256 = Column(String(64), ForeignKey("blobs.sha256"), nullable=False, index=True)
+    filename = Column(String(255), nullable=False)
+    content_type = Column(String(255), nullable=False)
+    created_at = Column(DateTime, server_default=func.now())
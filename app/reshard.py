@@ -0,0 +1,288 @@
+"""
+Rebalance or split the shards notes are spread across.
+
+    python -m app.reshard status
+    python -m app.reshard rebalance [--shards N]
+    python -m app.reshard split SHARD [--into NEW]
+
+Run it while the app is stopped: workers cache the shard map. Notes move
+a bucket at a time. They are copied to their new shard, the new map is
+saved, and then every shard drops the notes it no longer owns. A run that
+stops halfway can simply be run again. Start the app afterwards with
+DATABASE_SHARDS covering every shard in the map.
+"""
+import argparse
+import logging
+import os
+from collections import defaultdict
+from typing import Dict, List, Set
+
+from sqlalchemy import create_engine, func, select, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+
+from app import sharding
+from app.database import DATABASE_SHARDS, DATABASE_URL, create_schema
+from app.models.notes import (
+    Blob,
+    CachedSummary,
+    Note,
+    NoteAttachment,
+    NoteHistory,
+    NoteSignature,
+    NoteTag,
+    Tag,
+)
+
+logger = logging.getLogger(__name__)
+
+# Notes copied or deleted per transaction
+BATCH_SIZE = 500
+
+# Tables holding rows of a note, children first
+NOTE_TABLES = [
+    NoteTag.__table__,
+    NoteAttachment.__table__,
+    CachedSummary.__table__,
+    NoteSignature.__table__,
+    NoteHistory.__table__,
+]
+
+
+def shard_engines(shards: int, url: str = DATABASE_URL) -> List[Engine]:
+    """Engines of shards 0 to shards - 1, with their schema created"""
+    engines = [create_engine(sharding.shard_url(url, shard)) for shard in range(shards)]
+    for engine in engines:
+        create_schema(engine)
+    return engines
+
+
+def plan_rebalance(shard_map: sharding.ShardMap, shards: int) -> sharding.ShardMap:
+    """
+    A map spreading the buckets evenly over `shards` shards that moves as
+    few buckets as possible
+    """
+    if shards < 1:
+        raise ValueError("At least one shard is needed")
+    quota = [
+        sharding.SHARD_BUCKETS // shards + (1 if shard < sharding.SHARD_BUCKETS % shards else 0)
+        for shard in range(shards)
+    ]
+    buckets = list(shard_map.buckets)
+    owned: Dict[int, List[int]] = defaultdict(list)
+    for bucket, shard in enumerate(buckets):
+        owned[shard].append(bucket)
+    free = []
+    for shard, shard_buckets in owned.items():
+        keep = min(quota[shard] if shard < shards else 0, len(shard_buckets))
+        # Evenly spaced buckets stay, so the ids a shard keeps are spread
+        # over the whole id range rather than only its oldest notes
+        kept = {shard_buckets[i * len(shard_buckets) // keep] for i in range(keep)}
+        free.extend(bucket for bucket in shard_buckets if bucket not in kept)
+    missing = {
+        shard: quota[shard] - len(owned[shard])
+        for shard in range(shards)
+        if len(owned[shard]) < quota[shard]
+    }
+    # Freed buckets are dealt out in turn, for the same reason
+    while missing:
+        for shard in list(missing):
+            buckets[free.pop(0)] = shard
+            missing[shard] -= 1
+            if not missing[shard]:
+                del missing[shard]
+    return sharding.ShardMap(buckets)
+
+
+def plan_split(shard_map: sharding.ShardMap, shard: int, into: int) -> sharding.ShardMap:
+    """A map moving every other bucket of `shard` to `into`"""
+    buckets = list(shard_map.buckets)
+    for bucket in shard_map.buckets_of(shard)[1::2]:
+        buckets[bucket] = into
+    return sharding.ShardMap(buckets)
+
+
+def _note_ids(engine: Engine, keep) -> List[int]:
+    with engine.connect() as conn:
+        ids = conn.execute(select(Note.id).order_by(Note.id)).scalars()
+        return [note_id for note_id in ids if keep(note_id)]
+
+
+def _delete_notes(conn, note_ids: List[int]) -> None:
+    for table in NOTE_TABLES:
+        conn.execute(table.delete().where(table.c.note_id.in_(note_ids)))
+    conn.execute(Note.__table__.delete().where(Note.id.in_(note_ids)))
+
+
+def _copy_notes(source: Engine, target: Engine, note_ids: List[int]) -> None:
+    """Copy notes and their rows; rows left by an earlier attempt are replaced"""
+    with source.connect() as src:
+        rows = {
+            table.name: [dict(row) for row in src.execute(
+                table.select().where(table.c.note_id.in_(note_ids))
+            ).mappings()]
+            for table in NOTE_TABLES
+        }
+        notes = [dict(row) for row in src.execute(
+            Note.__table__.select().where(Note.id.in_(note_ids))
+        ).mappings()]
+        tag_links = src.execute(
+            select(NoteTag.note_id, Tag.name)
+            .join(Tag, Tag.id == NoteTag.tag_id)
+            .where(NoteTag.note_id.in_(note_ids))
+        ).all()
+        hashes = {row["sha256"] for row in rows[NoteAttachment.__tablename__]}
+        blobs = [dict(row) for row in src.execute(
+            Blob.__table__.select().where(Blob.sha256.in_(hashes))
+        ).mappings()]
+
+    with target.begin() as dst:
+        _delete_notes(dst, note_ids)
+        dst.execute(Note.__table__.insert(), notes)
+        history = rows[NoteHistory.__tablename__]
+        if history:
+            # History ids are per shard, so moved versions are numbered anew
+            for row in history:
+                del row["id"]
+            dst.execute(NoteHistory.__table__.insert(), history)
+        for table in (NoteSignature.__table__, NoteAttachment.__table__):
+            if rows[table.name]:
+                dst.execute(table.insert(), rows[table.name])
+        if rows[CachedSummary.__tablename__]:
+            dst.execute(
+                sqlite_insert(CachedSummary).on_conflict_do_nothing(),
+                rows[CachedSummary.__tablename__],
+            )
+        if blobs:
+            dst.execute(sqlite_insert(Blob).on_conflict_do_nothing(), blobs)
+        if tag_links:
+            names = {name for _, name in tag_links}
+            dst.execute(
+                sqlite_insert(Tag).on_conflict_do_nothing(index_elements=["name"]),
+                [{"name": name, "note_count": 0} for name in sorted(names)],
+            )
+            tag_ids = dict(dst.execute(select(Tag.name, Tag.id).where(Tag.name.in_(names))).all())
+            dst.execute(
+                NoteTag.__table__.insert(),
+                [{"note_id": note_id, "tag_id": tag_ids[name]} for note_id, name in tag_links],
+            )
+
+
+def recount_tags(engine: Engine) -> None:
+    """Recompute the note counts of a shard's tags"""
+    with engine.begin() as conn:
+        conn.execute(
+            update(Tag).values(
+                note_count=select(func.count())
+                .where(NoteTag.tag_id == Tag.id)
+                .scalar_subquery()
+            )
+        )
+
+
+def remove_strays(engines: List[Engine], shard_map: sharding.ShardMap) -> Dict[int, int]:
+    """Delete from every shard the notes its buckets do not include"""
+    removed = {}
+    for shard, engine in enumerate(engines):
+        strays = _note_ids(engine, lambda note_id: shard_map.shard_of(note_id) != shard)
+        for start in range(0, len(strays), BATCH_SIZE):
+            with engine.begin() as conn:
+                _delete_notes(conn, strays[start:start + BATCH_SIZE])
+        if strays:
+            recount_tags(engine)
+        removed[shard] = len(strays)
+    return removed
+
+
+def apply(engines: List[Engine], current: sharding.ShardMap, planned: sharding.ShardMap) -> Dict[str, int]:
+    """Move notes from the shards of `current` to those of `planned`"""
+    moves: Dict[int, Set[int]] = defaultdict(set)
+    for bucket, (source, target) in enumerate(zip(current.buckets, planned.buckets)):
+        if source != target:
+            moves[source].add(bucket)
+
+    copied = 0
+    for source, buckets in moves.items():
+        note_ids = _note_ids(
+            engines[source], lambda note_id: sharding.bucket_of(note_id) in buckets
+        )
+        by_target: Dict[int, List[int]] = defaultdict(list)
+        for note_id in note_ids:
+            by_target[planned.shard_of(note_id)].append(note_id)
+        for target, ids in by_target.items():
+            for start in range(0, len(ids), BATCH_SIZE):
+                _copy_notes(engines[source], engines[target], ids[start:start + BATCH_SIZE])
+            recount_tags(engines[target])
+            copied += len(ids)
+            logger.info("Copied %d notes from shard %d to shard %d", len(ids), source, target)
+
+    with engines[0].begin() as conn:
+        planned.save(conn)
+    removed = remove_strays(engines, planned)
+    return {"buckets": sum(len(b) for b in moves.values()), "copied": copied, "removed": sum(removed.values())}
+
+
+def load_map(engines: List[Engine]) -> sharding.ShardMap:
+    return sharding.ShardCatalog(engines).shard_map
+
+
+def status(engines: List[Engine], shard_map: sharding.ShardMap) -> List[Dict[str, int]]:
+    rows = []
+    for shard, engine in enumerate(engines):
+        with engine.connect() as conn:
+            notes = conn.execute(select(func.count()).select_from(Note)).scalar()
+        path = engine.url.database
+        rows.append(
+            {
+                "shard": shard,
+                "buckets": len(shard_map.buckets_of(shard)),
+                "notes": notes,
+                "bytes": os.path.getsize(path) if path and os.path.exists(path) else 0,
+            }
+        )
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status")
+    rebalance = commands.add_parser("rebalance")
+    rebalance.add_argument("--shards", type=int, default=DATABASE_SHARDS)
+    split = commands.add_parser("split")
+    split.add_argument("shard", type=int)
+    split.add_argument("--into", type=int)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    # Open enough shards for the stored map before reading it
+    count = max(DATABASE_SHARDS, getattr(args, "shards", 0) or 0)
+    with create_engine(DATABASE_URL).connect() as conn:
+        sharding.catalog_metadata.create_all(conn)
+        stored = sharding.ShardMap.load(conn)
+    if stored is not None:
+        count = max(count, max(stored.shards) + 1)
+
+    if args.command == "split":
+        into = args.into if args.into is not None else count
+        count = max(count, into + 1)
+    engines = shard_engines(count)
+    current = load_map(engines)
+
+    if args.command == "rebalance":
+        result = apply(engines, current, plan_rebalance(current, args.shards))
+    elif args.command == "split":
+        result = apply(engines, current, plan_split(current, args.shard, into))
+    else:
+        result = None
+    if result is not None:
+        logger.info("Moved %(buckets)d buckets: %(copied)d notes copied, %(removed)d removed", result)
+
+    shard_map = load_map(engines)
+    for row in status(engines, shard_map):
+        print("shard {shard}: {buckets} buckets, {notes} notes, {bytes} bytes".format(**row))
+    print(f"Start the app with DATABASE_SHARDS={max(shard_map.shards) + 1}")
+
+
+if __name__ == "__main__":
+    main()
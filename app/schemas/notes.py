@@ -1,7 +1,33 @@
-from pydantic import BaseModel, Field
-from typing import List, Optional
+import re
+from pydantic import BaseModel, ConfigDict, Field, field_validator
+from typing import Any, List, Optional
 from datetime import datetime
 
+# Tags are stored lowercase; commas separate them when loaded with a note
+MAX_TAGS = 20
+TAG_PATTERN = re.compile(r"^[\w\-.:/]{1,64}$")
+TAG_SEPARATOR = ","
+
+
+def normalize_tags(names: List[str]) -> List[str]:
+    """Lowercase, deduplicate and sort tag names, rejecting invalid ones"""
+    tags = sorted({name.strip().lower() for name in names})
+    for tag in tags:
+        if not TAG_PATTERN.match(tag):
+            raise ValueError(
+                f"Invalid tag {tag!r}: use 1-64 letters, digits or - _ . : /"
+            )
+    return tags
+
+
+def split_tags(value: Any) -> List[str]:
+    """Tag names from the comma-separated form they are loaded in"""
+    if value is None:
+        return []
+    if isinstance(value, str):
+        return sorted(tag for tag in value.split(TAG_SEPARATOR) if tag)
+    return value
+
 # Base Note Schema
 
 
@@ -14,7 +40,12 @@ class NoteBase(BaseModel):
 
 
 class NoteCreate(NoteBase):
-    pass
+    tags: List[str] = Field(default_factory=list, max_length=MAX_TAGS)
+
+    @field_validator("tags")
+    @classmethod
+    def _normalize_tags(cls, tags: List[str]) -> List[str]:
+        return normalize_tags(tags)
 
 
 # Schema for updating a note
@@ -23,6 +54,13 @@ class NoteCreate(NoteBase):
 class NoteUpdate(BaseModel):
     title: Optional[str] = Field(None, min_length=1, max_length=255)
     content: Optional[str] = Field(None, min_length=1)
+    # None leaves the tags as they are; a list replaces them
+    tags: Optional[List[str]] = Field(None, max_length=MAX_TAGS)
+
+    @field_validator("tags")
+    @classmethod
+    def _normalize_tags(cls, tags: Optional[List[str]]) -> Optional[List[str]]:
+        return None if tags is None else normalize_tags(tags)
 
 
 # Schema for note history
@@ -33,8 +71,7 @@ class NoteHistoryBase(BaseModel):
     content: str
     created_at: datetime
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # Schema for note response
@@ -44,9 +81,14 @@ class NoteResponse(NoteBase):
     id: int
     created_at: datetime
     updated_at: datetime
+    tags: List[str] = []
+
+    model_config = ConfigDict(from_attributes=True)
 
-    class Config:
-        orm_mode = True
+    @field_validator("tags", mode="before")
+    @classmethod
+    def _split_tags(cls, value: Any) -> List[str]:
+        return split_tags(value)
 
 
 # Schema for note with history
@@ -56,6 +98,47 @@ class NoteWithHistory(NoteResponse):
     history: List[NoteHistoryBase] = []
 
 
+# Schema for a note related to another one
+
+
+class RelatedNote(BaseModel):
+    note_id: int
+    title: str
+    score: float
+
+
+# Schema for a near duplicate of a note
+
+
+class DuplicateNote(BaseModel):
+    note_id: int
+    title: str
+    similarity: float
+
+
+# Schema for a tag and the number of notes that have it
+
+
+class TagCount(BaseModel):
+    name: str
+    count: int
+
+
+# Schema for a file attached to a note
+
+
+class AttachmentResponse(BaseModel):
+    id: int
+    note_id: int
+    filename: str
+    content_type: str
+    size: int
+    sha256: str
+    created_at: datetime
+
+    model_config = ConfigDict(from_attributes=True)
+
+
 # Schema for note summary
 
 
@@ -64,6 +147,14 @@ class NoteSummary(BaseModel):
     summary: str
 
 
+# Schema for a batch summarization request
+
+
+class SummaryBatchRequest(BaseModel):
+    note_ids: List[int] = Field(..., min_length=1, max_length=100)
+    concurrency: Optional[int] = Field(None, ge=1)
+
+
 # Schema for analytics response
 
 
@@ -74,3 +165,12 @@ class AnalyticsResponse(BaseModel):
     most_common_words: List[tuple]
     top_3_shortest_notes: List[int]
     top_3_longest_notes: List[int]
+
+
+# Schema for the corpus-wide duplicates report
+
+
+class DuplicatesReport(BaseModel):
+    total_notes: int
+    duplicate_notes: int
+    groups: List[List[int]]
@@ -0,0 +1,99 @@
+"""
+Production entry point.
+
+    python -m app.server [--workers N] [--host HOST] [--port PORT]
+
+Prepares the database once, then starts the uvicorn workers. Each worker
+warms up before it accepts requests, and on SIGTERM stops accepting new
+connections and lets in-flight requests finish.
+"""
+import argparse
+import importlib.util
+import logging
+import os
+
+import uvicorn
+
+from app.database import SessionLocal, create_schema
+from app.models import notes  # noqa: F401  (registers the tables)
+from app.services import duplicates, similarity
+
+logger = logging.getLogger(__name__)
+
+# Worker processes; 0 means one per CPU core
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "0"))
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+
+# Seconds in-flight requests get to finish after SIGTERM
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+
+# Seconds an idle keep-alive connection stays open
+KEEPALIVE_TIMEOUT = int(os.getenv("KEEPALIVE_TIMEOUT", "5"))
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "info")
+
+
+def worker_count(requested: int = WEB_WORKERS) -> int:
+    return requested if requested > 0 else os.cpu_count() or 1
+
+
+def event_loop() -> str:
+    """uvloop when it is installed, otherwise asyncio"""
+    return "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+
+
+def http_protocol() -> str:
+    """httptools when it is installed, otherwise h11"""
+    return "httptools" if importlib.util.find_spec("httptools") else "h11"
+
+
+def prepare_database() -> None:
+    """
+    Create the schema, backfill missing duplicate signatures and build the
+    related-notes index once, before any worker starts. Workers then find
+    every signature stored and load the saved index instead of racing to
+    write the same rows.
+    """
+    create_schema()
+    db = SessionLocal()
+    try:
+        duplicates.backfill_signatures(db)
+        similarity.load_index(db)
+    finally:
+        db.close()
+    similarity.save_index()
+    # Inherited by the workers, so they skip creating it concurrently
+    os.environ["SCHEMA_CREATED"] = "1"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--workers", type=int, default=WEB_WORKERS)
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=LOG_LEVEL.upper())
+    prepare_database()
+    workers, loop, http = worker_count(args.workers), event_loop(), http_protocol()
+    # Workers split the server-wide limits by this count
+    os.environ["WEB_WORKERS"] = str(workers)
+    logger.info("Starting %d workers (loop=%s, http=%s)", workers, loop, http)
+
+    uvicorn.run(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        loop=loop,
+        http=http,
+        timeout_keep_alive=KEEPALIVE_TIMEOUT,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT,
+        log_level=LOG_LEVEL,
+        access_log=False,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,68 @@
 import google.generativeai as genai
+import asyncio
+import contextvars
 import os
+import threading
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional, Union
 from dotenv import load_dotenv
 from fastapi import HTTPException
+from google.api_core import exceptions as google_exceptions
+
+from app.utils import tracing
+from app.utils.metrics import registry
+from app.utils.resilience import CircuitBreaker, LatencyWindow, backoff_delay
+from app.utils.workers import per_worker
 
 load_dotenv()
 
 # Get Gemini API key, but don't fail if not set
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 
+# Pin a model to skip discovery entirely
+GEMINI_MODEL = os.getenv("GEMINI_MODEL")
+
+# How long discovered models are served before a background refresh, and
+# how long a failed discovery is remembered before it is retried
+MODEL_CACHE_TTL = float(os.getenv("GEMINI_MODEL_CACHE_TTL", "3600"))
+MODEL_CACHE_ERROR_TTL = float(os.getenv("GEMINI_MODEL_CACHE_ERROR_TTL", "60"))
+
+DEFAULT_MODEL = "gemini-pro"
+
+# Concurrent model calls allowed across the server and per client; each
+# worker process allows its share
+AI_MAX_CONCURRENCY = per_worker(int(os.getenv("AI_MAX_CONCURRENCY", "8")))
+AI_MAX_CONCURRENCY_PER_CLIENT = per_worker(
+    int(os.getenv("AI_MAX_CONCURRENCY_PER_CLIENT", "2"))
+)
+
+# Seconds a call may wait for a free slot, and seconds it may take once running
+AI_QUEUE_TIMEOUT = float(os.getenv("AI_QUEUE_TIMEOUT", "10"))
+AI_REQUEST_TIMEOUT = float(os.getenv("AI_REQUEST_TIMEOUT", "30"))
+
+# Seconds a single attempt may take; AI_REQUEST_TIMEOUT bounds all of them
+AI_ATTEMPT_TIMEOUT = float(os.getenv("AI_ATTEMPT_TIMEOUT", "15"))
+
+# Retries of transient failures, with jittered exponential backoff
+AI_MAX_RETRIES = int(os.getenv("AI_MAX_RETRIES", "2"))
+AI_RETRY_BASE_DELAY = float(os.getenv("AI_RETRY_BASE_DELAY", "0.5"))
+AI_RETRY_MAX_DELAY = float(os.getenv("AI_RETRY_MAX_DELAY", "5"))
+
+# Consecutive transient failures that open the circuit, and seconds it
+# stays open before a probe call is let through
+AI_BREAKER_THRESHOLD = int(os.getenv("AI_BREAKER_THRESHOLD", "5"))
+AI_BREAKER_RESET = float(os.getenv("AI_BREAKER_RESET", "30"))
+
+# Send a second request when the first is slower than the recent p95
+AI_HEDGE = os.getenv("AI_HEDGE", "0") == "1"
+
 # Only configure if key is available
 if GEMINI_API_KEY:
     genai.configure(api_key=GEMINI_API_KEY)
 
 
-def list_available_models():
-    """List all available models for debugging"""
-    if not GEMINI_API_KEY:
-        return "API key not set"
-
+def _fetch_models() -> Union[List[str], str]:
     try:
         models = genai.list_models()
         return [model.name for model in models]
@@ -25,11 +70,532 @@ def list_available_models():
         return f"Error listing models: {str(e)}"
 
 
-async def summarize_text_async(text: str, title: str = "") -> str:
+class ModelCache:
+    """
+    Caches the result of model discovery.
+
+    The first lookup fetches synchronously, and lookups made while it runs
+    wait for its result instead of fetching again. After the TTL the stale
+    value keeps being served while a single background thread refreshes
+    it, so callers never wait on discovery once the cache is warm.
+    """
+
+    def __init__(self, ttl: float, error_ttl: float):
+        self.ttl = ttl
+        self.error_ttl = error_ttl
+        self._lock = threading.Lock()
+        self._refreshed = threading.Condition(self._lock)
+        self._value: Optional[Union[List[str], str]] = None
+        self._fetched_at = 0.0
+        self._refreshing = False
+
+    def get(self) -> Union[List[str], str]:
+        with self._lock:
+            # A cold lookup waits for the first fetch if one is running
+            self._refreshed.wait_for(
+                lambda: self._value is not None or not self._refreshing
+            )
+            value = self._value
+            expired = time.monotonic() - self._fetched_at > self._ttl_for(value)
+            start_refresh = (value is None or expired) and not self._refreshing
+            if start_refresh:
+                self._refreshing = True
+
+        if value is None:
+            return self.refresh()
+        if start_refresh:
+            threading.Thread(target=self.refresh, daemon=True).start()
+        return value
+
+    def refresh(self) -> Union[List[str], str]:
+        value = _fetch_models()
+        with self._lock:
+            # Keep serving a good list if a refresh fails
+            if isinstance(value, list) or not isinstance(self._value, list):
+                self._value = value
+            self._fetched_at = time.monotonic()
+            self._refreshing = False
+            self._refreshed.notify_all()
+            return self._value
+
+    @property
+    def warm(self) -> bool:
+        return self._value is not None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._value = None
+            self._fetched_at = 0.0
+            self._refreshing = False
+
+    def _ttl_for(self, value) -> float:
+        return self.ttl if isinstance(value, list) else self.error_ttl
+
+
+model_cache = ModelCache(MODEL_CACHE_TTL, MODEL_CACHE_ERROR_TTL)
+
+
+def list_available_models():
+    """List all available models, served from the discovery cache"""
+    if not GEMINI_API_KEY:
+        return "API key not set"
+
+    return model_cache.get()
+
+
+def _pick_model(available_models) -> str:
+    # Перевіряємо різні варіанти назв моделей
+    possible_models = [
+        "gemini-pro",
+        "models/gemini-pro",
+        "gemini-1.5-pro",
+        "models/gemini-1.5-pro",
+        "gemini-1.0-pro",
+    ]
+
+    if not isinstance(available_models, list):
+        return DEFAULT_MODEL
+
+    # Перевіримо, які з можливих моделей доступні
+    for model in possible_models:
+        if model in available_models or any(
+            m.endswith(model) for m in available_models
+        ):
+            return model
+
+    # Якщо не знайшли жодної моделі в списку, використовуємо першу
+    # доступну модель
+    for model in available_models:
+        if "gemini" in model.lower() and "pro" in model.lower():
+            return model
+
+    # Якщо все ще немає моделі, використовуємо стандартну
+    return DEFAULT_MODEL
+
+
+def resolve_model_name() -> str:
+    """Name of the model used for summaries, without a remote call once cached"""
+    if GEMINI_MODEL:
+        return GEMINI_MODEL
+    return _pick_model(list_available_models())
+
+
+@tracing.traced("ai", "gemini.resolve_model")
+async def resolve_model_name_async() -> str:
+    """Like resolve_model_name, moving a cold discovery off the event loop"""
+    if GEMINI_MODEL or model_cache.warm:
+        return resolve_model_name()
+    return await asyncio.to_thread(resolve_model_name)
+
+
+# Identity of the API client on whose behalf the current task calls the model
+current_client: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar(
+    "current_client", default=None
+)
+
+
+class ConcurrencyLimiter:
+    """
+    Global and per-client caps on concurrent model calls.
+
+    Semaphores are created for the running event loop on first use, so
+    the limiter also works when tests run each case on a fresh loop.
+    """
+
+    def __init__(self, limit: int, per_client: int):
+        self.limit = limit
+        self.per_client = per_client
+        self._loop = None
+        self._global: Optional[asyncio.Semaphore] = None
+        self._clients: Dict[str, List[Any]] = {}
+
+        self.waiting = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.rejected = 0
+
+    def _bind(self) -> None:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._global = asyncio.Semaphore(self.limit)
+            self._clients = {}
+
+    async def _acquire(self, client_id: Optional[str]) -> Optional[List[Any]]:
+        entry = None
+        if client_id is not None:
+            # [semaphore, number of tasks holding or waiting on it]
+            entry = self._clients.setdefault(
+                client_id, [asyncio.Semaphore(self.per_client), 0]
+            )
+            entry[1] += 1
+            try:
+                await entry[0].acquire()
+            except BaseException:
+                self._release_client(client_id, entry, acquired=False)
+                raise
+        try:
+            await self._global.acquire()
+        except BaseException:
+            if entry is not None:
+                self._release_client(client_id, entry, acquired=True)
+            raise
+        return entry
+
+    def _release_client(self, client_id: str, entry: List[Any], acquired: bool) -> None:
+        if acquired:
+            entry[0].release()
+        entry[1] -= 1
+        if entry[1] == 0:
+            self._clients.pop(client_id, None)
+
+    @asynccontextmanager
+    async def slot(self, client_id: Optional[str] = None, timeout: Optional[float] = None):
+        """Wait for a free slot, raising 503 if none frees up within timeout"""
+        self._bind()
+        self.waiting += 1
+        try:
+            entry = await asyncio.wait_for(self._acquire(client_id), timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503, detail="AI service is busy, try again later"
+            )
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._global.release()
+            if entry is not None:
+                self._release_client(client_id, entry, acquired=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "max_concurrency": self.limit,
+            "max_concurrency_per_client": self.per_client,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+        }
+
+
+limiter = ConcurrencyLimiter(AI_MAX_CONCURRENCY, AI_MAX_CONCURRENCY_PER_CLIENT)
+
+
+# Errors worth retrying; they also count against the circuit breaker
+_TRANSIENT_ERRORS = (
+    asyncio.TimeoutError,
+    ConnectionError,
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServerError,
+    google_exceptions.DeadlineExceeded,
+)
+
+breaker = CircuitBreaker(AI_BREAKER_THRESHOLD, AI_BREAKER_RESET)
+
+# kind is generate or stream; outcome is success, error or timeout. Calls
+# refused for lack of a slot or by the open circuit are counted by the
+# limiter and the breaker
+gemini_requests = registry.counter(
+    "gemini_requests", "Gemini calls by outcome", ("kind", "outcome")
+)
+gemini_request_duration = registry.histogram(
+    "gemini_request_duration_seconds",
+    "Duration of Gemini calls that got a concurrency slot, retries included",
+    ("kind",),
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0),
+)
+latencies = LatencyWindow()
+attempt_stats = {"retries": 0, "hedged": 0, "hedge_wins": 0}
+
+
+def get_stats() -> Dict[str, Any]:
+    """Concurrency, queue-depth and resilience counters of the async AI path"""
+    return {
+        **limiter.stats(),
+        **attempt_stats,
+        "latency_p95": latencies.percentile(95),
+        "circuit": breaker.stats(),
+    }
+
+
+def _record(kind: str, outcome: str, start: float) -> None:
+    gemini_request_duration.labels(kind).observe(time.perf_counter() - start)
+    gemini_requests.labels(kind, outcome).inc()
+
+
+def _unavailable() -> HTTPException:
+    return HTTPException(
+        status_code=503, detail="AI service is unavailable, try again later"
+    )
+
+
+# Bump whenever the prompt changes so cached summaries are not reused
+PROMPT_VERSION = "1"
+
+
+def _build_prompt(text: str, title: str) -> str:
+    return f"Title: {title}\nContent: {text}\nSummarize briefly."
+
+
+def _build_combine_prompt(partials: List[str], title: str) -> str:
+    parts = "\n".join(f"- {partial}" for partial in partials)
+    return (
+        f"Title: {title}\nSummaries of consecutive parts of the note:\n{parts}\n"
+        "Combine them into one brief summary."
+    )
+
+
+@tracing.traced("ai", "gemini.generate")
+async def generate_async(
+    prompt: str,
+    client_id: Optional[str] = None,
+    model_name: Optional[str] = None,
+) -> str:
+    """
+    Run a prompt through Gemini API (async)
+
+    Generation uses the SDK's async API, so the event loop keeps serving
+    other requests while the model works. Calls are capped globally and
+    per client (defaulting to current_client). Transient failures are
+    retried within AI_REQUEST_TIMEOUT, and while the circuit breaker is
+    open calls fail fast with a 503.
+    """
+    if not GEMINI_API_KEY:
+        raise HTTPException(
+            status_code=500,
+            detail="GEMINI_API_KEY not set. Configure it to use AI.",
+        )
+
+    if client_id is None:
+        client_id = current_client.get()
+    if model_name is None:
+        model_name = await resolve_model_name_async()
+
+    if not breaker.allow():
+        raise _unavailable()
+
+    queued = time.perf_counter()
+    async with limiter.slot(client_id, timeout=AI_QUEUE_TIMEOUT):
+        start = time.perf_counter()
+        tracing.record_span("gemini.queue", "ai", queued, start)
+        try:
+            summary = await asyncio.wait_for(
+                _generate_with_retries(model_name, prompt),
+                timeout=AI_REQUEST_TIMEOUT,
+            )
+        except asyncio.TimeoutError:
+            limiter.timeouts += 1
+            breaker.record_failure()
+            _record("generate", "timeout", start)
+            raise HTTPException(
+                status_code=504, detail="AI summarization timed out"
+            )
+        except Exception as e:
+            limiter.failed += 1
+            if isinstance(e, _TRANSIENT_ERRORS):
+                breaker.record_failure()
+            _record("generate", "error", start)
+            raise HTTPException(
+                status_code=500,
+                detail=f"AI summarization failed: {str(e)}",
+            )
+        breaker.record_success()
+        limiter.completed += 1
+        _record("generate", "success", start)
+        return summary
+
+
+@tracing.traced("ai", "gemini.attempt")
+async def _attempt(model: Any, prompt: str) -> str:
+    start = time.perf_counter()
+    response = await asyncio.wait_for(
+        model.generate_content_async(prompt), timeout=AI_ATTEMPT_TIMEOUT
+    )
+    text = response.text
+    latencies.add(time.perf_counter() - start)
+    return text
+
+
+async def _hedged_attempt(model: Any, prompt: str) -> str:
+    """
+    One attempt, plus a second identical request if the first is still
+    running after the recent p95 latency. The first success wins and the
+    other request is cancelled.
+    """
+    delay = latencies.percentile(95) if AI_HEDGE else None
+    if delay is None:
+        return await _attempt(model, prompt)
+
+    first = asyncio.create_task(_attempt(model, prompt))
+    tasks = {first}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            attempt_stats["hedged"] += 1
+            tasks.add(asyncio.create_task(_attempt(model, prompt)))
+        while True:
+            done, tasks = await asyncio.wait(
+                tasks, return_when=asyncio.FIRST_COMPLETED
+            )
+            errors = [task.exception() for task in done]
+            for task, error in zip(done, errors):
+                if error is None:
+                    if task is not first:
+                        attempt_stats["hedge_wins"] += 1
+                    return task.result()
+            if not tasks:
+                raise errors[0]
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _generate_with_retries(model_name: str, prompt: str) -> str:
+    model = genai.GenerativeModel(model_name)
+    for attempt in range(AI_MAX_RETRIES + 1):
+        try:
+            return await _hedged_attempt(model, prompt)
+        except _TRANSIENT_ERRORS:
+            if attempt == AI_MAX_RETRIES:
+                raise
+            attempt_stats["retries"] += 1
+            await asyncio.sleep(
+                backoff_delay(attempt, AI_RETRY_BASE_DELAY, AI_RETRY_MAX_DELAY)
+            )
+
+
+async def summarize_text_async(
+    text: str,
+    title: str = "",
+    client_id: Optional[str] = None,
+    model_name: Optional[str] = None,
+) -> str:
     """
     Summarize text using Gemini API (async)
     """
-    return summarize_text(text, title)
+    return await generate_async(_build_prompt(text, title), client_id, model_name)
+
+
+async def combine_summaries_async(
+    partials: List[str],
+    title: str = "",
+    client_id: Optional[str] = None,
+    model_name: Optional[str] = None,
+) -> str:
+    """
+    Merge summaries of consecutive parts of a document into one (async)
+    """
+    return await generate_async(
+        _build_combine_prompt(partials, title), client_id, model_name
+    )
+
+
+async def stream_generate_async(
+    prompt: str,
+    client_id: Optional[str] = None,
+    model_name: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """
+    Run a prompt through Gemini API, yielding chunks as they are generated
+
+    Each chunk must arrive within AI_REQUEST_TIMEOUT. Closing or cancelling
+    the generator closes the upstream stream, which cancels the call.
+    Streams are not retried, but they honour and feed the circuit breaker.
+    """
+    if not GEMINI_API_KEY:
+        raise HTTPException(
+            status_code=500,
+            detail="GEMINI_API_KEY not set. Configure it to use AI.",
+        )
+
+    if client_id is None:
+        client_id = current_client.get()
+    if model_name is None:
+        model_name = await resolve_model_name_async()
+
+    if not breaker.allow():
+        raise _unavailable()
+
+    async with limiter.slot(client_id, timeout=AI_QUEUE_TIMEOUT):
+        start = time.perf_counter()
+        chunks = None
+        try:
+            model = genai.GenerativeModel(model_name)
+            response = await asyncio.wait_for(
+                model.generate_content_async(prompt, stream=True),
+                timeout=AI_REQUEST_TIMEOUT,
+            )
+            chunks = response.__aiter__()
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(
+                        chunks.__anext__(), timeout=AI_REQUEST_TIMEOUT
+                    )
+                except StopAsyncIteration:
+                    break
+                yield chunk.text
+        except asyncio.TimeoutError:
+            limiter.timeouts += 1
+            breaker.record_failure()
+            _record("stream", "timeout", start)
+            raise HTTPException(
+                status_code=504, detail="AI summarization timed out"
+            )
+        except HTTPException:
+            raise
+        except Exception as e:
+            limiter.failed += 1
+            if isinstance(e, _TRANSIENT_ERRORS):
+                breaker.record_failure()
+            _record("stream", "error", start)
+            raise HTTPException(
+                status_code=500,
+                detail=f"AI summarization failed: {str(e)}",
+            )
+        finally:
+            if chunks is not None:
+                await chunks.aclose()
+            tracing.record_span("gemini.stream", "ai", start)
+        breaker.record_success()
+        limiter.completed += 1
+        _record("stream", "success", start)
+
+
+def stream_summary_async(
+    text: str,
+    title: str = "",
+    client_id: Optional[str] = None,
+    model_name: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """
+    Summarize text using Gemini API, yielding chunks as they are generated
+    """
+    return stream_generate_async(_build_prompt(text, title), client_id, model_name)
+
+
+def stream_combine_summaries_async(
+    partials: List[str],
+    title: str = "",
+    client_id: Optional[str] = None,
+    model_name: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """
+    Merge summaries of consecutive parts of a document, yielding chunks
+    """
+    return stream_generate_async(
+        _build_combine_prompt(partials, title), client_id, model_name
+    )
 
 
 def summarize_text(text: str, title: str = "") -> str:
@@ -45,52 +611,8 @@ def summarize_text(text: str, title: str = "") -> str:
         )
 
     try:
-        # Спробуємо отримати список доступних моделей
-        available_models = list_available_models()
-
-        # Виберемо відповідну модель
-        model_name = None
-
-        # Перевіряємо різні варіанти назв моделей
-        possible_models = [
-            "gemini-pro",
-            "models/gemini-pro",
-            "gemini-1.5-pro",
-            "models/gemini-1.5-pro",
-            "gemini-1.0-pro",
-        ]
-
-        # Якщо ми змогли отримати список моделей, перевіримо, які з них
-        # доступні
-        if isinstance(available_models, list):
-            for model in possible_models:
-                if model in available_models or any(
-                    m.endswith(model) for m in available_models
-                ):
-                    model_name = model
-                    break
-
-        # Якщо не знайшли жодної моделі в списку, спробуємо використати першу
-        # зі списку можливих
-        if (
-            not model_name
-            and isinstance(available_models, list)
-            and available_models
-        ):
-            # Використовуємо першу доступну модель
-            for model in available_models:
-                if "gemini" in model.lower() and "pro" in model.lower():
-                    model_name = model
-                    break
-
-        # Якщо все ще немає моделі, використовуємо стандартну
-        if not model_name:
-            model_name = "gemini-pro"
-
-        # Створюємо модель і генеруємо вміст
-        model = genai.GenerativeModel(model_name)
-        prompt = f"Title: {title}\nContent: {text}\nSummarize briefly."
-        response = model.generate_content(prompt)
+        model = genai.GenerativeModel(resolve_model_name())
+        response = model.generate_content(_build_prompt(text, title))
         return response.text
     except Exception as e:
         # Якщо виникла помилка, повертаємо фіктивний підсумок
@@ -98,6 +620,5 @@ def summarize_text(text: str, title: str = "") -> str:
         # return fallback_summary
         raise HTTPException(
             status_code=500,
-            detail=f"AI summarization failed: {
-                str(e)}",
+            detail=f"AI summarization failed: {str(e)}",
         )
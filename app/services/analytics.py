@@ -1,7 +1,10 @@
 from sqlalchemy.orm import Session
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
+from app import sharding
 from app.models.notes import Note
+from app.services import duplicates
+from app.utils.tracing import traced
 import pandas as pd
 import nltk
 from collections import Counter
@@ -25,29 +28,51 @@ def remove_stopwords(words: List[str]) -> List[str]:
     return [word for word in words if word not in stopwords and len(word) > 1]
 
 
+@traced()
 async def analyze_notes_async(db: AsyncSession) -> Dict[str, Any]:
-    """Analyze all notes in the database (async)"""
-    result = await db.execute(select(Note))
-    notes = result.scalars().all()
-    return _analyze_notes_helper(notes)
+    """
+    Analyze all notes in the database (async). Sharded, the shards are
+    read at once, each is analyzed on its own as it arrives, and the
+    results are merged.
+    """
 
+    async def analyze(shard_db: AsyncSession) -> Dict[str, Any]:
+        result = await shard_db.execute(select(Note))
+        return _partial_analysis(result.scalars().all())
 
+    return _merge_analyses(await sharding.gather_shards(db, analyze))
+
+
+@traced()
 def analyze_notes(db: Session) -> Dict[str, Any]:
     """Analyze all notes in the database (sync)"""
-    notes = db.query(Note).all()
-    return _analyze_notes_helper(notes)
+    partials = sharding.map_shards(
+        db, lambda shard_db: _partial_analysis(shard_db.query(Note).all())
+    )
+    return _merge_analyses(partials)
+
+
+@traced()
+def duplicates_report(
+    threshold: float = duplicates.DEFAULT_THRESHOLD,
+) -> Dict[str, Any]:
+    """Report groups of near-duplicate notes across the whole corpus"""
+    groups = duplicates.index.groups(threshold)
+    return {
+        "total_notes": len(duplicates.index),
+        "duplicate_notes": sum(len(group) for group in groups),
+        "groups": groups,
+    }
+
+
+def _length_pairs(rows) -> List[Tuple[int, int]]:
+    return list(zip(rows["word_count"].tolist(), rows["id"].tolist()))
 
 
-def _analyze_notes_helper(notes) -> Dict[str, Any]:
+def _partial_analysis(notes) -> Dict[str, Any]:
+    """The mergeable parts of an analysis of some of the notes"""
     if not notes:
-        return {
-            "total_notes": 0,
-            "total_words": 0,
-            "average_note_length": 0,
-            "most_common_words": [],
-            "top_3_shortest_notes": [],
-            "top_3_longest_notes": [],
-        }
+        return {"notes": 0, "words": 0, "counts": Counter(), "shortest": [], "longest": []}
 
     # Create a DataFrame for easier analysis
     df = pd.DataFrame(
@@ -62,28 +87,54 @@ def _analyze_notes_helper(notes) -> Dict[str, Any]:
         ]
     )
 
-    # Calculate total words
-    total_words = df["word_count"].sum()
-
-    # Calculate average note length
-    avg_length = df["word_count"].mean()
-
     # Find most common words (excluding stopwords)
     all_text = " ".join([clean_text(note.content) for note in notes])
     words = nltk.word_tokenize(all_text)
     filtered_words = remove_stopwords(words)
-    most_common_words = Counter(filtered_words).most_common(5)
 
-    # Find shortest and longest notes
+    # Shortest and longest notes, as (word count, id) in ascending order
     df_sorted = df.sort_values("word_count")
-    shortest_notes = df_sorted.head(3)["id"].tolist()
-    longest_notes = df_sorted.tail(3)["id"].tolist()
 
     return {
-        "total_notes": len(notes),
-        "total_words": int(total_words),
-        "average_note_length": float(avg_length),
-        "most_common_words": most_common_words,
-        "top_3_shortest_notes": shortest_notes,
-        "top_3_longest_notes": longest_notes,
+        "notes": len(notes),
+        "words": int(df["word_count"].sum()),
+        "counts": Counter(filtered_words),
+        "shortest": _length_pairs(df_sorted.head(3)),
+        "longest": _length_pairs(df_sorted.tail(3)),
+    }
+
+
+def _merge_analyses(partials: List[Dict[str, Any]]) -> Dict[str, Any]:
+    total_notes = sum(partial["notes"] for partial in partials)
+    if not total_notes:
+        return {
+            "total_notes": 0,
+            "total_words": 0,
+            "average_note_length": 0,
+            "most_common_words": [],
+            "top_3_shortest_notes": [],
+            "top_3_longest_notes": [],
+        }
+
+    total_words = sum(partial["words"] for partial in partials)
+    counts = Counter()
+    for partial in partials:
+        counts.update(partial["counts"])
+    # Stable sorts keep the order of a single analysis among equal lengths
+    shortest = sorted(
+        (pair for partial in partials for pair in partial["shortest"]),
+        key=lambda pair: pair[0],
+    )[:3]
+    longest = sorted(
+        (pair for partial in partials for pair in partial["longest"]),
+        key=lambda pair: pair[0],
+    )[-3:]
+
+    return {
+        "total_notes": total_notes,
+        "total_words": total_words,
+        "average_note_length": total_words / total_notes,
+        "most_common_words": counts.most_common(5),
+        "top_3_shortest_notes": [note_id for _, note_id in shortest],
+        "top_3_longest_notes": [note_id for _, note_id in longest],
     }
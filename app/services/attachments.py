@@ -0,0 +1,336 @@
+import asyncio
+import hashlib
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import anyio
+from fastapi import HTTPException
+from sqlalchemy import delete, exists, func, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app import sharding
+from app.database import SessionLocal
+from app.models.notes import Blob, Note, NoteAttachment
+from app.utils.tracing import traced
+
+logger = logging.getLogger(__name__)
+
+# Directory holding attachment content, one file per distinct content named
+# by its SHA-256; uploads are written to its tmp/ subdirectory first
+ATTACHMENT_DIR = os.getenv("ATTACHMENT_DIR", "./attachments")
+
+# Largest accepted upload in bytes
+ATTACHMENT_MAX_BYTES = int(os.getenv("ATTACHMENT_MAX_BYTES", str(100 * 1024 * 1024)))
+
+# Seconds content stays after its last reference is removed, and after an
+# upload of it started, before garbage collection may delete it
+ATTACHMENT_GC_GRACE = float(os.getenv("ATTACHMENT_GC_GRACE", "3600"))
+
+# Seconds between garbage collection runs; 0 disables the background runs
+ATTACHMENT_GC_INTERVAL = float(os.getenv("ATTACHMENT_GC_INTERVAL", "3600"))
+
+# Uploads are hashed and written in blocks of this many bytes
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# Blob rows checked per statement when sweeping the store
+_SWEEP_BATCH = 500
+
+
+def blob_path(sha256: str) -> str:
+    """Where the content with this hash is stored; two directory levels keep directories small"""
+    return os.path.join(ATTACHMENT_DIR, sha256[:2], sha256[2:4], sha256)
+
+
+def _temp_dir() -> str:
+    return os.path.join(ATTACHMENT_DIR, "tmp")
+
+
+def _columns():
+    return (
+        NoteAttachment.id,
+        NoteAttachment.note_id,
+        NoteAttachment.filename,
+        NoteAttachment.content_type,
+        Blob.size,
+        NoteAttachment.sha256,
+        NoteAttachment.created_at,
+    )
+
+
+async def _receive(chunks: AsyncIterator[bytes], max_bytes: int) -> Tuple[str, str, int]:
+    """
+    Write a stream to a temporary file in the store, hashing it on the way;
+    returns the file, its SHA-256 and its size. Blocks are hashed and
+    written in a worker thread, so the event loop only collects them.
+    """
+    os.makedirs(_temp_dir(), exist_ok=True)
+    fd, path = tempfile.mkstemp(dir=_temp_dir(), prefix="upload-")
+    digest = hashlib.sha256()
+    size = 0
+    buffer = bytearray()
+
+    def write(f, block: bytes) -> None:
+        digest.update(block)
+        f.write(block)
+
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(status_code=413, detail="Attachment too large")
+                buffer += chunk
+                if len(buffer) >= WRITE_BUFFER_SIZE:
+                    await anyio.to_thread.run_sync(write, f, bytes(buffer))
+                    buffer.clear()
+            if buffer:
+                await anyio.to_thread.run_sync(write, f, bytes(buffer))
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path, digest.hexdigest(), size
+
+
+def _install(temp_path: str, sha256: str) -> None:
+    """
+    Move an upload to its place in the store. Done even when the content is
+    already there, which renews the file's mtime so garbage collection that
+    is about to delete the old copy leaves it alone.
+    """
+    final = blob_path(sha256)
+    os.makedirs(os.path.dirname(final), exist_ok=True)
+    os.replace(temp_path, final)
+
+
+@traced()
+async def create_attachment_async(
+    db: AsyncSession,
+    note_id: int,
+    filename: str,
+    content_type: str,
+    chunks: AsyncIterator[bytes],
+    max_bytes: Optional[int] = None,
+) -> Dict[str, Any]:
+    """
+    Attach a file, streamed in `chunks`, to a note (async).
+
+    The content is stored once however many attachments share it. Its blob
+    row is committed before the file is moved into the store and the
+    attachment row after, so garbage collection never sees a referenced
+    blob without its file.
+    """
+    found = await db.execute(select(Note.id).where(Note.id == note_id))
+    if found.scalar() is None:
+        raise HTTPException(status_code=404, detail="Note not found")
+
+    limit = ATTACHMENT_MAX_BYTES if max_bytes is None else max_bytes
+    temp_path, sha256, size = await _receive(chunks, limit)
+    try:
+        # Sharded, each shard keeps rows for the content its notes refer to
+        with sharding.for_note(db, note_id):
+            await db.execute(
+                sqlite_insert(Blob)
+                .values(sha256=sha256, size=size)
+                .on_conflict_do_update(
+                    index_elements=["sha256"], set_={"last_used_at": func.now()}
+                )
+            )
+        await db.commit()
+        await anyio.to_thread.run_sync(_install, temp_path, sha256)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+    attachment = NoteAttachment(
+        id=await sharding.new_id_async(db, "note_attachments"),
+        note_id=note_id,
+        sha256=sha256,
+        filename=filename,
+        content_type=content_type,
+    )
+    db.add(attachment)
+    await db.commit()
+    await db.refresh(attachment)
+    return {
+        "id": attachment.id,
+        "note_id": note_id,
+        "filename": filename,
+        "content_type": content_type,
+        "size": size,
+        "sha256": sha256,
+        "created_at": attachment.created_at,
+    }
+
+
+@traced()
+async def get_attachments_async(db: AsyncSession, note_id: int) -> List[Dict[str, Any]]:
+    """The attachments of a note, oldest first (async)"""
+    result = await db.execute(
+        select(*_columns())
+        .join(Blob, Blob.sha256 == NoteAttachment.sha256)
+        .where(NoteAttachment.note_id == note_id)
+        .order_by(NoteAttachment.id)
+    )
+    rows = [dict(row._mapping) for row in result.all()]
+    if not rows:
+        found = await db.execute(select(Note.id).where(Note.id == note_id))
+        if found.scalar() is None:
+            raise HTTPException(status_code=404, detail="Note not found")
+    return rows
+
+
+@traced()
+async def get_attachment_async(
+    db: AsyncSession, note_id: int, attachment_id: int
+) -> Dict[str, Any]:
+    """An attachment of a note (async)"""
+    result = await db.execute(
+        select(*_columns())
+        .join(Blob, Blob.sha256 == NoteAttachment.sha256)
+        .where(NoteAttachment.id == attachment_id, NoteAttachment.note_id == note_id)
+    )
+    row = result.first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    return dict(row._mapping)
+
+
+@traced()
+async def delete_attachment_async(db: AsyncSession, note_id: int, attachment_id: int) -> bool:
+    """Detach a file from a note; its content is left to garbage collection (async)"""
+    result = await db.execute(
+        delete(NoteAttachment)
+        .where(NoteAttachment.id == attachment_id, NoteAttachment.note_id == note_id)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    await db.commit()
+    return True
+
+
+def _unlink_if_older(path: str, cutoff: float) -> bool:
+    """Delete a file unless it was written after `cutoff`, a time.time() value"""
+    try:
+        if os.stat(path).st_mtime >= cutoff:
+            return False
+        os.unlink(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+@traced()
+def collect_garbage(db: Session, grace: float = ATTACHMENT_GC_GRACE) -> Dict[str, int]:
+    """
+    Delete content no attachment refers to any more.
+
+    Blob rows without references and unused for `grace` seconds are
+    deleted, then their files unless an upload renewed them meanwhile.
+    Uploads abandoned in tmp/ and files without a blob row, left by a run
+    that stopped between the two steps, are removed once older than
+    `grace` as well. Returns counts of what was removed.
+    """
+    now = time.time()
+    cutoff = now - grace
+    cutoff_at = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=grace)
+    stale = (
+        Blob.last_used_at < cutoff_at,
+        ~exists().where(NoteAttachment.sha256 == Blob.sha256),
+    )
+    stats = {"blobs": 0, "files": 0, "temp_files": 0, "orphan_files": 0}
+
+    # Sharded, the statements run on every shard, and content is only
+    # deleted once no shard has a row for it
+    candidates = sorted(set(db.execute(select(Blob.sha256).where(*stale)).scalars()))
+    for start in range(0, len(candidates), _SWEEP_BATCH):
+        batch = candidates[start:start + _SWEEP_BATCH]
+        # The conditions are checked again, as an upload may have used the
+        # content since it was selected
+        db.execute(
+            delete(Blob)
+            .where(Blob.sha256.in_(batch), *stale)
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+        kept = set(db.execute(select(Blob.sha256).where(Blob.sha256.in_(batch))).scalars())
+        for sha256 in batch:
+            if sha256 in kept:
+                continue
+            stats["blobs"] += 1
+            if _unlink_if_older(blob_path(sha256), cutoff):
+                stats["files"] += 1
+
+    if os.path.isdir(_temp_dir()):
+        for entry in os.scandir(_temp_dir()):
+            if entry.is_file() and _unlink_if_older(entry.path, cutoff):
+                stats["temp_files"] += 1
+
+    stored = []
+    for directory, subdirectories, files in os.walk(ATTACHMENT_DIR):
+        if directory == ATTACHMENT_DIR and "tmp" in subdirectories:
+            subdirectories.remove("tmp")
+        stored.extend((name, os.path.join(directory, name)) for name in files)
+    for start in range(0, len(stored), _SWEEP_BATCH):
+        batch = dict(stored[start:start + _SWEEP_BATCH])
+        known = set(
+            db.execute(select(Blob.sha256).where(Blob.sha256.in_(list(batch)))).scalars()
+        )
+        for name, path in batch.items():
+            if name not in known and _unlink_if_older(path, cutoff):
+                stats["orphan_files"] += 1
+    return stats
+
+
+class GarbageCollector:
+    """Runs collect_garbage every `interval` seconds in a worker thread"""
+
+    def __init__(self, interval: float = ATTACHMENT_GC_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.last_stats: Dict[str, int] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def start(self) -> None:
+        if self.running or self.interval <= 0:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if not self.running:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def collect(self) -> Dict[str, int]:
+        db = SessionLocal()
+        try:
+            self.last_stats = collect_garbage(db)
+        finally:
+            db.close()
+        self.runs += 1
+        return self.last_stats
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                stats = await anyio.to_thread.run_sync(self.collect)
+                logger.info("Attachment garbage collection: %s", stats)
+            except Exception:
+                logger.exception("Attachment garbage collection failed")
+
+
+collector = GarbageCollector()
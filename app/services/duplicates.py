@@ -0,0 +1,290 @@
+import threading
+import zlib
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from app import sharding
+from app.models.notes import Note, NoteSignature
+from app.utils.text_processing import tokenize
+
+# 128 permutations split into 16 bands of 8 rows: notes with a Jaccard
+# similarity around 0.7 or more collide in at least one band
+NUM_PERM = 128
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+DEFAULT_THRESHOLD = 0.8
+
+_PRIME = np.uint64(4294967311)  # smallest prime above 2**32
+_MASK = np.uint64(0xFFFFFFFF)
+_rng = np.random.RandomState(1)
+_A = _rng.randint(1, 2 ** 32, size=NUM_PERM, dtype=np.uint64)
+_B = _rng.randint(0, 2 ** 32, size=NUM_PERM, dtype=np.uint64)
+
+# Upper bound on shingles permuted at once (about 32 MB of uint64)
+_CHUNK = 32768
+
+
+def _shingle_hashes(text: str) -> np.ndarray:
+    tokens = tokenize(text)
+    if len(tokens) < SHINGLE_SIZE:
+        shingles = [" ".join(tokens) or text.strip().lower()]
+    else:
+        shingles = {
+            " ".join(tokens[i:i + SHINGLE_SIZE])
+            for i in range(len(tokens) - SHINGLE_SIZE + 1)
+        }
+    return np.fromiter(
+        (zlib.crc32(s.encode("utf-8")) for s in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+
+
+def _permute(hashes: np.ndarray) -> np.ndarray:
+    return (hashes[:, None] * _A + _B) % _PRIME & _MASK
+
+
+def compute_signatures(texts: Sequence[str]) -> np.ndarray:
+    """
+    Compute MinHash signatures for many texts at once.
+
+    Shingle hashes of consecutive texts are permuted together in chunks of
+    at most _CHUNK shingles and reduced per text, which keeps the backfill
+    vectorised while bounding memory.
+    """
+    hashes = [_shingle_hashes(text) for text in texts]
+    signatures = np.empty((len(hashes), NUM_PERM), dtype=np.uint32)
+    start = 0
+    while start < len(hashes):
+        if len(hashes[start]) > _CHUNK:
+            big = hashes[start]
+            partial = [
+                _permute(big[i:i + _CHUNK]).min(axis=0)
+                for i in range(0, len(big), _CHUNK)
+            ]
+            signatures[start] = np.min(partial, axis=0)
+            start += 1
+            continue
+
+        end, total = start, 0
+        while end < len(hashes) and total + len(hashes[end]) <= _CHUNK:
+            total += len(hashes[end])
+            end += 1
+        chunk = hashes[start:end]
+        offsets = np.zeros(len(chunk), dtype=np.int64)
+        np.cumsum([len(h) for h in chunk[:-1]], out=offsets[1:])
+        signatures[start:end] = np.minimum.reduceat(
+            _permute(np.concatenate(chunk)), offsets, axis=0
+        )
+        start = end
+    return signatures
+
+
+def compute_signature(text: str) -> np.ndarray:
+    """Compute the MinHash signature of a single text"""
+    return compute_signatures([text])[0]
+
+
+def signature_to_bytes(signature: np.ndarray) -> bytes:
+    return signature.astype("<u4").tobytes()
+
+
+def signature_from_bytes(data: bytes) -> np.ndarray:
+    return np.frombuffer(data, dtype="<u4").astype(np.uint32)
+
+
+class LshIndex:
+    """
+    Banded locality-sensitive hashing index over MinHash signatures.
+
+    Each signature is split into BANDS slices and every slice is a bucket
+    key, so candidates for a note are found by BANDS dictionary lookups
+    instead of a scan over the corpus.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._signatures: Dict[int, np.ndarray] = {}
+        self._buckets: List[Dict[bytes, Set[int]]] = [
+            defaultdict(set) for _ in range(BANDS)
+        ]
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def __contains__(self, note_id: int) -> bool:
+        return note_id in self._signatures
+
+    def add(self, note_id: int, signature: np.ndarray) -> None:
+        """Index a signature, replacing any previous one for the note"""
+        with self._lock:
+            self.remove(note_id)
+            self._signatures[note_id] = signature
+            for band, key in enumerate(self._band_keys(signature)):
+                self._buckets[band][key].add(note_id)
+
+    def remove(self, note_id: int) -> None:
+        with self._lock:
+            signature = self._signatures.pop(note_id, None)
+            if signature is None:
+                return
+            for band, key in enumerate(self._band_keys(signature)):
+                bucket = self._buckets[band].get(key)
+                if bucket is not None:
+                    bucket.discard(note_id)
+                    if not bucket:
+                        del self._buckets[band][key]
+
+    def duplicates(
+        self, note_id: int, threshold: float = DEFAULT_THRESHOLD
+    ) -> List[Tuple[int, float]]:
+        """
+        Return (note_id, estimated Jaccard similarity) pairs for the near
+        duplicates of a note, most similar first.
+        """
+        with self._lock:
+            signature = self._signatures.get(note_id)
+            if signature is None:
+                return []
+            candidates: Set[int] = set()
+            for band, key in enumerate(self._band_keys(signature)):
+                candidates |= self._buckets[band].get(key, set())
+            candidates.discard(note_id)
+            if not candidates:
+                return []
+            ids = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+            others = np.stack([self._signatures[i] for i in ids.tolist()])
+
+        scores = (others == signature).mean(axis=1)
+        keep = scores >= threshold
+        ranked = sorted(
+            zip(ids[keep].tolist(), scores[keep].tolist()),
+            key=lambda item: (-item[1], item[0]),
+        )
+        return ranked
+
+    def groups(self, threshold: float = DEFAULT_THRESHOLD) -> List[List[int]]:
+        """Group every indexed note with its near duplicates"""
+        parent: Dict[int, int] = {}
+
+        def find(x: int) -> int:
+            root = x
+            while parent.setdefault(root, root) != root:
+                root = parent[root]
+            parent[x] = root
+            return root
+
+        # Only the shared buckets are copied under the lock; comparing their
+        # members, quadratic in bucket size, runs without it
+        with self._lock:
+            shared = [
+                sorted(members)
+                for buckets in self._buckets
+                for members in buckets.values()
+                if len(members) > 1
+            ]
+            signatures = {
+                note_id: self._signatures[note_id] for ids in shared for note_id in ids
+            }
+
+        for ids in shared:
+            sigs = np.stack([signatures[i] for i in ids])
+            for i, note_id in enumerate(ids[:-1]):
+                scores = (sigs[i + 1:] == sigs[i]).mean(axis=1)
+                for j in np.nonzero(scores >= threshold)[0]:
+                    a, b = find(note_id), find(ids[i + 1 + j])
+                    if a != b:
+                        parent[max(a, b)] = min(a, b)
+
+        grouped: Dict[int, List[int]] = defaultdict(list)
+        for note_id in parent:
+            grouped[find(note_id)].append(note_id)
+        return sorted(sorted(members) for members in grouped.values())
+
+    @staticmethod
+    def _band_keys(signature: np.ndarray) -> Iterable[bytes]:
+        data = signature.astype("<u4").tobytes()
+        step = ROWS * 4
+        return (data[i:i + step] for i in range(0, len(data), step))
+
+
+# Process-wide index shared by the notes service and the API
+index = LshIndex()
+
+
+def index_signature(note_id: Optional[int], signature: np.ndarray) -> None:
+    """Add a note's signature to the in-memory LSH index"""
+    # Notes that have not been flushed yet have no id to index under
+    if note_id is None:
+        return
+    index.add(note_id, signature)
+
+
+def remove_note(note_id: int) -> None:
+    index.remove(note_id)
+
+
+def backfill_signatures(db: Session, batch_size: int = 1000) -> int:
+    """
+    Compute and store signatures for notes that do not have one yet,
+    batch_size notes at a time, shard by shard. Returns the number of
+    notes processed.
+    """
+    processed = 0
+    for shard in sharding.shard_ids(db) or [None]:
+        with sharding.on_shard(db, shard):
+            processed += _backfill_shard(db, batch_size)
+    return processed
+
+
+def _backfill_shard(db: Session, batch_size: int) -> int:
+    processed = 0
+    while True:
+        rows = (
+            db.query(Note.id, Note.content)
+            .outerjoin(NoteSignature, NoteSignature.note_id == Note.id)
+            .filter(NoteSignature.note_id.is_(None))
+            .order_by(Note.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not rows:
+            return processed
+        signatures = compute_signatures([content for _, content in rows])
+        # A Core executemany, which sharded sessions support unlike
+        # bulk_insert_mappings; rows another process backfilled meanwhile
+        # are left as they are
+        db.execute(
+            sqlite_insert(NoteSignature).on_conflict_do_nothing(),
+            [
+                {"note_id": note_id, "signature": signature_to_bytes(sig)}
+                for (note_id, _), sig in zip(rows, signatures)
+            ],
+        )
+        db.commit()
+        processed += len(rows)
+
+
+def load_index(db: Session) -> None:
+    """Backfill missing signatures and load all of them into the index"""
+    backfill_signatures(db)
+    _load_signatures(index, db)
+
+
+def reload_index(db: Session) -> None:
+    """Replace the index with one of the signatures stored now"""
+    global index
+    fresh = LshIndex()
+    _load_signatures(fresh, db)
+    index = fresh
+
+
+def _load_signatures(target: LshIndex, db: Session) -> None:
+    rows = db.query(NoteSignature.note_id, NoteSignature.signature).yield_per(5000)
+    for note_id, data in rows:
+        target.add(note_id, signature_from_bytes(data))
@@ -0,0 +1,69 @@
+from collections import Counter
+from typing import List
+
+import numpy as np
+
+from app.utils.text_processing import split_sentences, tokenize
+
+DAMPING = 0.85
+_MAX_ITERATIONS = 100
+_TOLERANCE = 1e-6
+
+
+def _sentence_vectors(sentences: List[str]) -> np.ndarray:
+    """L2-normalised TF-IDF rows, one per sentence"""
+    counts = [Counter(tokenize(sentence)) for sentence in sentences]
+    vocabulary = {term: i for i, term in enumerate(sorted(set().union(*counts)))}
+    matrix = np.zeros((len(sentences), len(vocabulary)), dtype=np.float64)
+    for row, terms in enumerate(counts):
+        for term, count in terms.items():
+            matrix[row, vocabulary[term]] = count
+
+    df = np.count_nonzero(matrix, axis=0)
+    matrix *= np.log((1 + len(sentences)) / (1 + df)) + 1
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+    return matrix
+
+
+def rank_sentences(sentences: List[str]) -> np.ndarray:
+    """
+    TextRank scores of sentences.
+
+    Sentences are the nodes of a graph weighted by the cosine similarity
+    of their TF-IDF vectors, and the scores are its PageRank, found by
+    power iteration over the dense similarity matrix.
+    """
+    n = len(sentences)
+    if n == 0:
+        return np.zeros(0)
+    vectors = _sentence_vectors(sentences)
+    weights = vectors @ vectors.T
+    np.fill_diagonal(weights, 0.0)
+
+    # Sentences sharing no terms with any other link to every sentence
+    out = weights.sum(axis=1, keepdims=True)
+    transition = np.where(out > 0, weights / np.where(out > 0, out, 1), 1.0 / n)
+
+    scores = np.full(n, 1.0 / n)
+    for _ in range(_MAX_ITERATIONS):
+        updated = (1 - DAMPING) / n + DAMPING * (transition.T @ scores)
+        converged = np.abs(updated - scores).sum() < _TOLERANCE
+        scores = updated
+        if converged:
+            break
+    return scores
+
+
+def summarize(text: str, max_sentences: int = 3) -> str:
+    """
+    Extract the max_sentences most central sentences of text, in their
+    original order. Deterministic and fully local.
+    """
+    sentences = split_sentences(text)
+    if len(sentences) <= max_sentences:
+        return " ".join(sentences)
+    scores = rank_sentences(sentences)
+    # Stable sort so ties go to the earlier sentence
+    top = np.argsort(-scores, kind="stable")[:max_sentences]
+    return " ".join(sentences[i] for i in sorted(top.tolist()))
@@ -0,0 +1,199 @@
+"""
+Keeps the in-memory related-notes and duplicate indexes of every worker
+process up to date with the notes the other workers write.
+
+Each write to note content adds a row to the note_changes log in the same
+transaction. Every worker follows the log, shard by shard, and re-reads
+the notes other processes changed; its own changes are already applied.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+import anyio
+from sqlalchemy import delete, func, literal
+from sqlalchemy.orm import Session
+
+from app import sharding
+from app.database import SessionLocal
+from app.models.notes import Note, NoteChange, NoteSignature
+from app.services import duplicates, similarity
+
+logger = logging.getLogger(__name__)
+
+# Seconds between reads of the change log; 0 stops following it
+INDEX_SYNC_INTERVAL = float(os.getenv("INDEX_SYNC_INTERVAL", "1"))
+
+# Seconds changes stay in the log. A worker that falls further behind
+# rebuilds its indexes from the database
+INDEX_SYNC_RETENTION = float(os.getenv("INDEX_SYNC_RETENTION", "3600"))
+
+# Identifies this process in the log
+ORIGIN = uuid.uuid4().hex
+
+_BATCH = 500
+
+
+def record_change(db, note_id: int, deleted: bool = False) -> None:
+    """Log a write to a note's content; commit it with the write"""
+    db.add(NoteChange(note_id=note_id, deleted=deleted, origin=ORIGIN))
+
+
+class ChangeFollower:
+    """Applies the changes other processes logged, every `interval` seconds"""
+
+    def __init__(
+        self,
+        interval: float = INDEX_SYNC_INTERVAL,
+        retention: float = INDEX_SYNC_RETENTION,
+    ):
+        self.interval = interval
+        self.retention = retention
+        # shard (None unsharded) -> last seq applied
+        self._positions: Dict[Optional[int], int] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._last_prune: Optional[datetime] = None
+        self.applied = 0
+        self.rebuilds = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def mark(self, db: Session) -> None:
+        """
+        Follow the log from its current end. Call it before the indexes are
+        loaded, so changes made while they load are applied afterwards.
+        """
+        for shard in sharding.shard_ids(db) or [None]:
+            with sharding.on_shard(db, shard):
+                self._positions[shard] = db.query(func.max(NoteChange.seq)).scalar() or 0
+
+    def follow(self, db: Session) -> int:
+        """Apply the changes logged since the last call; returns how many"""
+        applied = 0
+        for shard in sharding.shard_ids(db) or [None]:
+            with sharding.on_shard(db, shard):
+                count = self._follow_shard(db, shard)
+            if count is None:
+                # Changes were pruned before this worker read them
+                logger.warning("Fell behind the note change log; rebuilding the indexes")
+                self.mark(db)
+                self.rebuild(db)
+                break
+            applied += count
+        self.applied += applied
+        return applied
+
+    def _follow_shard(self, db: Session, shard: Optional[int]) -> Optional[int]:
+        """Apply one shard's changes; None if some are missing from the log"""
+        position = self._positions.get(shard, 0)
+        applied = 0
+        while True:
+            rows = (
+                db.query(
+                    NoteChange.seq, NoteChange.note_id, NoteChange.deleted, NoteChange.origin
+                )
+                .filter(NoteChange.seq > position)
+                .order_by(NoteChange.seq)
+                .limit(_BATCH)
+                .all()
+            )
+            if not rows:
+                return applied
+            if rows[0].seq > position + 1 and position > 0:
+                return None
+            # The last change to each note decides what it looks like now
+            changes: Dict[int, bool] = {}
+            for _, note_id, deleted, origin in rows:
+                if origin != ORIGIN:
+                    changes[note_id] = deleted
+            self._apply(db, changes)
+            applied += len(changes)
+            position = self._positions[shard] = rows[-1].seq
+
+    @staticmethod
+    def _apply(db: Session, changes: Dict[int, bool]) -> None:
+        changed = [note_id for note_id, deleted in changes.items() if not deleted]
+        contents, signatures = {}, {}
+        if changed:
+            contents = dict(
+                db.query(Note.id, Note.content).filter(Note.id.in_(changed)).all()
+            )
+            signatures = dict(
+                db.query(NoteSignature.note_id, NoteSignature.signature)
+                .filter(NoteSignature.note_id.in_(changed))
+                .all()
+            )
+        for note_id in changes:
+            if note_id not in contents:
+                # Deleted, maybe by a change further on in the log
+                similarity.remove_note(note_id)
+                duplicates.remove_note(note_id)
+                continue
+            similarity.index.add(note_id, contents[note_id])
+            if note_id in signatures:
+                duplicates.index_signature(
+                    note_id, duplicates.signature_from_bytes(signatures[note_id])
+                )
+
+    def rebuild(self, db: Session) -> None:
+        """Rebuild both indexes from the notes in the database"""
+        similarity.index.rebuild(db.query(Note.id, Note.content).yield_per(1000))
+        duplicates.reload_index(db)
+        self.rebuilds += 1
+
+    def prune(self, db: Session) -> None:
+        """Delete changes older than the retention period"""
+        # Compared as text with the timestamps SQLite stores
+        now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+        cutoff = now - timedelta(seconds=self.retention)
+        for shard in sharding.shard_ids(db) or [None]:
+            with sharding.on_shard(db, shard):
+                db.execute(
+                    delete(NoteChange).where(
+                        NoteChange.created_at < literal(cutoff.isoformat(sep=" "))
+                    )
+                )
+                db.commit()
+
+    def sync(self) -> int:
+        """Follow the log once, and prune it at most every tenth of the retention"""
+        db = SessionLocal()
+        try:
+            applied = self.follow(db)
+            now = datetime.now(timezone.utc)
+            if self._last_prune is None or (
+                (now - self._last_prune).total_seconds() >= self.retention / 10
+            ):
+                self.prune(db)
+                self._last_prune = now
+        finally:
+            db.close()
+        return applied
+
+    async def start(self) -> None:
+        if self.running or self.interval <= 0:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if not self.running:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await anyio.to_thread.run_sync(self.sync)
+            except Exception:
+                logger.exception("Following the note change log failed")
+
+
+follower = ChangeFollower()
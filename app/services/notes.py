@@ -1,40 +1,360 @@
+import heapq
+import itertools
+
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, with_expression
 from sqlalchemy.future import select
-from sqlalchemy import delete, update
-from app.models.notes import Note, NoteHistory
-from app.schemas.notes import NoteCreate, NoteUpdate
-from typing import List, Optional
+from sqlalchemy import String, delete, literal, tuple_, type_coerce, update
+from sqlalchemy.sql import Select
+from app.models.notes import (
+    CachedSummary,
+    Note,
+    NoteAttachment,
+    NoteHistory,
+    NoteSignature,
+)
+from app.schemas.notes import TAG_SEPARATOR, NoteCreate, NoteUpdate, split_tags
+from app import sharding
+from app.services import duplicates, index_sync, precompute, similarity, tags
+from app.utils.pagination import decode_cursor, encode_cursor
+from app.utils.tracing import traced
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
 from fastapi import HTTPException
 
+
+def _signature_row(note_id: int, signature) -> NoteSignature:
+    return NoteSignature(
+        note_id=note_id, signature=duplicates.signature_to_bytes(signature)
+    )
+
+
+# Columns note listings can be sorted by; each but id has a covering index
+SORT_COLUMNS = {
+    "id": Note.id,
+    "updated_at": Note.updated_at,
+    "created_at": Note.created_at,
+    "title": Note.title,
+}
+
+
+def _timestamp(value: datetime) -> str:
+    """
+    A datetime as SQLite stores timestamps, for comparing with the stored
+    text; aware datetimes are converted to UTC, like CURRENT_TIMESTAMP
+    """
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat(sep=" ")
+
+
+def _decode_note_cursor(cursor: Optional[str], sort: str) -> Optional[List[Any]]:
+    """The position a listing cursor continues after; a 400 if it is not one"""
+    if cursor is None:
+        return None
+    if sort == "id":
+        after = decode_cursor(cursor, 1)
+        valid = isinstance(after[0], int)
+    else:
+        after = decode_cursor(cursor, 3)
+        valid = after[0] == sort and isinstance(after[1], str) and isinstance(after[2], int)
+    if not valid:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return after[0] if sort == "id" else after[1:]
+
+
+def _note_ids_query(limit: int) -> Select:
+    return select(Note.id).order_by(Note.id).limit(limit)
+
+
+def _last_skipped(id_pages: List[List[int]], skip: int) -> Optional[int]:
+    """The last of the first `skip` ids across shards, or None if there are fewer"""
+    return next(itertools.islice(heapq.merge(*id_pages), skip - 1, None), None)
+
+
+def _history_query(note_id: int):
+    return (
+        select(Note.id, NoteHistory)
+        .outerjoin(NoteHistory, NoteHistory.note_id == Note.id)
+        .filter(Note.id == note_id)
+        .order_by(NoteHistory.created_at)
+    )
+
+
+def _history_of(rows) -> List[NoteHistory]:
+    """The versions in rows of _history_query, or a 404 if the note is missing"""
+    if not rows:
+        raise HTTPException(status_code=404, detail="Note not found")
+    return [version for _, version in rows if version is not None]
+
+
+def note_list_query(
+    skip: int,
+    limit: int,
+    tag_counts: Optional[Dict[int, int]] = None,
+    match_all: bool = True,
+    sort: str = "id",
+    descending: bool = False,
+    after: Optional[Any] = None,
+    updated_since: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    with_content: bool = True,
+    keys_only: bool = False,
+) -> Select:
+    """
+    The query behind note listings.
+
+    Notes are ordered by the sort column and then id, which the sort
+    column's index provides, so a page reads `skip + limit` index entries
+    from the cursor on. `after` is the id, or the stored sort value and id,
+    of the last note of the previous page; the stored value is selected as
+    `sort_key`. Without content every column comes from that index, and
+    with `keys_only` only the id and `sort_key` are selected.
+    """
+    key = SORT_COLUMNS[sort]
+    if keys_only:
+        columns = [Note.id]
+    else:
+        columns = [Note.id, Note.title, Note.created_at, Note.updated_at]
+        if with_content:
+            columns.insert(2, Note.content)
+        columns.append(tags.tag_names.label("tags"))
+    if sort != "id":
+        # The text SQLite stores, so the cursor compares equal to it
+        columns.append(type_coerce(key, String).label("sort_key"))
+    query = select(*columns)
+
+    if updated_since is not None:
+        query = query.where(Note.updated_at >= literal(_timestamp(updated_since)))
+    if created_before is not None:
+        query = query.where(Note.created_at < literal(_timestamp(created_before)))
+
+    if tag_counts is not None:
+        if sort == "id" and updated_since is None and created_before is None:
+            # Pages of the tag index, in the same order as the listing
+            note_ids = tags.tagged_note_ids(
+                tag_counts, match_all, after, skip + limit, descending
+            )
+            query = query.where(Note.id.in_(note_ids))
+        else:
+            query = query.where(tags.note_has_tags(list(tag_counts), match_all))
+
+    if after is not None:
+        if sort == "id":
+            query = query.where(Note.id < after if descending else Note.id > after)
+        else:
+            position = tuple_(literal(after[0]), literal(after[1]))
+            sort_position = tuple_(key, Note.id)
+            query = query.where(
+                sort_position < position if descending else sort_position > position
+            )
+
+    if descending:
+        query = query.order_by(key.desc(), Note.id.desc())
+    elif sort == "id":
+        query = query.order_by(Note.id)
+    else:
+        query = query.order_by(key, Note.id)
+    return query.offset(skip).limit(limit)
+
+
 # Async versions
 
+@traced()
 async def create_note_async(db: AsyncSession, note: NoteCreate) -> Note:
     """Create a new note (async)"""
-    db_note = Note(title=note.title, content=note.content)
+    signature = duplicates.compute_signature(note.content)
+    db_note = Note(
+        id=await sharding.new_id_async(db), title=note.title, content=note.content
+    )
     db.add(db_note)
+    await db.flush()
+    db.add(_signature_row(db_note.id, signature))
+    index_sync.record_change(db, db_note.id)
+    if note.tags:
+        await db.run_sync(tags.set_note_tags, db_note.id, note.tags, True)
     await db.commit()
     await db.refresh(db_note)
+    db_note.tags = TAG_SEPARATOR.join(note.tags)
+    similarity.index_note(db_note)
+    duplicates.index_signature(db_note.id, signature)
+    precompute.precomputer.schedule(db_note.id)
     return db_note
 
 
+@traced()
 async def get_note_async(db: AsyncSession, note_id: int) -> Note:
     """Get a note by ID (async)"""
-    result = await db.execute(select(Note).filter(Note.id == note_id))
+    result = await db.execute(
+        select(Note)
+        .options(with_expression(Note.tags, tags.tag_names))
+        .filter(Note.id == note_id)
+    )
     note = result.scalars().first()
     if note is None:
         raise HTTPException(status_code=404, detail="Note not found")
     return note
 
 
+@traced()
+async def get_notes_by_ids_async(
+    db: AsyncSession, note_ids: List[int]
+) -> List[Note]:
+    """Get several notes in one query, skipping ids that do not exist (async)"""
+    result = await db.execute(select(Note).filter(Note.id.in_(note_ids)))
+    return result.scalars().all()
+
+
+@traced()
 async def get_all_notes_async(
     db: AsyncSession, skip: int = 0, limit: int = 100
 ) -> List[Note]:
     """Get all notes with pagination (async)"""
-    result = await db.execute(select(Note).offset(skip).limit(limit))
-    return result.scalars().all()
+    query = (
+        select(Note)
+        .options(with_expression(Note.tags, tags.tag_names))
+        .order_by(Note.id)
+    )
+    if sharding.shard_ids(db) is None:
+        result = await db.execute(query.offset(skip).limit(limit))
+        return result.scalars().all()
+    # Every shard is read at once, from after the last skipped note
+    if skip:
+        id_pages = await sharding.gather_shards(
+            db, lambda shard_db: _all_async(shard_db, _note_ids_query(skip))
+        )
+        last = _last_skipped(id_pages, skip)
+        if last is None:
+            return []
+        query = query.where(Note.id > last)
+    pages = await sharding.gather_shards(
+        db, lambda shard_db: _all_async(shard_db, query.limit(limit))
+    )
+    merged = heapq.merge(*pages, key=lambda note: note.id)
+    return list(itertools.islice(merged, limit))
 
 
+async def _all_async(db: AsyncSession, query: Select) -> List[Any]:
+    return (await db.execute(query)).scalars().all()
+
+
+@traced()
+async def get_all_note_rows_async(
+    db: AsyncSession, skip: int = 0, limit: int = 100
+) -> List[Dict[str, Any]]:
+    """
+    Get notes with pagination as plain dicts (async)
+
+    Selects the columns directly instead of loading ORM objects, for
+    responses that are rendered without further validation.
+    """
+    rows, _ = await list_note_rows_async(db, skip, limit)
+    return rows
+
+
+async def _note_rows_async(
+    db: AsyncSession, tag_names: Optional[List[str]], skip: int, limit: int, **query
+) -> List[Dict[str, Any]]:
+    """Rows of note_list_query, looking up the ids of `tag_names` first"""
+    tag_counts = None
+    if tag_names:
+        tag_counts = await tags.get_tag_ids_async(db, tag_names)
+        if not tag_counts or (
+            query["match_all"] and len(tag_counts) < len(set(tag_names))
+        ):
+            return []
+    result = await db.execute(
+        note_list_query(skip, limit, tag_counts=tag_counts, **query)
+    )
+    return [dict(row) for row in result.mappings()]
+
+
+async def _merged_note_rows_async(
+    db: AsyncSession, tag_names: Optional[List[str]], skip: int, limit: int, **query
+) -> List[Dict[str, Any]]:
+    """
+    _note_rows_async over every shard, merged in listing order.
+
+    The shards are read at once. To skip notes, the first `skip` keys of
+    every shard are merged to find the last skipped note, and the page is
+    read after it, so each shard reads `skip` index entries and only
+    `limit` rows.
+    """
+    sort, descending = query["sort"], query["descending"]
+
+    def position(row):
+        return (row["id"],) if sort == "id" else (row["sort_key"], row["id"])
+
+    if skip:
+        key_pages = await sharding.gather_shards(
+            db,
+            lambda shard_db: _note_rows_async(
+                shard_db, tag_names, 0, skip, keys_only=True, **query
+            ),
+        )
+        merged = heapq.merge(*key_pages, key=position, reverse=descending)
+        last = next(itertools.islice(merged, skip - 1, None), None)
+        if last is None:
+            return []
+        query["after"] = last["id"] if sort == "id" else [last["sort_key"], last["id"]]
+    pages = await sharding.gather_shards(
+        db, lambda shard_db: _note_rows_async(shard_db, tag_names, 0, limit, **query)
+    )
+    merged = heapq.merge(*pages, key=position, reverse=descending)
+    return list(itertools.islice(merged, limit))
+
+
+@traced()
+async def list_note_rows_async(
+    db: AsyncSession,
+    skip: int = 0,
+    limit: int = 100,
+    tag_names: Optional[List[str]] = None,
+    match_all: bool = True,
+    sort: str = "id",
+    descending: bool = False,
+    cursor: Optional[str] = None,
+    updated_since: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    with_content: bool = True,
+) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Get a page of notes as plain dicts, and the cursor of the next page (async)
+
+    Notes can be limited to those with all (or, without `match_all`, any)
+    of `tag_names` and to a time range, and are sorted by `sort`. The
+    cursor is None on the last page. Sharded, each shard's page is read and
+    the pages are merged.
+    """
+    after = _decode_note_cursor(cursor, sort)
+    query = dict(
+        match_all=match_all,
+        sort=sort,
+        descending=descending,
+        after=after,
+        updated_since=updated_since,
+        created_before=created_before,
+        with_content=with_content,
+    )
+    # One more row than the page tells whether there is a next one
+    if sharding.shard_ids(db) is None:
+        rows = await _note_rows_async(db, tag_names, skip, limit + 1, **query)
+    else:
+        rows = await _merged_note_rows_async(db, tag_names, skip, limit + 1, **query)
+    has_next = len(rows) > limit
+    del rows[limit:]
+    sort_key = None
+    for row in rows:
+        row["tags"] = split_tags(row["tags"])
+        sort_key = row.pop("sort_key", None)
+
+    if not has_next:
+        return rows, None
+    last_id = rows[-1]["id"]
+    return rows, encode_cursor([last_id] if sort == "id" else [sort, sort_key, last_id])
+
+
+@traced()
 async def update_note_async(
     db: AsyncSession, note_id: int, note_update: NoteUpdate
 ) -> Note:
@@ -48,62 +368,178 @@ async def update_note_async(
     db.add(note_history)
 
     # Update note with new values
+    signature = None
     if note_update.title is not None:
         db_note.title = note_update.title
     if note_update.content is not None:
         db_note.content = note_update.content
+        signature = duplicates.compute_signature(db_note.content)
+        await db.merge(_signature_row(db_note.id, signature))
+        index_sync.record_change(db, db_note.id)
+    note_tags = db_note.tags
+    if note_update.tags is not None:
+        await db.run_sync(tags.set_note_tags, db_note.id, note_update.tags)
+        note_tags = TAG_SEPARATOR.join(note_update.tags)
 
     await db.commit()
     await db.refresh(db_note)
+    db_note.tags = note_tags
+    similarity.index_note(db_note)
+    if signature is not None:
+        duplicates.index_signature(db_note.id, signature)
+    precompute.precomputer.schedule(db_note.id)
     return db_note
 
 
+@traced()
 async def delete_note_async(db: AsyncSession, note_id: int) -> bool:
     """Delete a note (async)"""
     db_note = await get_note_async(db, note_id)
+    await db.run_sync(tags.remove_note_tags, note_id)
+    await db.execute(delete(NoteSignature).where(NoteSignature.note_id == note_id))
+    await db.execute(delete(CachedSummary).where(CachedSummary.note_id == note_id))
+    # Their content stays until attachment garbage collection
+    await db.execute(delete(NoteAttachment).where(NoteAttachment.note_id == note_id))
     await db.delete(db_note)
+    index_sync.record_change(db, note_id, deleted=True)
     await db.commit()
+    similarity.remove_note(note_id)
+    duplicates.remove_note(note_id)
     return True
 
 
+@traced()
 async def get_note_history_async(
     db: AsyncSession, note_id: int
 ) -> List[NoteHistory]:
-    """Get the history of a note (async)"""
+    """
+    Get the history of a note (async)
+
+    The history is outer-joined to the note's id, so a missing note still
+    gives a 404 without loading the note in a query of its own.
+    """
+    result = await db.execute(_history_query(note_id))
+    return _history_of(result.all())
+
+
+@traced()
+async def get_related_notes_async(
+    db: AsyncSession, note_id: int, k: int = 10
+) -> List[Dict[str, Any]]:
+    """Get the notes most similar to a note (async)"""
     note = await get_note_async(db, note_id)
+    if note.id not in similarity.index:
+        similarity.index_note(note)
+
+    ranked = similarity.index.related(note.id, k)
+    if not ranked:
+        return []
+
     result = await db.execute(
-        select(NoteHistory)
-        .filter(NoteHistory.note_id == note_id)
-        .order_by(NoteHistory.created_at)
+        select(Note.id, Note.title).filter(Note.id.in_([i for i, _ in ranked]))
     )
-    return result.scalars().all()
+    titles = dict(result.all())
+    return [
+        {"note_id": other_id, "title": titles[other_id], "score": score}
+        for other_id, score in ranked
+        if other_id in titles
+    ]
+
+
+@traced()
+async def get_duplicate_notes_async(
+    db: AsyncSession, note_id: int, threshold: float = duplicates.DEFAULT_THRESHOLD
+) -> List[Dict[str, Any]]:
+    """Get the near duplicates of a note (async)"""
+    note = await get_note_async(db, note_id)
+    if note.id not in duplicates.index:
+        duplicates.index_signature(note.id, duplicates.compute_signature(note.content))
+
+    matches = duplicates.index.duplicates(note.id, threshold)
+    if not matches:
+        return []
+
+    result = await db.execute(
+        select(Note.id, Note.title).filter(Note.id.in_([i for i, _ in matches]))
+    )
+    titles = dict(result.all())
+    return [
+        {"note_id": other_id, "title": titles[other_id], "similarity": score}
+        for other_id, score in matches
+        if other_id in titles
+    ]
 
 
 # Sync versions for testing
 
 
+@traced()
 def create_note(db: Session, note: NoteCreate) -> Note:
     """Create a new note (sync)"""
-    db_note = Note(title=note.title, content=note.content)
+    signature = duplicates.compute_signature(note.content)
+    db_note = Note(id=sharding.new_id(db), title=note.title, content=note.content)
     db.add(db_note)
+    db.flush()
+    db.add(_signature_row(db_note.id, signature))
+    index_sync.record_change(db, db_note.id)
+    if note.tags:
+        tags.set_note_tags(db, db_note.id, note.tags, new=True)
     db.commit()
     db.refresh(db_note)
+    db_note.tags = TAG_SEPARATOR.join(note.tags)
+    similarity.index_note(db_note)
+    duplicates.index_signature(db_note.id, signature)
     return db_note
 
 
+@traced()
 def get_note(db: Session, note_id: int) -> Note:
     """Get a note by ID (sync)"""
-    note = db.query(Note).filter(Note.id == note_id).first()
+    note = (
+        db.query(Note)
+        .options(with_expression(Note.tags, tags.tag_names))
+        .filter(Note.id == note_id)
+        .first()
+    )
     if note is None:
         raise HTTPException(status_code=404, detail="Note not found")
     return note
 
 
+@traced()
 def get_all_notes(db: Session, skip: int = 0, limit: int = 100) -> List[Note]:
     """Get all notes with pagination (sync)"""
-    return db.query(Note).offset(skip).limit(limit).all()
+    if sharding.shard_ids(db) is None:
+        return (
+            db.query(Note)
+            .options(with_expression(Note.tags, tags.tag_names))
+            .order_by(Note.id)
+            .offset(skip)
+            .limit(limit)
+            .all()
+        )
+    query = (
+        select(Note)
+        .options(with_expression(Note.tags, tags.tag_names))
+        .order_by(Note.id)
+    )
+    # As get_all_notes_async, with the shards read in threads
+    if skip:
+        id_pages = sharding.map_shards(
+            db, lambda shard_db: shard_db.execute(_note_ids_query(skip)).scalars().all()
+        )
+        last = _last_skipped(id_pages, skip)
+        if last is None:
+            return []
+        query = query.where(Note.id > last)
+    pages = sharding.map_shards(
+        db, lambda shard_db: shard_db.execute(query.limit(limit)).scalars().all()
+    )
+    merged = heapq.merge(*pages, key=lambda note: note.id)
+    return list(itertools.islice(merged, limit))
 
 
+@traced()
 def update_note(db: Session, note_id: int, note_update: NoteUpdate) -> Note:
     """Update a note and save the previous version to history (sync)"""
     db_note = get_note(db, note_id)
@@ -115,30 +551,45 @@ def update_note(db: Session, note_id: int, note_update: NoteUpdate) -> Note:
     db.add(note_history)
 
     # Update note with new values
+    signature = None
     if note_update.title is not None:
         db_note.title = note_update.title
     if note_update.content is not None:
         db_note.content = note_update.content
+        signature = duplicates.compute_signature(db_note.content)
+        db.merge(_signature_row(db_note.id, signature))
+        index_sync.record_change(db, db_note.id)
+    note_tags = db_note.tags
+    if note_update.tags is not None:
+        tags.set_note_tags(db, db_note.id, note_update.tags)
+        note_tags = TAG_SEPARATOR.join(note_update.tags)
 
     db.commit()
     db.refresh(db_note)
+    db_note.tags = note_tags
+    similarity.index_note(db_note)
+    if signature is not None:
+        duplicates.index_signature(db_note.id, signature)
     return db_note
 
 
+@traced()
 def delete_note(db: Session, note_id: int) -> bool:
     """Delete a note (sync)"""
     db_note = get_note(db, note_id)
+    tags.remove_note_tags(db, note_id)
+    db.execute(delete(NoteSignature).where(NoteSignature.note_id == note_id))
+    db.execute(delete(CachedSummary).where(CachedSummary.note_id == note_id))
+    db.execute(delete(NoteAttachment).where(NoteAttachment.note_id == note_id))
     db.delete(db_note)
+    index_sync.record_change(db, note_id, deleted=True)
     db.commit()
+    similarity.remove_note(note_id)
+    duplicates.remove_note(note_id)
     return True
 
 
+@traced()
 def get_note_history(db: Session, note_id: int) -> List[NoteHistory]:
     """Get the history of a note (sync)"""
-    note = get_note(db, note_id)
-    return (
-        db.query(NoteHistory)
-        .filter(NoteHistory.note_id == note_id)
-        .order_by(NoteHistory.created_at)
-        .all()
-    )
+    return _history_of(db.execute(_history_query(note_id)).all())
@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.database import AsyncSessionLocal
+from app.models.notes import Note
+from app.services import summaries
+
+logger = logging.getLogger(__name__)
+
+# Generate summaries in the background when notes are created or edited
+SUMMARY_PRECOMPUTE = os.getenv("SUMMARY_PRECOMPUTE", "0") == "1"
+
+# Seconds to wait after the last write to a note before summarizing it, so
+# a burst of edits produces a single summary
+SUMMARY_PRECOMPUTE_DELAY = float(os.getenv("SUMMARY_PRECOMPUTE_DELAY", "5"))
+
+SUMMARY_PRECOMPUTE_WORKERS = int(os.getenv("SUMMARY_PRECOMPUTE_WORKERS", "2"))
+
+# Notes waiting to be summarized beyond this are dropped
+SUMMARY_PRECOMPUTE_QUEUE_SIZE = int(os.getenv("SUMMARY_PRECOMPUTE_QUEUE_SIZE", "1000"))
+
+# Seconds shutdown waits for summaries already being generated
+SUMMARY_PRECOMPUTE_DRAIN_TIMEOUT = float(
+    os.getenv("SUMMARY_PRECOMPUTE_DRAIN_TIMEOUT", "10")
+)
+
+
+class SummaryPrecomputer:
+    """
+    Write-behind queue that summarizes notes after they are written.
+
+    schedule() records a note with a due time SUMMARY_PRECOMPUTE_DELAY in
+    the future; scheduling it again before then only pushes the due time
+    back. A dispatcher hands due notes to a fixed pool of workers, which
+    summarize them through the summaries service so the results land in
+    the summary cache. While the precomputer is not running, schedule()
+    does nothing.
+    """
+
+    def __init__(
+        self,
+        delay: float = SUMMARY_PRECOMPUTE_DELAY,
+        workers: int = SUMMARY_PRECOMPUTE_WORKERS,
+        maxsize: int = SUMMARY_PRECOMPUTE_QUEUE_SIZE,
+    ):
+        self.delay = delay
+        self.workers = workers
+        self.maxsize = maxsize
+        self._session_factory: Callable[[], Any] = AsyncSessionLocal
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # note id -> (due time, time first scheduled)
+        self._pending: Dict[int, Tuple[float, float]] = {}
+        self._ready: Optional[asyncio.Queue] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+
+        self.scheduled = 0
+        self.debounced = 0
+        self.dropped = 0
+        self.completed = 0
+        self.failed = 0
+        self.in_progress = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self, session_factory: Optional[Callable[[], Any]] = None) -> None:
+        if self.running:
+            return
+        if session_factory is not None:
+            self._session_factory = session_factory
+        self._loop = asyncio.get_running_loop()
+        self._ready = asyncio.Queue()
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._dispatch())] + [
+            asyncio.create_task(self._work()) for _ in range(self.workers)
+        ]
+
+    async def stop(self, timeout: float = SUMMARY_PRECOMPUTE_DRAIN_TIMEOUT) -> None:
+        """
+        Stop accepting work, let notes already due finish for up to timeout
+        seconds and cancel the rest. Notes still waiting out their delay
+        are discarded and counted as dropped.
+        """
+        if not self.running:
+            return
+        dispatcher, workers = self._tasks[0], self._tasks[1:]
+        dispatcher.cancel()
+        self.dropped += len(self._pending)
+        self._pending.clear()
+        try:
+            await asyncio.wait_for(self._ready.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Summary precompute queue not drained before shutdown")
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.dropped += self._ready.qsize()
+        self._tasks = []
+
+    def schedule(self, note_id: int) -> None:
+        """Queue a note for summarization once its writes settle"""
+        if not self.running:
+            return
+        now = self._loop.time()
+        entry = self._pending.get(note_id)
+        if entry is not None:
+            self.debounced += 1
+            self._pending[note_id] = (now + self.delay, entry[1])
+            return
+        if len(self._pending) + self._ready.qsize() >= self.maxsize:
+            self.dropped += 1
+            return
+        self.scheduled += 1
+        self._pending[note_id] = (now + self.delay, now)
+        self._wakeup.set()
+
+    async def _dispatch(self) -> None:
+        while True:
+            now = self._loop.time()
+            due = [
+                note_id for note_id, (at, _) in self._pending.items() if at <= now
+            ]
+            for note_id in due:
+                _, first = self._pending.pop(note_id)
+                self._ready.put_nowait((note_id, first))
+
+            next_due = min((at for at, _ in self._pending.values()), default=None)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(),
+                    None if next_due is None else max(0.0, next_due - now),
+                )
+            except asyncio.TimeoutError:
+                pass
+
+    async def _work(self) -> None:
+        while True:
+            note_id, first = await self._ready.get()
+            self.in_progress += 1
+            try:
+                async with self._session_factory() as db:
+                    note = await db.get(Note, note_id)
+                    # Deleted since it was scheduled
+                    if note is not None:
+                        await summaries.get_summary_async(db, note)
+                self.completed += 1
+                self.last_lag = self._loop.time() - first
+                self.max_lag = max(self.max_lag, self.last_lag)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failed += 1
+                logger.exception("Precomputing summary of note %s failed", note_id)
+            finally:
+                self.in_progress -= 1
+                self._ready.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "depth": len(self._pending) + (self._ready.qsize() if self._ready else 0),
+            "in_progress": self.in_progress,
+            "scheduled": self.scheduled,
+            "debounced": self.debounced,
+            "dropped": self.dropped,
+            "completed": self.completed,
+            "failed": self.failed,
+            "last_lag_seconds": round(self.last_lag, 3),
+            "max_lag_seconds": round(self.max_lag, 3),
+        }
+
+
+precomputer = SummaryPrecomputer()
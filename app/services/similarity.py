@@ -0,0 +1,445 @@
+import os
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from sqlalchemy import literal
+from sqlalchemy.orm import Session
+
+from app.models.notes import Note
+from app.utils.text_processing import tokenize
+
+# Where the index is persisted between restarts
+TFIDF_INDEX_PATH = os.getenv("TFIDF_INDEX_PATH", "./tfidf_index.npz")
+
+# The delta of recently written notes is folded into the compiled matrix
+# once it holds more than this share of the corpus (or COMPACT_MIN notes),
+# and at most COMPACT_MAX_PENDING notes, since every query scores it
+COMPACT_RATIO = 0.1
+COMPACT_MIN = 256
+COMPACT_MAX_PENDING = int(os.getenv("TFIDF_MAX_PENDING", "2000"))
+
+# Query terms that appear in more than this share of notes are pruned
+DEFAULT_MAX_DF_RATIO = 0.5
+
+
+class TfidfIndex:
+    """
+    Incrementally maintained sparse TF-IDF matrix over note content.
+
+    Raw term counts per note are the source of truth. They are compiled
+    into a column-major (CSC) matrix of L2-normalised TF-IDF weights, so
+    a query only reads the posting lists of its own terms. Notes written
+    since the last compaction are kept in a small delta that is scored
+    directly, and compiled rows that were updated or deleted are masked
+    out until the next compaction. Writes that fill the delta start a
+    compaction in a background thread, which compiles a snapshot without
+    holding the lock, so writes and queries carry on meanwhile.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        # Held for a whole compaction, so only one runs at a time
+        self._compaction = threading.Lock()
+        self._compactor: Optional[threading.Thread] = None
+        self._generation = 0
+        self._reset()
+
+    def _reset(self) -> None:
+        # A compaction in progress was of the replaced index
+        self._generation += 1
+        self._touched: Optional[Set[int]] = None
+        self._vocab: Dict[str, int] = {}
+        self._df = np.zeros(1024, dtype=np.int64)
+        self._docs: Dict[int, Tuple[np.ndarray, np.ndarray]] = {}
+        self._pending: Set[int] = set()
+        # Weights of the delta, kept until the next write
+        self._pending_weights = None
+
+        # Compiled CSC matrix: column t holds rows _rows[_indptr[t]:_indptr[t+1]]
+        self._row_ids = np.zeros(0, dtype=np.int64)
+        self._row_of: Dict[int, int] = {}
+        self._alive = np.zeros(0, dtype=bool)
+        self._indptr = np.zeros(1, dtype=np.int64)
+        self._rows = np.zeros(0, dtype=np.int32)
+        self._data = np.zeros(0, dtype=np.float32)
+        self._idf = np.zeros(0, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def __contains__(self, note_id: int) -> bool:
+        return note_id in self._docs
+
+    def note_ids(self) -> Set[int]:
+        """Ids of every indexed note"""
+        with self._lock:
+            return set(self._docs)
+
+    # ---------- writes ----------
+
+    def add(self, note_id: int, text: str) -> None:
+        """Index a note, replacing any previous version of it"""
+        counts = Counter(tokenize(text))
+        with self._lock:
+            self._discard(note_id)
+            self._insert(note_id, counts)
+            self._pending.add(note_id)
+            if self._touched is not None:
+                self._touched.add(note_id)
+            limit = min(max(COMPACT_MIN, COMPACT_RATIO * len(self._docs)), COMPACT_MAX_PENDING)
+            due = len(self._pending) > limit
+        if due:
+            self.compact_in_background()
+
+    def remove(self, note_id: int) -> None:
+        """Drop a note from the index"""
+        with self._lock:
+            self._discard(note_id)
+
+    def rebuild(self, notes: Iterable[Tuple[int, str]]) -> None:
+        """Replace the whole index with the given (id, content) pairs"""
+        with self._lock:
+            self._reset()
+            for note_id, content in notes:
+                self._insert(note_id, Counter(tokenize(content)))
+        self.compact()
+
+    def compact(self) -> None:
+        """Recompute IDF and fold every indexed note into the CSC matrix"""
+        with self._compaction:
+            with self._lock:
+                generation = self._generation
+                ids = list(self._docs.keys())
+                docs = [self._docs[note_id] for note_id in ids]
+                n_terms = len(self._vocab)
+                df = self._df[:n_terms].copy()
+                # Notes written from here on stay in the delta
+                self._touched = set()
+            try:
+                compiled = self._compile(ids, docs, df)
+            finally:
+                with self._lock:
+                    touched, self._touched = self._touched, None
+            with self._lock:
+                if generation == self._generation:
+                    self._install(compiled, touched)
+
+    def compact_in_background(self) -> None:
+        """Start a compaction in a worker thread unless one is running"""
+        with self._lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                return
+            self._compactor = threading.Thread(
+                target=self.compact, name="tfidf-compaction", daemon=True
+            )
+            self._compactor.start()
+
+    @classmethod
+    def _compile(cls, ids: List[int], docs: List[Tuple[np.ndarray, np.ndarray]], df: np.ndarray):
+        """The CSC matrix of a snapshot of the notes and document frequencies"""
+        n_docs = len(ids)
+        n_terms = len(df)
+        idf = (np.log((1.0 + n_docs) / (1.0 + df)) + 1.0).astype(np.float32)
+
+        if n_docs:
+            lengths = np.fromiter(
+                (len(terms) for terms, _ in docs), dtype=np.int64, count=n_docs
+            )
+            terms = np.concatenate([t for t, _ in docs]).astype(np.int64)
+            tf = np.concatenate([c for _, c in docs])
+        else:
+            lengths = np.zeros(0, dtype=np.int64)
+            terms = np.zeros(0, dtype=np.int64)
+            tf = np.zeros(0, dtype=np.float32)
+
+        doc_rows = np.repeat(np.arange(n_docs, dtype=np.int32), lengths)
+        weights = cls._normalise(doc_rows, terms, tf, idf, n_docs)
+
+        order = np.argsort(terms, kind="stable")
+        indptr = np.zeros(n_terms + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=n_terms), out=indptr[1:])
+        return np.array(ids, dtype=np.int64), indptr, doc_rows[order], weights[order], idf
+
+    def _install(self, compiled, touched: Set[int]) -> None:
+        """Swap in a compiled matrix; notes touched since its snapshot stay in the delta"""
+        self._row_ids, self._indptr, self._rows, self._data, self._idf = compiled
+        self._row_of = {note_id: row for row, note_id in enumerate(self._row_ids.tolist())}
+        self._alive = np.ones(len(self._row_ids), dtype=bool)
+        for note_id in touched:
+            row = self._row_of.get(note_id)
+            if row is not None:
+                self._alive[row] = False
+        self._pending = self._pending & touched
+        self._pending_weights = None
+
+    # ---------- reads ----------
+
+    def related(
+        self,
+        note_id: int,
+        k: int = 10,
+        min_score: float = 0.0,
+        max_terms: Optional[int] = None,
+        max_df_ratio: Optional[float] = DEFAULT_MAX_DF_RATIO,
+    ) -> List[Tuple[int, float]]:
+        """
+        Return up to k (note_id, cosine similarity) pairs most similar to
+        the given note, best first.
+
+        max_terms keeps only the heaviest query terms and max_df_ratio drops
+        query terms common to most notes; both trade a little recall for
+        reading fewer posting lists.
+        """
+        with self._lock:
+            doc = self._docs.get(note_id)
+            if doc is None or k <= 0:
+                return []
+
+            q_terms, q_weights = self._query_vector(doc, max_terms, max_df_ratio)
+            if len(q_terms) == 0:
+                return []
+
+            candidates = self._score_compiled(q_terms, q_weights, k + 1)
+            candidates.extend(self._score_pending(q_terms, q_weights))
+
+        best: Dict[int, float] = {}
+        for other_id, score in candidates:
+            if other_id != note_id and score > min_score:
+                best[other_id] = score
+        ranked = sorted(best.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:k]
+
+    # ---------- persistence ----------
+
+    def save(self, path: str) -> None:
+        """
+        Write the raw term counts to an .npz file atomically, with the time
+        they were taken, to the second, as SQLite stores timestamps
+        """
+        with self._lock:
+            saved_at = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+            ids = list(self._docs.keys())
+            docs = [self._docs[note_id] for note_id in ids]
+            indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+            if docs:
+                np.cumsum([len(terms) for terms, _ in docs], out=indptr[1:])
+                term_ids = np.concatenate([t for t, _ in docs])
+                counts = np.concatenate([c for _, c in docs])
+            else:
+                term_ids = np.zeros(0, dtype=np.int32)
+                counts = np.zeros(0, dtype=np.float32)
+            vocab = np.array(sorted(self._vocab, key=self._vocab.get), dtype=str)
+
+        # Per process, so saves from separate processes never share a file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as fh:
+            np.savez_compressed(
+                fh,
+                vocab=vocab,
+                ids=np.array(ids, dtype=np.int64),
+                indptr=indptr,
+                term_ids=term_ids,
+                counts=counts,
+                saved_at=np.array(saved_at.isoformat(sep=" ")),
+            )
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> Optional[str]:
+        """
+        Replace the index with one previously written by save(); returns
+        when it was saved, or None for files from before that was recorded
+        """
+        with np.load(path, allow_pickle=False) as data:
+            saved_at = str(data["saved_at"]) if "saved_at" in data.files else None
+            vocab = data["vocab"].tolist()
+            ids = data["ids"].tolist()
+            indptr = data["indptr"]
+            term_ids = data["term_ids"].astype(np.int32)
+            counts = data["counts"].astype(np.float32)
+
+        with self._lock:
+            self._reset()
+            self._vocab = {term: i for i, term in enumerate(vocab)}
+            self._df = np.zeros(max(1024, len(vocab)), dtype=np.int64)
+            self._df[: len(vocab)] = np.bincount(term_ids, minlength=len(vocab))
+            for i, note_id in enumerate(ids):
+                start, end = indptr[i], indptr[i + 1]
+                self._docs[note_id] = (term_ids[start:end], counts[start:end])
+        self.compact()
+        return saved_at
+
+    # ---------- internals ----------
+
+    def _term_id(self, term: str) -> int:
+        term_id = self._vocab.get(term)
+        if term_id is None:
+            term_id = len(self._vocab)
+            self._vocab[term] = term_id
+            if term_id >= len(self._df):
+                self._df = np.concatenate([self._df, np.zeros_like(self._df)])
+        return term_id
+
+    def _insert(self, note_id: int, counts: Counter) -> None:
+        term_ids = np.fromiter(
+            (self._term_id(term) for term in counts),
+            dtype=np.int32,
+            count=len(counts),
+        )
+        tf = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+        self._df[term_ids] += 1
+        self._docs[note_id] = (term_ids, tf)
+        self._pending_weights = None
+
+    def _discard(self, note_id: int) -> None:
+        doc = self._docs.pop(note_id, None)
+        if doc is None:
+            return
+        self._df[doc[0]] -= 1
+        self._pending.discard(note_id)
+        self._pending_weights = None
+        if self._touched is not None:
+            self._touched.add(note_id)
+        row = self._row_of.get(note_id)
+        if row is not None:
+            self._alive[row] = False
+
+    def _idf_for(self, term_ids: np.ndarray) -> np.ndarray:
+        n_docs = len(self._docs)
+        df = self._df[term_ids]
+        return (np.log((1.0 + n_docs) / (1.0 + df)) + 1.0).astype(np.float32)
+
+    @staticmethod
+    def _normalise(doc_rows, terms, tf, idf, n_docs) -> np.ndarray:
+        weights = ((1.0 + np.log(tf)) * idf[terms]).astype(np.float32)
+        norms = np.sqrt(np.bincount(doc_rows, weights=weights ** 2, minlength=n_docs))
+        norms[norms == 0] = 1.0
+        return (weights / norms[doc_rows]).astype(np.float32)
+
+    def _query_vector(self, doc, max_terms, max_df_ratio):
+        terms, tf = doc
+        weights = (1.0 + np.log(tf)) * self._idf_for(terms)
+        norm = np.sqrt(np.dot(weights, weights))
+        if norm == 0:
+            return terms[:0], weights[:0]
+        weights = weights / norm
+
+        keep = np.ones(len(terms), dtype=bool)
+        if max_df_ratio is not None and len(self._docs) > 1:
+            keep &= self._df[terms] <= max(1, max_df_ratio * len(self._docs))
+        terms, weights = terms[keep], weights[keep]
+        if max_terms is not None and len(terms) > max_terms:
+            top = np.argpartition(-weights, max_terms - 1)[:max_terms]
+            terms, weights = terms[top], weights[top]
+        return terms, weights
+
+    def _score_compiled(self, q_terms, q_weights, k) -> List[Tuple[int, float]]:
+        n_rows = len(self._row_ids)
+        compiled = q_terms < len(self._indptr) - 1
+        if n_rows == 0 or not compiled.any():
+            return []
+
+        q_terms, q_weights = q_terms[compiled], q_weights[compiled]
+        starts = self._indptr[q_terms]
+        ends = self._indptr[q_terms + 1]
+        lengths = ends - starts
+        if lengths.sum() == 0:
+            return []
+
+        # Gather every posting of every query term in one vectorised pass
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        positions = offsets + np.arange(lengths.sum())
+        contrib = self._data[positions] * np.repeat(q_weights, lengths)
+        # Scores are summed over the rows the postings reach only, so a
+        # query allocates nothing in proportion to the corpus
+        rows, inverse = np.unique(self._rows[positions], return_inverse=True)
+        scores = np.bincount(inverse, weights=contrib)
+        live = self._alive[rows] & (scores > 0)
+        rows, scores = rows[live], scores[live]
+        if len(rows) == 0:
+            return []
+
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        return [(int(self._row_ids[rows[i]]), float(scores[i])) for i in top]
+
+    def _delta(self):
+        """The notes of the delta with their terms' weights and their norms"""
+        if self._pending_weights is None:
+            ids = list(self._pending)
+            docs = [self._docs[note_id] for note_id in ids]
+            lengths = np.fromiter(
+                (len(terms) for terms, _ in docs), dtype=np.int64, count=len(ids)
+            )
+            terms = np.concatenate([t for t, _ in docs])
+            tf = np.concatenate([c for _, c in docs])
+            doc_rows = np.repeat(np.arange(len(ids)), lengths)
+            weights = (1.0 + np.log(tf)) * self._idf_for(terms)
+            norms = np.sqrt(np.bincount(doc_rows, weights=weights ** 2, minlength=len(ids)))
+            self._pending_weights = (ids, doc_rows, terms, weights, norms)
+        return self._pending_weights
+
+    def _score_pending(self, q_terms, q_weights) -> List[Tuple[int, float]]:
+        if not self._pending:
+            return []
+        ids, doc_rows, terms, weights, norms = self._delta()
+
+        # The query as a dense vector over the vocabulary, read at the delta's terms
+        query = np.zeros(len(self._vocab), dtype=np.float32)
+        query[q_terms] = q_weights
+        scores = np.bincount(doc_rows, weights=weights * query[terms], minlength=len(ids))
+        hits = np.flatnonzero((scores > 0) & (norms > 0))
+        return [(ids[i], float(scores[i] / norms[i])) for i in hits.tolist()]
+
+
+# Process-wide index shared by the notes service and the API
+index = TfidfIndex()
+
+
+def index_note(note: Note) -> None:
+    """Add or refresh a note in the similarity index"""
+    # Notes that have not been flushed yet have no id to index under
+    if note.id is None:
+        return
+    index.add(note.id, note.content)
+
+
+def remove_note(note_id: int) -> None:
+    """Remove a note from the similarity index"""
+    index.remove(note_id)
+
+
+def load_index(db: Session, path: str = TFIDF_INDEX_PATH) -> None:
+    """
+    Load the persisted index, or build it from the database if there is
+    none, then reconcile it with the notes that currently exist. Notes
+    missing from the file, or updated since it was saved, are indexed
+    again, so edits made after the last save are not lost.
+    """
+    saved_at = index.load(path) if os.path.exists(path) else None
+    if saved_at is None:
+        index.rebuild(db.query(Note.id, Note.content).yield_per(1000))
+        return
+
+    existing = {note_id for (note_id,) in db.query(Note.id)}
+    indexed = index.note_ids()
+    for note_id in indexed - existing:
+        index.remove(note_id)
+    changed = {
+        note_id
+        for (note_id,) in db.query(Note.id).filter(Note.updated_at >= literal(saved_at))
+    }
+    stale = sorted((existing - indexed) | changed)
+    for start in range(0, len(stale), 500):
+        batch = stale[start:start + 500]
+        for note_id, content in db.query(Note.id, Note.content).filter(
+            Note.id.in_(batch)
+        ):
+            index.add(note_id, content)
+
+
+def save_index(path: str = TFIDF_INDEX_PATH) -> None:
+    """Persist the index so it can be reloaded at startup"""
+    index.save(path)
@@ -0,0 +1,462 @@
+import asyncio
+import hashlib
+import os
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+
+from fastapi import HTTPException
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.models.notes import CachedSummary, ChunkSummary, Note
+from app.services import ai as ai_service
+from app.services.summarizers import Summarizer, select_summarizer
+from app.services.summarizers import local as local_summarizer
+from app.utils.cache import LRUCache
+from app.utils.singleflight import SingleFlight
+from app.utils.tracing import traced
+from app.utils.text_processing import estimate_tokens, split_into_chunks
+
+# Number of summaries kept in memory in front of the note_summaries table
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "1024"))
+
+# Model calls a batch request may run at once
+AI_BATCH_CONCURRENCY = int(os.getenv("AI_BATCH_CONCURRENCY", "4"))
+
+# Notes longer than AI_LONG_NOTE_TOKENS are summarized in chunks of at most
+# AI_CHUNK_TOKENS, with up to AI_CHUNK_CONCURRENCY chunks in flight
+AI_LONG_NOTE_TOKENS = int(os.getenv("AI_LONG_NOTE_TOKENS", "8000"))
+AI_CHUNK_TOKENS = int(os.getenv("AI_CHUNK_TOKENS", "3000"))
+AI_CHUNK_CONCURRENCY = int(os.getenv("AI_CHUNK_CONCURRENCY", "4"))
+
+# When the model fails, serve the note's last cached summary or, failing
+# that, a local extractive one instead of an error
+AI_FALLBACK = os.getenv("AI_FALLBACK", "1") == "1"
+
+lru = LRUCache(SUMMARY_CACHE_SIZE)
+
+# Concurrent requests for the summary of the same note version share one
+# model call, keyed by (note id, summary key)
+flight = SingleFlight()
+
+fallback_stats = {"stale": 0, "local": 0}
+
+
+def summary_key(
+    title: str,
+    content: str,
+    model: str,
+    prompt_version: str = ai_service.PROMPT_VERSION,
+) -> str:
+    """Hash of everything that determines a summary"""
+    digest = hashlib.sha256()
+    for part in (title, content, model, prompt_version):
+        data = part.encode("utf-8")
+        # Length-prefix each part so different splits never collide
+        digest.update(len(data).to_bytes(8, "big"))
+        digest.update(data)
+    return digest.hexdigest()
+
+
+@traced()
+async def get_cached_summary_async(db: AsyncSession, key: str) -> Optional[str]:
+    """Look a summary up in memory, then in the note_summaries table"""
+    summary = lru.get(key)
+    if summary is not None:
+        return summary
+
+    result = await db.execute(
+        select(CachedSummary.summary).filter(CachedSummary.key == key)
+    )
+    summary = result.scalar_one_or_none()
+    if summary is not None:
+        lru.set(key, summary)
+    return summary
+
+
+@traced()
+async def get_cached_summaries_async(
+    db: AsyncSession, keys: Iterable[str]
+) -> Dict[str, str]:
+    """Look many summaries up at once, with a single query for LRU misses"""
+    found: Dict[str, str] = {}
+    missing: List[str] = []
+    for key in keys:
+        summary = lru.get(key)
+        if summary is None:
+            missing.append(key)
+        else:
+            found[key] = summary
+
+    if missing:
+        result = await db.execute(
+            select(CachedSummary.key, CachedSummary.summary).filter(
+                CachedSummary.key.in_(missing)
+            )
+        )
+        for key, summary in result.all():
+            lru.set(key, summary)
+            found[key] = summary
+    return found
+
+
+@traced()
+async def store_summary_async(
+    db: AsyncSession, note_id: int, key: str, model: str, summary: str
+) -> None:
+    """Persist a summary and drop the note's summaries of older versions"""
+    lru.set(key, summary)
+    await db.execute(
+        delete(CachedSummary).where(
+            CachedSummary.note_id == note_id, CachedSummary.key != key
+        )
+    )
+    await db.merge(
+        CachedSummary(key=key, note_id=note_id, model=model, summary=summary)
+    )
+    await db.commit()
+
+
+def _chunk_key(chunk: str, model: str) -> str:
+    return summary_key("", chunk, model, f"{ai_service.PROMPT_VERSION}:chunk")
+
+
+async def _bounded_gather(
+    factories: List[Callable[[], Awaitable[str]]], limit: int
+) -> List[str]:
+    """Run coroutine factories with at most `limit` at once, failing fast"""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(factory):
+        # Fan-out within one request is bounded here, not by the per-client cap
+        ai_service.current_client.set(None)
+        async with semaphore:
+            return await factory()
+
+    tasks = [asyncio.create_task(run(factory)) for factory in factories]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+
+async def _summarize_chunks_async(
+    db: Optional[AsyncSession],
+    title: str,
+    chunks: List[str],
+    summarizer: Summarizer,
+    model: str,
+) -> List[str]:
+    """
+    Summarize each chunk, reusing cached chunk summaries. Without a session
+    only the in-memory cache is used.
+    """
+    keys = [_chunk_key(chunk, model) for chunk in chunks]
+    found: Dict[str, str] = {}
+    for key in keys:
+        summary = lru.get(key)
+        if summary is not None:
+            found[key] = summary
+
+    missing = [key for key in keys if key not in found]
+    if missing and db is not None:
+        result = await db.execute(
+            select(ChunkSummary.key, ChunkSummary.summary).filter(
+                ChunkSummary.key.in_(missing)
+            )
+        )
+        for key, summary in result.all():
+            lru.set(key, summary)
+            found[key] = summary
+
+    todo = {key: chunk for key, chunk in zip(keys, chunks) if key not in found}
+    results = await _bounded_gather(
+        [
+            lambda chunk=chunk: summarizer.summarize_async(chunk, title, model)
+            for chunk in todo.values()
+        ],
+        AI_CHUNK_CONCURRENCY,
+    )
+    for key, summary in zip(todo, results):
+        lru.set(key, summary)
+        found[key] = summary
+        if db is not None:
+            await db.merge(ChunkSummary(key=key, summary=summary))
+    if todo and db is not None:
+        await db.commit()
+
+    return [found[key] for key in keys]
+
+
+def _group_partials(partials: List[str]) -> List[List[str]]:
+    groups: List[List[str]] = []
+    size = 0
+    for partial in partials:
+        tokens = estimate_tokens(partial)
+        if groups and size + tokens <= AI_CHUNK_TOKENS:
+            groups[-1].append(partial)
+            size += tokens
+        else:
+            groups.append([partial])
+            size = tokens
+    if len(groups) == len(partials) > 1:
+        # Nothing fits together; merge pairs so every round still shrinks
+        groups = [partials[i:i + 2] for i in range(0, len(partials), 2)]
+    return groups
+
+
+async def _reduce_to_group_async(
+    title: str, partials: List[str], summarizer: Summarizer, model: str
+) -> List[str]:
+    """Combine partial summaries until the rest fit in a single prompt"""
+    groups = _group_partials(partials)
+    while len(groups) > 1:
+        partials = await _bounded_gather(
+            [
+                lambda group=group: summarizer.combine_async(group, title, model)
+                for group in groups
+            ],
+            AI_CHUNK_CONCURRENCY,
+        )
+        groups = _group_partials(partials)
+    return groups[0]
+
+
+def _long_note_chunks(content: str) -> Optional[List[str]]:
+    if estimate_tokens(content) <= AI_LONG_NOTE_TOKENS:
+        return None
+    chunks = split_into_chunks(content, AI_CHUNK_TOKENS)
+    return chunks if len(chunks) > 1 else None
+
+
+@traced()
+async def summarize_content_async(
+    db: Optional[AsyncSession],
+    title: str,
+    content: str,
+    summarizer: Summarizer,
+    model: str,
+) -> str:
+    """
+    Summarize note content, using map-reduce over chunks for long notes.
+
+    Chunks are summarized in parallel and their summaries are cached by
+    chunk content, so after an edit only the changed chunks are sent to
+    the model again before the final combine step.
+    """
+    chunks = _long_note_chunks(content)
+    if chunks is None:
+        return await summarizer.summarize_async(content, title, model)
+
+    partials = await _summarize_chunks_async(db, title, chunks, summarizer, model)
+    group = await _reduce_to_group_async(title, partials, summarizer, model)
+    return await summarizer.combine_async(group, title, model)
+
+
+def _should_fall_back(summarizer: Summarizer, error: HTTPException) -> bool:
+    return (
+        AI_FALLBACK
+        and summarizer is not local_summarizer
+        and error.status_code >= 500
+    )
+
+
+@traced()
+async def _fallback_summary_async(
+    db: AsyncSession, note_id: int, title: str, content: str
+) -> str:
+    """
+    Best summary available without the model: the note's most recent
+    cached summary, possibly of an older version, else a local one.
+    Fallbacks are not cached, so the next request tries the model again.
+    """
+    result = await db.execute(
+        select(CachedSummary.summary)
+        .filter(CachedSummary.note_id == note_id)
+        .order_by(CachedSummary.created_at.desc())
+        .limit(1)
+    )
+    summary = result.scalar()
+    if summary is not None:
+        fallback_stats["stale"] += 1
+        return summary
+
+    fallback_stats["local"] += 1
+    model = await local_summarizer.model_name_async()
+    return await summarize_content_async(None, title, content, local_summarizer, model)
+
+
+@traced()
+async def get_summary_async(db: AsyncSession, note: Note) -> str:
+    """
+    Return the note's summary, generating it only if it is not cached.
+    Concurrent requests for the same version of a note share one call.
+    """
+    note_id, title, content = note.id, note.title, note.content
+    summarizer = select_summarizer(content)
+    model = await summarizer.model_name_async()
+    key = summary_key(title, content, model)
+
+    summary = await get_cached_summary_async(db, key)
+    if summary is not None:
+        return summary
+
+    async def generate() -> Tuple[str, bool]:
+        try:
+            summary = await summarize_content_async(
+                db, title, content, summarizer, model
+            )
+        except HTTPException as e:
+            if not _should_fall_back(summarizer, e):
+                raise
+            return await _fallback_summary_async(db, note_id, title, content), True
+        await store_summary_async(db, note_id, key, model, summary)
+        return summary, False
+
+    # Callers sharing the flight are told about a fallback, so none of
+    # them caches it as the model's summary
+    summary, _ = await flight.do((note_id, key), generate)
+    return summary
+
+
+async def stream_summary_async(db: AsyncSession, note: Note) -> AsyncIterator[str]:
+    """
+    Yield the note's summary in chunks as the model produces them.
+
+    A cached summary is yielded as a single chunk. A completed stream is
+    stored in the cache; an interrupted one is not. If the model fails
+    before sending anything, a fallback summary is yielded instead.
+    """
+    note_id, title, content = note.id, note.title, note.content
+    summarizer = select_summarizer(content)
+    model = await summarizer.model_name_async()
+    key = summary_key(title, content, model)
+
+    summary = await get_cached_summary_async(db, key)
+    if summary is not None:
+        yield summary
+        return
+
+    parts: List[str] = []
+    try:
+        # For long notes the chunks are summarized first and only the final
+        # combine step is streamed
+        chunks = _long_note_chunks(content)
+        if chunks is None:
+            stream = summarizer.stream_async(content, title, model)
+        else:
+            partials = await _summarize_chunks_async(
+                db, title, chunks, summarizer, model
+            )
+            group = await _reduce_to_group_async(
+                title, partials, summarizer, model
+            )
+            stream = summarizer.stream_combine_async(group, title, model)
+
+        async for chunk in stream:
+            parts.append(chunk)
+            yield chunk
+    except HTTPException as e:
+        # Once text has been sent a fallback would not match it
+        if parts or not _should_fall_back(summarizer, e):
+            raise
+        yield await _fallback_summary_async(db, note_id, title, content)
+        return
+    await store_summary_async(db, note_id, key, model, "".join(parts))
+
+
+async def summarize_notes_async(
+    db: AsyncSession,
+    note_ids: List[int],
+    notes: List[Note],
+    concurrency: Optional[int] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Yield one result per requested note id as soon as it is available.
+
+    Cached summaries come first. The remaining notes are sent to the model
+    with at most `concurrency` calls in flight, and no more than the
+    per-client cap of the calling client, so they do not time out queueing
+    for it. Failures are reported per note instead of aborting the batch.
+    """
+    limit = min(concurrency or AI_BATCH_CONCURRENCY, AI_BATCH_CONCURRENCY)
+    if ai_service.current_client.get() is not None:
+        limit = min(limit, ai_service.AI_MAX_CONCURRENCY_PER_CLIENT)
+
+    # Read the attributes up front; the session is only used from this task
+    by_id = {note.id: (note.title, note.content) for note in notes}
+    backends: Dict[int, Tuple[Summarizer, str]] = {}
+    for note_id, (title, content) in by_id.items():
+        summarizer = select_summarizer(content)
+        backends[note_id] = (summarizer, await summarizer.model_name_async())
+    keys = {
+        note_id: summary_key(title, content, backends[note_id][1])
+        for note_id, (title, content) in by_id.items()
+    }
+    cached = await get_cached_summaries_async(db, keys.values())
+
+    pending = []
+    for note_id in dict.fromkeys(note_ids):
+        if note_id not in by_id:
+            yield {"note_id": note_id, "error": "Note not found", "status_code": 404}
+        elif keys[note_id] in cached:
+            yield {"note_id": note_id, "summary": cached[keys[note_id]]}
+        else:
+            pending.append(note_id)
+
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(note_id: int):
+        title, content = by_id[note_id]
+        summarizer, model = backends[note_id]
+
+        async def generate() -> Tuple[str, bool]:
+            # Concurrent tasks cannot share the session, so chunks of long
+            # notes are only cached in memory here
+            summary = await summarize_content_async(
+                None, title, content, summarizer, model
+            )
+            return summary, False
+
+        async with semaphore:
+            try:
+                # The flight may be a single-note request that fell back
+                summary, fallback = await flight.do((note_id, keys[note_id]), generate)
+                return note_id, (summary, fallback), None
+            except HTTPException as e:
+                return note_id, None, e
+            except Exception as e:
+                return note_id, None, HTTPException(status_code=500, detail=str(e))
+
+    tasks = [asyncio.create_task(run(note_id)) for note_id in pending]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            note_id, result, error = await next_done
+            if error is not None:
+                yield {
+                    "note_id": note_id,
+                    "error": error.detail,
+                    "status_code": error.status_code,
+                }
+                continue
+            summary, fallback = result
+            if not fallback:
+                model = backends[note_id][1]
+                await store_summary_async(db, note_id, keys[note_id], model, summary)
+            yield {"note_id": note_id, "summary": summary}
+    finally:
+        # The client went away or the consumer stopped early
+        for task in tasks:
+            task.cancel()
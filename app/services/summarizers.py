@@ -0,0 +1,127 @@
+import asyncio
+import os
+from abc import ABC, abstractmethod
+from typing import AsyncIterator, List
+
+from app.services import ai as ai_service
+from app.services import extractive
+
+# gemini: always call Gemini
+# local: always use the extractive engine, never leaving the host
+# auto: local for notes under LOCAL_SUMMARY_MAX_WORDS words or when no
+#       Gemini key is configured, Gemini otherwise
+SUMMARIZER_BACKEND = os.getenv("SUMMARIZER_BACKEND", "auto")
+LOCAL_SUMMARY_MAX_WORDS = int(os.getenv("LOCAL_SUMMARY_MAX_WORDS", "0"))
+
+# Sentences kept by the extractive engine
+LOCAL_SUMMARY_SENTENCES = int(os.getenv("LOCAL_SUMMARY_SENTENCES", "3"))
+
+
+class Summarizer(ABC):
+    """
+    A summary backend.
+
+    The model name is part of every cache key, so each backend reports
+    one that changes whenever its output would.
+    """
+
+    name = ""
+
+    @abstractmethod
+    async def model_name_async(self) -> str:
+        ...
+
+    @abstractmethod
+    async def summarize_async(self, text: str, title: str, model: str) -> str:
+        ...
+
+    @abstractmethod
+    async def combine_async(self, partials: List[str], title: str, model: str) -> str:
+        """Merge summaries of consecutive parts of a note into one"""
+
+    @abstractmethod
+    def stream_async(self, text: str, title: str, model: str) -> AsyncIterator[str]:
+        ...
+
+    @abstractmethod
+    def stream_combine_async(
+        self, partials: List[str], title: str, model: str
+    ) -> AsyncIterator[str]:
+        ...
+
+
+class GeminiSummarizer(Summarizer):
+    name = "gemini"
+
+    async def model_name_async(self) -> str:
+        return await ai_service.resolve_model_name_async()
+
+    async def summarize_async(self, text: str, title: str, model: str) -> str:
+        return await ai_service.summarize_text_async(text, title, model_name=model)
+
+    async def combine_async(self, partials: List[str], title: str, model: str) -> str:
+        return await ai_service.combine_summaries_async(
+            partials, title, model_name=model
+        )
+
+    def stream_async(self, text: str, title: str, model: str) -> AsyncIterator[str]:
+        return ai_service.stream_summary_async(text, title, model_name=model)
+
+    def stream_combine_async(
+        self, partials: List[str], title: str, model: str
+    ) -> AsyncIterator[str]:
+        return ai_service.stream_combine_summaries_async(
+            partials, title, model_name=model
+        )
+
+
+class LocalSummarizer(Summarizer):
+    """
+    TextRank sentence extraction; fast, offline and deterministic.
+
+    Ranking builds a sentence similarity matrix and iterates over it, which
+    takes a while for long notes, so it runs in a worker thread.
+    """
+
+    name = "local"
+
+    def __init__(self, max_sentences: int = LOCAL_SUMMARY_SENTENCES):
+        self.max_sentences = max_sentences
+
+    async def model_name_async(self) -> str:
+        return f"local-textrank-{self.max_sentences}"
+
+    async def summarize_async(self, text: str, title: str, model: str) -> str:
+        return await asyncio.to_thread(extractive.summarize, text, self.max_sentences)
+
+    async def combine_async(self, partials: List[str], title: str, model: str) -> str:
+        return await asyncio.to_thread(
+            extractive.summarize, "\n\n".join(partials), self.max_sentences
+        )
+
+    async def stream_async(
+        self, text: str, title: str, model: str
+    ) -> AsyncIterator[str]:
+        yield await self.summarize_async(text, title, model)
+
+    async def stream_combine_async(
+        self, partials: List[str], title: str, model: str
+    ) -> AsyncIterator[str]:
+        yield await self.combine_async(partials, title, model)
+
+
+gemini = GeminiSummarizer()
+local = LocalSummarizer()
+
+
+def select_summarizer(content: str) -> Summarizer:
+    """Pick the backend for a note according to SUMMARIZER_BACKEND"""
+    if SUMMARIZER_BACKEND == "gemini":
+        return gemini
+    if SUMMARIZER_BACKEND == "local":
+        return local
+    if not ai_service.GEMINI_API_KEY:
+        return local
+    if LOCAL_SUMMARY_MAX_WORDS and len(content.split()) < LOCAL_SUMMARY_MAX_WORDS:
+        return local
+    return gemini
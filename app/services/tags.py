@@ -0,0 +1,190 @@
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import and_, delete, exists, func, literal, select, union, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy.sql import ColumnElement, Select
+
+from app import sharding
+from app.models.notes import Note, NoteTag, Tag
+from app.schemas.notes import TAG_SEPARATOR
+from app.utils.tracing import traced
+
+# A note's tag names, comma-separated; correlated to the notes row of the
+# enclosing query, so a note and its tags load in one statement
+tag_names = (
+    select(func.group_concat(Tag.name, TAG_SEPARATOR))
+    .join(NoteTag, NoteTag.tag_id == Tag.id)
+    .where(NoteTag.note_id == Note.id)
+    .scalar_subquery()
+)
+
+
+@traced()
+def set_note_tags(db: Session, note_id: int, names: List[str], new: bool = False) -> None:
+    """
+    Replace the tags of a note, creating tags on first use and adjusting
+    the note counts of the tags added and removed. `new` skips looking up
+    the current tags of a note that was just created. Runs in the caller's
+    transaction; with an AsyncSession use db.run_sync.
+    """
+    with sharding.for_note(db, note_id):
+        _set_note_tags(db, note_id, names, new)
+
+
+def _set_note_tags(db: Session, note_id: int, names: List[str], new: bool) -> None:
+    current = set()
+    if not new:
+        current = set(
+            db.execute(
+                select(Tag.name)
+                .join(NoteTag, NoteTag.tag_id == Tag.id)
+                .where(NoteTag.note_id == note_id)
+            ).scalars()
+        )
+    wanted = set(names)
+    added, removed = wanted - current, current - wanted
+
+    if removed:
+        removed_ids = select(Tag.id).where(Tag.name.in_(removed))
+        db.execute(
+            delete(NoteTag)
+            .where(NoteTag.note_id == note_id, NoteTag.tag_id.in_(removed_ids))
+            .execution_options(synchronize_session=False)
+        )
+        db.execute(
+            update(Tag)
+            .where(Tag.name.in_(removed))
+            .values(note_count=Tag.note_count - 1)
+            .execution_options(synchronize_session=False)
+        )
+    if added:
+        db.execute(
+            sqlite_insert(Tag).on_conflict_do_nothing(index_elements=["name"]),
+            [{"name": name, "note_count": 0} for name in sorted(added)],
+        )
+        db.execute(
+            NoteTag.__table__.insert().from_select(
+                ["note_id", "tag_id"],
+                select(literal(note_id), Tag.id).where(Tag.name.in_(added)),
+            )
+        )
+        db.execute(
+            update(Tag)
+            .where(Tag.name.in_(added))
+            .values(note_count=Tag.note_count + 1)
+            .execution_options(synchronize_session=False)
+        )
+
+
+@traced()
+def remove_note_tags(db: Session, note_id: int) -> None:
+    """Untag a note that is being deleted; runs in the caller's transaction"""
+    tag_ids = select(NoteTag.tag_id).where(NoteTag.note_id == note_id)
+    with sharding.for_note(db, note_id):
+        db.execute(
+            update(Tag)
+            .where(Tag.id.in_(tag_ids))
+            .values(note_count=Tag.note_count - 1)
+            .execution_options(synchronize_session=False)
+        )
+        db.execute(
+            delete(NoteTag)
+            .where(NoteTag.note_id == note_id)
+            .execution_options(synchronize_session=False)
+        )
+
+
+@traced()
+async def get_tag_counts_async(db: AsyncSession, limit: int = 100) -> List[Dict[str, Any]]:
+    """
+    Tags in use, most used first, with their note counts (async). Sharded,
+    every shard counts its own notes, so all counts are read at once and
+    added up.
+    """
+    query = select(Tag.name, Tag.note_count).where(Tag.note_count > 0)
+    if sharding.shard_ids(db) is None:
+        result = await db.execute(
+            query.order_by(Tag.note_count.desc(), Tag.name).limit(limit)
+        )
+        return [{"name": name, "count": count} for name, count in result.all()]
+
+    async def shard_counts(shard_db: AsyncSession) -> List[Tuple[str, int]]:
+        return (await shard_db.execute(query)).all()
+
+    counts: Dict[str, int] = {}
+    for rows in await sharding.gather_shards(db, shard_counts):
+        for name, count in rows:
+            counts[name] = counts.get(name, 0) + count
+    ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:limit]
+    return [{"name": name, "count": count} for name, count in ranked]
+
+
+@traced()
+async def get_tag_ids_async(db: AsyncSession, names: List[str]) -> Dict[int, int]:
+    """Ids of the tags with these names and their note counts (async)"""
+    result = await db.execute(
+        select(Tag.id, Tag.note_count).where(Tag.name.in_(names))
+    )
+    return dict(result.all())
+
+
+def tagged_note_ids(
+    tag_counts: Dict[int, int],
+    match_all: bool,
+    after_id: Optional[int],
+    limit: int,
+    descending: bool = False,
+) -> Select:
+    """
+    Ids of the next `limit` notes after `after_id`, in id order, that have
+    all (or any) of the tags. Every branch walks the (tag_id, note_id) index
+    from the cursor and stops after `limit` rows, so the cost depends on
+    the page size rather than on how many notes have the tags.
+
+    For all tags, the rarest tag drives and the others are probed through
+    the primary key. For any tag, each tag's next page is read and the
+    pages are merged.
+    """
+
+    def page(note_id, query):
+        if after_id is not None:
+            query = query.where(note_id < after_id if descending else note_id > after_id)
+        return query.order_by(note_id.desc() if descending else note_id).limit(limit)
+
+    if match_all:
+        driver, *others = sorted(tag_counts, key=tag_counts.get)
+        first = aliased(NoteTag)
+        query = select(first.note_id).where(first.tag_id == driver)
+        for tag_id in others:
+            other = aliased(NoteTag)
+            query = query.join(
+                other, (other.note_id == first.note_id) & (other.tag_id == tag_id)
+            )
+        return page(first.note_id, query)
+
+    pages = [
+        select(NoteTag.note_id).where(NoteTag.tag_id == tag_id) for tag_id in tag_counts
+    ]
+    if len(pages) == 1:
+        return page(NoteTag.note_id, pages[0])
+    pages = [page(NoteTag.note_id, query).subquery() for query in pages]
+    merged = union(*[select(query.c.note_id) for query in pages]).subquery()
+    return page(merged.c.note_id, select(merged.c.note_id))
+
+
+def note_has_tags(tag_ids: List[int], match_all: bool) -> ColumnElement:
+    """
+    Condition on the notes of a query that they have all (or any) of the
+    tags, checked per note through the primary key of note_tags; for
+    listings that are not in id order
+    """
+    if match_all:
+        return and_(
+            *[
+                exists().where(NoteTag.note_id == Note.id, NoteTag.tag_id == tag_id)
+                for tag_id in tag_ids
+            ]
+        )
+    return exists().where(NoteTag.note_id == Note.id, NoteTag.tag_id.in_(tag_ids))
@@ -0,0 +1,440 @@
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypeVar,
+)
+
+import anyio
+from sqlalchemy import Column, Integer, MetaData, String, Table, func, inspect, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import column, operators, table
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter, BooleanClauseList
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Note ids are hashed into this many buckets and the shard map assigns
+# buckets to shards; rebalancing moves whole buckets. Changing it reroutes
+# every note, so it is not configurable
+SHARD_BUCKETS = 1024
+
+# Ids each process reserves from the catalog at a time
+SHARD_ID_BLOCK = int(os.getenv("SHARD_ID_BLOCK", "1000"))
+
+# Tables whose ids are allocated from the catalog when sharded, so they are
+# unique across shards and rows keep them when they move; other tables
+# number their rows per shard
+GLOBAL_ID_TABLES = ("notes", "note_attachments")
+
+# The catalog lives in shard 0, beside its share of the notes
+catalog_metadata = MetaData()
+
+shard_buckets = Table(
+    "shard_buckets",
+    catalog_metadata,
+    Column("bucket", Integer, primary_key=True),
+    Column("shard", Integer, nullable=False),
+)
+
+id_blocks = Table(
+    "id_blocks",
+    catalog_metadata,
+    # Table name -> first id not yet handed out
+    Column("name", String(64), primary_key=True),
+    Column("next_id", Integer, nullable=False),
+)
+
+
+def shard_url(url: str, shard: int) -> str:
+    """Database URL of a shard: shard 0 is `url`, shard 2 of notes.db is notes.shard2.db"""
+    if shard == 0:
+        return url
+    root, ext = os.path.splitext(url)
+    return f"{root}.shard{shard}{ext}"
+
+
+def bucket_of(note_id: int) -> int:
+    return note_id % SHARD_BUCKETS
+
+
+class ShardMap:
+    """The shard of each bucket"""
+
+    def __init__(self, buckets: List[int]):
+        if len(buckets) != SHARD_BUCKETS:
+            raise ValueError(f"A shard map has {SHARD_BUCKETS} buckets, not {len(buckets)}")
+        self.buckets = list(buckets)
+
+    @classmethod
+    def even(cls, shards: int) -> "ShardMap":
+        return cls([bucket % shards for bucket in range(SHARD_BUCKETS)])
+
+    @property
+    def shards(self) -> List[int]:
+        """Shards that own buckets, and so may hold notes"""
+        return sorted(set(self.buckets))
+
+    def shard_of(self, note_id: int) -> int:
+        return self.buckets[bucket_of(note_id)]
+
+    def buckets_of(self, shard: int) -> List[int]:
+        return [bucket for bucket, owner in enumerate(self.buckets) if owner == shard]
+
+    @classmethod
+    def load(cls, conn) -> Optional["ShardMap"]:
+        rows = conn.execute(select(shard_buckets.c.bucket, shard_buckets.c.shard)).all()
+        if not rows:
+            return None
+        buckets = [0] * SHARD_BUCKETS
+        for bucket, shard in rows:
+            buckets[bucket] = shard
+        return cls(buckets)
+
+    def save(self, conn) -> None:
+        insert = sqlite_insert(shard_buckets)
+        conn.execute(
+            insert.on_conflict_do_update(
+                index_elements=["bucket"], set_={"shard": insert.excluded.shard}
+            ),
+            [{"bucket": bucket, "shard": shard} for bucket, shard in enumerate(self.buckets)],
+        )
+
+
+def _max_id(engine: Engine, name: str) -> int:
+    with engine.connect() as conn:
+        return conn.execute(select(func.max(column("id"))).select_from(table(name))).scalar() or 0
+
+
+class ShardCatalog:
+    """
+    The shard map and the id sequences of a set of shards, kept in shard 0.
+
+    The map is read once and cached, so it may only change while the app
+    is stopped (see app.reshard). Ids are reserved SHARD_ID_BLOCK at a time
+    and handed out from memory, so creating a note costs a catalog write
+    only once per block.
+    """
+
+    def __init__(self, engines: List[Engine], block: int = SHARD_ID_BLOCK):
+        self.engines = engines
+        self.block = block
+        self._map: Optional[ShardMap] = None
+        self._lock = threading.Lock()
+        # table name -> [next id, end of the reserved block]
+        self._ids: Dict[str, List[int]] = {}
+        self._refills: Dict[str, asyncio.Lock] = {}
+
+    @property
+    def shard_map(self) -> ShardMap:
+        if self._map is None:
+            with self._lock:
+                if self._map is None:
+                    self._map = self._load_map()
+        return self._map
+
+    def _load_map(self) -> ShardMap:
+        catalog_metadata.create_all(self.engines[0])
+        with self.engines[0].begin() as conn:
+            shard_map = ShardMap.load(conn)
+            if shard_map is None:
+                # An existing single-file database keeps its notes in shard
+                # 0 until it is rebalanced
+                if _max_id(self.engines[0], "notes"):
+                    shard_map = ShardMap([0] * SHARD_BUCKETS)
+                    logger.warning(
+                        "Existing notes stay in shard 0 until python -m "
+                        "app.reshard rebalance spreads them"
+                    )
+                else:
+                    shard_map = ShardMap.even(len(self.engines))
+                conn.execute(
+                    sqlite_insert(shard_buckets).on_conflict_do_nothing(),
+                    [{"bucket": b, "shard": s} for b, s in enumerate(shard_map.buckets)],
+                )
+                # Another process may have written its map first
+                shard_map = ShardMap.load(conn)
+        if max(shard_map.shards) >= len(self.engines):
+            raise RuntimeError(
+                f"The shard map uses {max(shard_map.shards) + 1} shards but only "
+                f"{len(self.engines)} are configured; set DATABASE_SHARDS"
+            )
+        return shard_map
+
+    def reload(self) -> ShardMap:
+        with self._lock:
+            self._map = None
+        return self.shard_map
+
+    def _reserve(self, name: str) -> Tuple[int, int]:
+        """Reserve the next block of ids of a table in the catalog"""
+        self.shard_map
+        with self.engines[0].begin() as conn:
+            # The update takes the write lock before the new end is read
+            reserved = conn.execute(
+                id_blocks.update()
+                .where(id_blocks.c.name == name)
+                .values(next_id=id_blocks.c.next_id + self.block)
+            )
+            if reserved.rowcount == 0:
+                start = max(_max_id(engine, name) for engine in self.engines) + 1
+                conn.execute(id_blocks.insert().values(name=name, next_id=start + self.block))
+            end = conn.execute(
+                select(id_blocks.c.next_id).where(id_blocks.c.name == name)
+            ).scalar()
+        return end - self.block, end
+
+    def _available(self, name: str) -> bool:
+        ids = self._ids.get(name)
+        return ids is not None and ids[0] < ids[1]
+
+    def _take(self, name: str) -> Optional[int]:
+        with self._lock:
+            if not self._available(name):
+                return None
+            ids = self._ids[name]
+            ids[0] += 1
+            return ids[0] - 1
+
+    def _refill(self, name: str) -> None:
+        start, end = self._reserve(name)
+        with self._lock:
+            if not self._available(name):
+                self._ids[name] = [start, end]
+
+    def next_id(self, name: str) -> int:
+        while True:
+            new_id = self._take(name)
+            if new_id is not None:
+                return new_id
+            self._refill(name)
+
+    async def next_id_async(self, name: str) -> int:
+        """next_id, reserving blocks in a worker thread"""
+        while True:
+            new_id = self._take(name)
+            if new_id is not None:
+                return new_id
+            async with self._refills.setdefault(name, asyncio.Lock()):
+                if not self._available(name):
+                    await anyio.to_thread.run_sync(self._refill, name)
+
+
+# Session info key of the shard every statement of the session goes to
+_PINNED = "shard_id"
+
+
+def _is_note_key(expression) -> bool:
+    name = getattr(expression, "name", None)
+    if name == "note_id":
+        return True
+    owner = getattr(expression, "table", None)
+    return name == "id" and getattr(owner, "name", None) == "notes"
+
+
+def note_ids(statement, parameters: Optional[Dict] = None) -> Optional[Set[int]]:
+    """
+    The note ids a statement is limited to by an `=` or `IN` on notes.id
+    or a note_id column among the AND-ed conditions of its WHERE clause,
+    or None if it may touch any note. Values bound at execution, as by
+    lazy loads, are looked up in `parameters`.
+    """
+    where = getattr(statement, "whereclause", None)
+    if where is None:
+        return None
+    if isinstance(where, BooleanClauseList) and where.operator is operators.and_:
+        conditions = where.clauses
+    else:
+        conditions = [where]
+    for condition in conditions:
+        if not isinstance(condition, BinaryExpression):
+            continue
+        bind, key = condition.right, condition.left
+        if isinstance(key, BindParameter):
+            # Lazy loads compare the other way around
+            bind, key = key, bind
+        if not (isinstance(bind, BindParameter) and _is_note_key(key)):
+            continue
+        value = bind.effective_value
+        if value is None and parameters:
+            value = parameters.get(bind.key)
+        if condition.operator is operators.eq and isinstance(value, int):
+            return {value}
+        if condition.operator is operators.in_op and isinstance(value, (list, tuple)):
+            if all(isinstance(v, int) for v in value):
+                return set(value)
+    return None
+
+
+class ShardedNotesSession(ShardedSession):
+    """
+    Session over several shards, routing by note id.
+
+    Rows of a note live in the note's shard. Statements limited to given
+    notes go to their shards, other statements go to every shard and their
+    results are concatenated, so ordered, limited or aggregated queries
+    across notes have to run per shard (see gather_shards) and be merged. New
+    rows go to the shard of their note; rows without one, and Core inserts,
+    go to the pinned shard, or shard 0.
+    """
+
+    def __init__(self, catalog: ShardCatalog, shards: Dict[int, Engine], **kwargs):
+        self.catalog = catalog
+        # The engine of each shard, for sessions of a single shard
+        self.shard_engines = dict(shards)
+        super().__init__(
+            shard_chooser=self._shard_for_row,
+            id_chooser=self._shards_for_identity,
+            execute_chooser=self._shards_for_statement,
+            shards=shards,
+            **kwargs,
+        )
+
+    @property
+    def shard_map(self) -> ShardMap:
+        return self.catalog.shard_map
+
+    def _shard_for_row(self, mapper, instance, clause=None):
+        if instance is not None:
+            if mapper.local_table.name == "notes":
+                if instance.id is None:
+                    raise ValueError("Notes need an id from new_id() in a sharded session")
+                return self.shard_map.shard_of(instance.id)
+            note_id = getattr(instance, "note_id", None)
+            if note_id is not None:
+                return self.shard_map.shard_of(note_id)
+        pinned = self.info.get(_PINNED)
+        if pinned is not None:
+            return pinned
+        if clause is not None:
+            ids = note_ids(clause)
+            if ids and len({self.shard_map.shard_of(i) for i in ids}) == 1:
+                return self.shard_map.shard_of(next(iter(ids)))
+        return 0
+
+    def _shards_for_identity(self, query, ident) -> List[int]:
+        pinned = self.info.get(_PINNED)
+        if pinned is not None:
+            return [pinned]
+        mapper = inspect(query.column_descriptions[0]["entity"])
+        key = mapper.primary_key[0]
+        if _is_note_key(key) and isinstance(ident[0], int):
+            return [self.shard_map.shard_of(ident[0])]
+        return self.shard_map.shards
+
+    def _shards_for_statement(self, orm_context) -> List[int]:
+        pinned = self.info.get(_PINNED)
+        if pinned is not None:
+            return [pinned]
+        parameters = orm_context.parameters
+        ids = note_ids(
+            orm_context.statement, parameters if isinstance(parameters, dict) else None
+        )
+        if ids is None:
+            return self.shard_map.shards
+        # A statement for no notes still needs somewhere to run
+        return sorted({self.shard_map.shard_of(i) for i in ids}) or [0]
+
+
+def _sharded(db) -> Optional[ShardedNotesSession]:
+    session = getattr(db, "sync_session", db)
+    return session if isinstance(session, ShardedNotesSession) else None
+
+
+def shard_ids(db) -> Optional[List[int]]:
+    """The shards holding notes, or None if the session is not sharded"""
+    session = _sharded(db)
+    return session.shard_map.shards if session is not None else None
+
+
+@contextmanager
+def on_shard(db, shard: Optional[int]) -> Iterator[None]:
+    """Send every statement of the session to `shard` in the block; no-op unsharded"""
+    session = _sharded(db)
+    if session is None or shard is None:
+        yield
+        return
+    previous = session.info.get(_PINNED)
+    session.info[_PINNED] = shard
+    try:
+        yield
+    finally:
+        if previous is None:
+            session.info.pop(_PINNED, None)
+        else:
+            session.info[_PINNED] = previous
+
+
+@contextmanager
+def for_note(db, note_id: int) -> Iterator[None]:
+    """on_shard for the shard of a note"""
+    session = _sharded(db)
+    shard = session.shard_map.shard_of(note_id) if session is not None else None
+    with on_shard(db, shard):
+        yield
+
+
+async def gather_shards(db, query: Callable[[AsyncSession], Awaitable[T]]) -> List[T]:
+    """
+    Run `query(session)` on every shard at once; returns the results in
+    shard order. A session runs one statement at a time, so each shard gets
+    a session of its own on the shard's engine. That session is not
+    sharded: `query` reads its shard as it would an unsharded database,
+    and does not see changes `db` has not committed. Unsharded, `query`
+    runs on `db`.
+    """
+    session = _sharded(db)
+    if session is None:
+        return [await query(db)]
+
+    async def on(shard: int) -> T:
+        engine = AsyncEngine(session.shard_engines[shard])
+        async with AsyncSession(engine, expire_on_commit=False) as shard_db:
+            return await query(shard_db)
+
+    return list(await asyncio.gather(*(on(shard) for shard in session.shard_map.shards)))
+
+
+def map_shards(db, query: Callable[[Session], T]) -> List[T]:
+    """gather_shards for a Session, running the shards in threads"""
+    session = _sharded(db)
+    if session is None:
+        return [query(db)]
+
+    def on(shard: int) -> T:
+        with Session(session.shard_engines[shard], expire_on_commit=False) as shard_db:
+            return query(shard_db)
+
+    shards = session.shard_map.shards
+    with ThreadPoolExecutor(len(shards)) as pool:
+        return list(pool.map(on, shards))
+
+
+def new_id(db, name: str = "notes") -> Optional[int]:
+    """A globally unique id for a new row of a table, or None to let the database number it"""
+    session = _sharded(db)
+    return session.catalog.next_id(name) if session is not None else None
+
+
+async def new_id_async(db, name: str = "notes") -> Optional[int]:
+    """new_id for an AsyncSession"""
+    session = _sharded(db)
+    if session is None:
+        return None
+    return await session.catalog.next_id_async(name)
@@ -0,0 +1,174 @@
+import os
+import re
+from typing import Mapping, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# Types a browser may render inline from the API origin; anything else,
+# HTML and SVG included, is sent as a download so it cannot run script
+_INLINE_TYPES = ("application/pdf",)
+_UNSAFE_IMAGES = ("image/svg+xml",)
+
+
+def renders_inline(media_type: str) -> bool:
+    """Whether a file of this type is shown in the browser rather than downloaded"""
+    media_type = media_type.split(";", 1)[0].strip().lower()
+    if media_type.startswith("image/"):
+        return media_type not in _UNSAFE_IMAGES
+    return media_type in _INLINE_TYPES
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    The first and last byte of a single-range Range header, or None to send
+    the whole file (no header, several ranges or another unit). Raises
+    ValueError when the range cannot be satisfied.
+    """
+    if not header:
+        return None
+    match = _RANGE.match(header.strip().replace(" ", ""))
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # The last `last` bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError(header)
+    return start, end
+
+
+class BlobResponse(Response):
+    """
+    Serves an immutable file, whole or a single byte range.
+
+    The ETag identifies the content, so If-None-Match answers 304 and
+    If-Range only honours a range of the same content. The file is handed
+    to the server when it supports the ASGI pathsend or zerocopysend
+    extensions, which let it use sendfile; otherwise it is read in chunks
+    with pread in worker threads, so the event loop never waits on disk.
+
+    The media type comes from whoever uploaded the file, so only images
+    and PDFs are shown inline; everything else is a download, and the
+    browser may neither sniff another type nor run script from it.
+    """
+
+    chunk_size = 256 * 1024
+
+    def __init__(
+        self,
+        path: str,
+        size: int,
+        etag: str,
+        media_type: str,
+        filename: Optional[str] = None,
+        headers: Optional[Mapping[str, str]] = None,
+    ):
+        self.path = path
+        self.size = size
+        self.etag = f'"{etag}"'
+        self.status_code = 200
+        self.media_type = media_type
+        self.background = None
+        self.init_headers(headers)
+        self.headers["accept-ranges"] = "bytes"
+        self.headers["etag"] = self.etag
+        # Content never changes under the same ETag
+        self.headers.setdefault("cache-control", "private, max-age=31536000, immutable")
+        self.headers["x-content-type-options"] = "nosniff"
+        self.headers["content-security-policy"] = "sandbox"
+        disposition = "inline" if renders_inline(media_type) else "attachment"
+        if filename is None:
+            self.headers["content-disposition"] = disposition
+        else:
+            quoted = quote(filename)
+            if quoted != filename:
+                self.headers["content-disposition"] = f"{disposition}; filename*=utf-8''{quoted}"
+            else:
+                self.headers["content-disposition"] = f'{disposition}; filename="{filename}"'
+
+    def _select(self, request_headers: Headers) -> Optional[Tuple[int, int]]:
+        """Set the status and length headers; returns the byte range to send"""
+        if self.etag in request_headers.get("if-none-match", "").split(","):
+            self.status_code = 304
+            del self.headers["content-length"]
+            return None
+        if_range = request_headers.get("if-range")
+        header = request_headers.get("range")
+        try:
+            byte_range = None if if_range not in (None, self.etag) else parse_range(header, self.size)
+        except ValueError:
+            self.status_code = 416
+            self.headers["content-range"] = f"bytes */{self.size}"
+            self.headers["content-length"] = "0"
+            return None
+        if byte_range is None:
+            self.headers["content-length"] = str(self.size)
+            return 0, self.size - 1
+        start, end = byte_range
+        self.status_code = 206
+        self.headers["content-range"] = f"bytes {start}-{end}/{self.size}"
+        self.headers["content-length"] = str(end - start + 1)
+        return byte_range
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        byte_range = self._select(Headers(scope=scope))
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        if byte_range is None or scope["method"].upper() == "HEAD" or self.size == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+
+        start, end = byte_range
+        extensions = scope.get("extensions") or {}
+        if self.status_code == 200 and "http.response.pathsend" in extensions:
+            await send({"type": "http.response.pathsend", "path": self.path})
+            return
+        with open(self.path, "rb") as file:
+            if "http.response.zerocopysend" in extensions:
+                await send(
+                    {
+                        "type": "http.response.zerocopysend",
+                        "file": file,
+                        "offset": start,
+                        "count": end - start + 1,
+                        "more_body": False,
+                    }
+                )
+                return
+            fd = file.fileno()
+            offset = start
+            while offset <= end:
+                length = min(self.chunk_size, end - offset + 1)
+                chunk = await anyio.to_thread.run_sync(os.pread, fd, length, offset)
+                if not chunk:
+                    break
+                offset += len(chunk)
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": chunk,
+                        "more_body": offset <= end,
+                    }
+                )
+            if offset <= end:
+                # The file was truncated; end the response rather than hang
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
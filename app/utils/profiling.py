@@ -0,0 +1,143 @@
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Opt-in profiling: the X-Profile header and the /profiling endpoints only
+# exist when this is 1 and PROFILING_TOKEN is set
+PROFILING = os.getenv("PROFILING", "0") == "1"
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+
+# Where profiles are written
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+
+# Seconds between stack samples, and the longest process-wide sampling run
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "300"))
+
+Frame = Tuple[str, str, int]
+
+
+def enabled() -> bool:
+    return PROFILING and bool(PROFILING_TOKEN)
+
+
+def token_valid(token: Optional[str]) -> bool:
+    return enabled() and token is not None and hmac.compare_digest(token, PROFILING_TOKEN)
+
+
+def profile_path(label: str, suffix: str) -> str:
+    """A new file in PROFILE_DIR named after the time and what was profiled"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    safe = "".join(c if c.isalnum() else "_" for c in label).strip("_")[:60]
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    return os.path.join(PROFILE_DIR, f"{stamp}-{safe}-{uuid.uuid4().hex[:8]}{suffix}")
+
+
+class StackSampler:
+    """
+    Statistical profiler that samples Python stacks from a background thread.
+
+    Only the threads in `thread_ids` are sampled, or every other thread when
+    it is None. Sampling ends after `duration` seconds or on stop(), and then
+    `on_finish` is called from the sampling thread. Samples can be exported
+    in the speedscope format.
+    """
+
+    def __init__(
+        self,
+        interval: float = PROFILE_SAMPLE_INTERVAL,
+        thread_ids: Optional[set] = None,
+        duration: Optional[float] = None,
+        on_finish: Optional[Callable[[], None]] = None,
+    ):
+        self.interval = interval
+        self.thread_ids = thread_ids
+        self.duration = duration
+        self.on_finish = on_finish
+        self.samples: Counter = Counter()
+        self.started_at: Optional[float] = None
+        self.stopped_at: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(
+            target=self._run, name="stack-sampler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        deadline = None if self.duration is None else self.started_at + self.duration
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                if self.thread_ids is not None and thread_id not in self.thread_ids:
+                    continue
+                self.samples[self._stack(frame)] += 1
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+        self.stopped_at = time.perf_counter()
+        if self.on_finish is not None:
+            self.on_finish()
+
+    @staticmethod
+    def _stack(frame) -> Tuple[Frame, ...]:
+        stack: List[Frame] = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+            frame = frame.f_back
+        stack.reverse()
+        return tuple(stack)
+
+    def speedscope(self, name: str) -> Dict:
+        """The samples as a speedscope sampled profile, weighted in seconds"""
+        frames: Dict[Frame, int] = {}
+        samples, weights = [], []
+        for stack, count in self.samples.most_common():
+            samples.append([frames.setdefault(frame, len(frames)) for frame in stack])
+            weights.append(count * self.interval)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": "note_app",
+            "shared": {
+                "frames": [
+                    {"name": fn, "file": filename, "line": line}
+                    for fn, filename, line in frames
+                ]
+            },
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": name,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": sum(weights),
+                    "samples": samples,
+                    "weights": weights,
+                }
+            ],
+        }
+
+    def dump_speedscope(self, path: str, name: str) -> None:
+        with open(path, "w") as f:
+            json.dump(self.speedscope(name), f)
@@ -0,0 +1,44 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List, Tuple
+
+
+class QueryStats:
+    """SQL statements run while tracking, the time spent in them and their rows"""
+
+    __slots__ = ("queries", "seconds", "rows", "statements")
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.statements: List[str] = []
+
+    def add(self, statement: str, seconds: float, rows: int) -> None:
+        self.queries += 1
+        self.seconds += seconds
+        self.rows += rows
+        self.statements.append(statement)
+
+
+# Trackers active in the current context; nested tracking sees every
+# statement, so a test can measure a request that the middleware also tracks
+_active: ContextVar[Tuple[QueryStats, ...]] = ContextVar(
+    "query_stats", default=()
+)
+
+
+@contextmanager
+def track_queries() -> Iterator[QueryStats]:
+    """Collect the statements executed in this context until exit"""
+    stats = QueryStats()
+    token = _active.set(_active.get() + (stats,))
+    try:
+        yield stats
+    finally:
+        _active.reset(token)
+
+
+def record(statement: str, seconds: float, rows: int) -> None:
+    for stats in _active.get():
+        stats.add(statement, seconds, rows)
@@ -0,0 +1,113 @@
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Optional
+
+
+class CircuitBreaker:
+    """
+    Fails fast while a backend is unhealthy.
+
+    After failure_threshold consecutive failures the circuit opens and
+    calls are refused for reset_timeout seconds. Then a single probe call
+    is let through (half-open): its success closes the circuit, its
+    failure opens it again. A probe that never reports back is replaced
+    after another reset_timeout.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int,
+        reset_timeout: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._opened_at = 0.0
+            self._probe_at = 0.0
+            self.opened = 0
+            self.rejected = 0
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead now"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = self._clock()
+            since = now - (self._opened_at if self.state == self.OPEN else self._probe_at)
+            if since >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                self._probe_at = now
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self.failures >= self.failure_threshold
+            ):
+                self.state = self.OPEN
+                self._opened_at = self._clock()
+                self.opened += 1
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
+
+
+class LatencyWindow:
+    """Rolling window of recent latencies for percentile estimates"""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples: deque = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._samples.clear()
+
+    def percentile(self, q: float) -> Optional[float]:
+        """The q-th percentile (0-100), or None until min_samples are seen"""
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Exponential backoff with full jitter for the given retry (0-based)"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
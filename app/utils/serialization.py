@@ -0,0 +1,30 @@
+from functools import lru_cache
+from typing import Any
+
+from fastapi.responses import ORJSONResponse
+from pydantic import TypeAdapter
+
+
+@lru_cache(maxsize=None)
+def get_adapter(tp: Any) -> TypeAdapter:
+    """TypeAdapter for a type, built once per process"""
+    return TypeAdapter(tp)
+
+
+def to_jsonable(tp: Any, data: Any) -> Any:
+    """
+    Validate data (ORM objects included) against tp once and dump it to
+    plain Python values that orjson can render.
+    """
+    adapter = get_adapter(tp)
+    return adapter.dump_python(adapter.validate_python(data, from_attributes=True))
+
+
+def json_response(tp: Any, data: Any, status_code: int = 200) -> ORJSONResponse:
+    """
+    Render data as tp with orjson.
+
+    Returning a Response makes FastAPI skip its own validation and encoding
+    of the result; the route's response_model still documents the schema.
+    """
+    return ORJSONResponse(to_jsonable(tp, data), status_code=status_code)
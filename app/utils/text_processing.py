@@ -0,0 +1,144 @@
+import math
+import re
+import zlib
+from functools import lru_cache
+from typing import FrozenSet, List
+
+import nltk
+
+_TOKEN_RE = re.compile(r"[^\W\d_]{2,}", re.UNICODE)
+_PARAGRAPH_RE = re.compile(r"\n\s*\n")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+_HEADING_RE = re.compile(r"^\s{0,3}#{1,6}\s")
+
+# A chunk that reached half its budget ends after roughly one paragraph in
+# this many, chosen by content so boundaries resync after an edit
+_BOUNDARY_MODULUS = 4
+
+# Used when the NLTK corpus is not installed and cannot be downloaded,
+# e.g. on hosts without internet access
+_FALLBACK_STOPWORDS = frozenset(
+    """
+    about above after again against all am an and any are as at be because
+    been before being below between both but by can did do does doing down
+    during each few for from further had has have having he her here hers
+    herself him himself his how if in into is it its itself just me more
+    most my myself no nor not now of off on once only or other our ours
+    ourselves out over own same she should so some such than that the their
+    theirs them themselves then there these they this those through to too
+    under until up very was we were what when where which while who whom why
+    will with you your yours yourself yourselves
+    """.split()
+)
+
+
+@lru_cache(maxsize=1)
+def get_stopwords() -> FrozenSet[str]:
+    """Load the English stopword list once per process"""
+    try:
+        return frozenset(nltk.corpus.stopwords.words("english"))
+    except LookupError:
+        if nltk.download("stopwords", quiet=True):
+            return frozenset(nltk.corpus.stopwords.words("english"))
+        return _FALLBACK_STOPWORDS
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into lowercase word tokens without stopwords.
+
+    This is the shared tokenizer used by the similarity and duplicate
+    detection indexes, so every index sees the same vocabulary.
+    """
+    stopwords = get_stopwords()
+    return [
+        token
+        for token in _TOKEN_RE.findall(text.lower())
+        if token not in stopwords
+    ]
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough model token count (about four characters per token)"""
+    return math.ceil(len(text) / 4)
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split text into sentences, treating paragraph breaks as boundaries"""
+    return [
+        sentence.strip()
+        for block in _PARAGRAPH_RE.split(text)
+        for sentence in _SENTENCE_RE.split(block.strip())
+        if sentence.strip()
+    ]
+
+
+def _pack(parts: List[str], max_tokens: int, sep: str) -> List[str]:
+    packed: List[str] = []
+    current: List[str] = []
+    size = 0
+    for part in parts:
+        # Rounding up per part keeps the sum an upper bound on the joined text
+        tokens = estimate_tokens(sep + part)
+        if current and size + tokens > max_tokens:
+            packed.append(sep.join(current))
+            current, size = [], 0
+        current.append(part)
+        size += tokens
+    if current:
+        packed.append(sep.join(current))
+    return packed
+
+
+def _split_oversized(block: str, max_tokens: int) -> List[str]:
+    sentences: List[str] = []
+    for sentence in _SENTENCE_RE.split(block):
+        if estimate_tokens(sentence) > max_tokens:
+            sentences.extend(_pack(sentence.split(), max_tokens, " "))
+        else:
+            sentences.append(sentence)
+    return _pack(sentences, max_tokens, " ")
+
+
+def split_into_chunks(text: str, max_tokens: int) -> List[str]:
+    """
+    Split text into chunks of at most max_tokens estimated tokens.
+
+    Chunks break at paragraph boundaries and a heading starts a new chunk
+    once the current one is half full. Other boundaries are picked from the
+    paragraph contents rather than positions, so editing one part of a
+    note leaves the chunks around it unchanged. Paragraphs larger than the
+    budget are split at sentence, then word, boundaries.
+    """
+    pieces: List[str] = []
+    for block in _PARAGRAPH_RE.split(text):
+        block = block.strip()
+        if not block:
+            continue
+        if estimate_tokens(block) > max_tokens:
+            pieces.extend(_split_oversized(block, max_tokens))
+        else:
+            pieces.append(block)
+
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    min_tokens = max_tokens // 2
+    for piece in pieces:
+        # Count one token for the separator joining it to the previous piece
+        tokens = estimate_tokens(piece) + 1
+        starts_section = _HEADING_RE.match(piece) is not None
+        if current and (
+            size + tokens > max_tokens or (starts_section and size >= min_tokens)
+        ):
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(piece)
+        size += tokens
+        boundary = zlib.crc32(piece.encode("utf-8")) % _BOUNDARY_MODULUS == 0
+        if size >= min_tokens and boundary:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
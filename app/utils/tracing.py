@@ -0,0 +1,388 @@
+import functools
+import inspect
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from app.utils.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Tracing is opt-in: with 0 the middleware is not installed and every span
+# is a no-op
+TRACING = os.getenv("TRACING", "0") == "1"
+
+# Fraction of requests whose span tree is exported; the Server-Timing
+# header is added to every traced request regardless
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.1"))
+
+# Export format: "jsonl" writes one span tree per line, "otlp" writes OTLP
+# JSON requests, one per line, or POSTs them to TRACE_OTLP_ENDPOINT if set
+TRACE_FORMAT = os.getenv("TRACE_FORMAT", "jsonl")
+TRACE_FILE = os.getenv("TRACE_FILE", "./traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "")
+
+# Sampled traces waiting for the exporter; more are dropped
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", "1000"))
+
+SERVICE_NAME = "note_app"
+
+traces_exported = registry.counter("traces_exported", "Sampled traces exported")
+traces_dropped = registry.counter(
+    "traces_dropped", "Sampled traces dropped because the export queue was full"
+)
+
+
+class Span:
+    """A timed operation; `kind` groups spans into the phases of a request"""
+
+    __slots__ = (
+        "trace", "name", "kind", "span_id", "parent_id", "start", "end",
+        "attributes", "error", "outer_kinds",
+    )
+
+    def __init__(self, trace: "Trace", name: str, kind: str, parent: Optional["Span"]):
+        self.trace = trace
+        self.name = name
+        self.kind = kind
+        self.span_id = random.getrandbits(64)
+        self.parent_id = parent.span_id if parent is not None else trace.parent_id
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.attributes: Dict[str, Any] = {}
+        self.error: Optional[str] = None
+        # Kinds of the enclosing spans; only the outermost span of a kind
+        # counts towards its phase, so nested service calls are not
+        # counted twice
+        self.outer_kinds = (
+            parent.outer_kinds | {parent.kind} if parent is not None else frozenset()
+        )
+
+    def finish(self, end: Optional[float] = None) -> None:
+        self.end = time.perf_counter() if end is None else end
+        self.trace.add(self)
+
+
+class Trace:
+    """The spans of one request, and the time spent per span kind"""
+
+    def __init__(
+        self,
+        sampled: bool,
+        trace_id: Optional[int] = None,
+        parent_id: Optional[int] = None,
+    ):
+        self.trace_id = trace_id or random.getrandbits(128)
+        # Span id of the caller's span when the request carried a traceparent
+        self.parent_id = parent_id
+        self.sampled = sampled
+        self.spans: List[Span] = []
+        # kind -> [seconds, count]
+        self.phases: Dict[str, List[float]] = {}
+        # Wall clock time matching the perf_counter() origin of the spans
+        self.epoch = time.time() - time.perf_counter()
+
+    def add(self, span: Span) -> None:
+        if span.kind not in span.outer_kinds:
+            phase = self.phases.setdefault(span.kind, [0.0, 0])
+            phase[0] += span.end - span.start
+            phase[1] += 1
+        if self.sampled:
+            self.spans.append(span)
+
+    @property
+    def trace_id_hex(self) -> str:
+        return f"{self.trace_id:032x}"
+
+
+_trace: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+_span: ContextVar[Optional[Span]] = ContextVar("span", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _trace.get()
+
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+def start_trace(traceparent: Optional[str] = None) -> Trace:
+    """
+    A new trace for a request. A W3C traceparent header continues the
+    caller's trace and follows its sampling decision; otherwise the trace
+    is sampled at TRACE_SAMPLE_RATE.
+    """
+    match = _TRACEPARENT.match(traceparent.strip().lower()) if traceparent else None
+    if match and int(match.group(1), 16) and int(match.group(2), 16):
+        return Trace(
+            sampled=bool(int(match.group(3), 16) & 1),
+            trace_id=int(match.group(1), 16),
+            parent_id=int(match.group(2), 16),
+        )
+    return Trace(sampled=random.random() < TRACE_SAMPLE_RATE)
+
+
+@contextmanager
+def activate(trace: Trace) -> Iterator[Trace]:
+    """Make `trace` the current trace of this context until exit"""
+    trace_token = _trace.set(trace)
+    span_token = _span.set(None)
+    try:
+        yield trace
+    finally:
+        _span.reset(span_token)
+        _trace.reset(trace_token)
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", **attributes) -> Iterator[Optional[Span]]:
+    """Time the block as a child of the current span; no-op outside a trace"""
+    trace = _trace.get()
+    if trace is None:
+        yield None
+        return
+    current = Span(trace, name, kind, _span.get())
+    current.attributes.update(attributes)
+    token = _span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = type(e).__name__
+        raise
+    finally:
+        _span.reset(token)
+        current.finish()
+
+
+def record_span(
+    name: str,
+    kind: str,
+    start: float,
+    end: Optional[float] = None,
+    **attributes,
+) -> None:
+    """Add an already finished operation, timed with perf_counter, to the current span"""
+    trace = _trace.get()
+    if trace is None:
+        return
+    finished = Span(trace, name, kind, _span.get())
+    finished.start = start
+    finished.attributes.update(attributes)
+    finished.finish(end)
+
+
+def traced(kind: str = "service", name: Optional[str] = None) -> Callable:
+    """
+    Decorator running a function, sync or async, in a span named
+    `module.function` unless `name` is given.
+    """
+
+    def decorate(fn: Callable) -> Callable:
+        span_name = name or f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__name__}"
+
+        if inspect.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                if _trace.get() is None:
+                    return await fn(*args, **kwargs)
+                with span(span_name, kind):
+                    return await fn(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _trace.get() is None:
+                return fn(*args, **kwargs)
+            with span(span_name, kind):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def server_timing(trace: Trace, total: float) -> str:
+    """Server-Timing header value: the total and the time of each span kind"""
+    entries = [f"total;dur={total * 1000:.3f}"]
+    for kind, (seconds, count) in trace.phases.items():
+        if kind == "server":
+            continue
+        count = int(count)
+        desc = f"{count} span" if count == 1 else f"{count} spans"
+        entries.append(f'{kind};dur={seconds * 1000:.3f};desc="{desc}"')
+    return ", ".join(entries)
+
+
+def _nano(trace: Trace, perf: float) -> int:
+    return int((trace.epoch + perf) * 1e9)
+
+
+def to_tree(trace: Trace) -> Dict[str, Any]:
+    """The trace as nested spans, with times in milliseconds from its start"""
+    origin = min((s.start for s in trace.spans), default=0.0)
+    nodes = {}
+    for s in trace.spans:
+        nodes[s.span_id] = {
+            "name": s.name,
+            "kind": s.kind,
+            "span_id": f"{s.span_id:016x}",
+            "start_ms": round((s.start - origin) * 1000, 3),
+            "duration_ms": round((s.end - s.start) * 1000, 3),
+            **({"attributes": s.attributes} if s.attributes else {}),
+            **({"error": s.error} if s.error else {}),
+            "children": [],
+        }
+    roots = []
+    for s in sorted(trace.spans, key=lambda s: s.start):
+        parent = nodes.get(s.parent_id)
+        (parent["children"] if parent is not None else roots).append(nodes[s.span_id])
+    return {
+        "trace_id": trace.trace_id_hex,
+        "start": trace.epoch + origin,
+        "spans": roots,
+    }
+
+
+# OTLP span kinds: the request is the server span, Gemini calls are client
+# spans and everything else is internal
+_OTLP_KINDS = {"server": 2, "ai": 3}
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(traces: List[Trace]) -> Dict[str, Any]:
+    """Traces as an OTLP/JSON ExportTraceServiceRequest"""
+    spans = []
+    for trace in traces:
+        for s in trace.spans:
+            attributes = {"app.span_kind": s.kind, **s.attributes}
+            spans.append(
+                {
+                    "traceId": trace.trace_id_hex,
+                    "spanId": f"{s.span_id:016x}",
+                    "parentSpanId": f"{s.parent_id:016x}" if s.parent_id else "",
+                    "name": s.name,
+                    "kind": _OTLP_KINDS.get(s.kind, 1),
+                    "startTimeUnixNano": str(_nano(trace, s.start)),
+                    "endTimeUnixNano": str(_nano(trace, s.end)),
+                    "attributes": [
+                        {"key": key, "value": _otlp_value(value)}
+                        for key, value in attributes.items()
+                    ],
+                    "status": {"code": 2, "message": s.error} if s.error else {},
+                }
+            )
+    return {
+        "resourceSpans": [
+            {
+                "resource": {
+                    "attributes": [
+                        {"key": "service.name", "value": {"stringValue": SERVICE_NAME}}
+                    ]
+                },
+                "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}],
+            }
+        ]
+    }
+
+
+class TraceExporter:
+    """
+    Writes sampled traces from a background thread, so requests never wait
+    on the file or the collector. Traces are batched; when the queue is
+    full new ones are dropped.
+    """
+
+    def __init__(
+        self,
+        format: str = TRACE_FORMAT,
+        path: str = TRACE_FILE,
+        endpoint: str = TRACE_OTLP_ENDPOINT,
+        max_queue: int = TRACE_QUEUE_SIZE,
+        batch_size: int = 100,
+    ):
+        if format not in ("jsonl", "otlp"):
+            raise ValueError(f"Unknown trace format: {format}")
+        self.format = format
+        self.path = path
+        self.endpoint = endpoint
+        self.batch_size = batch_size
+        self._queue: "queue.Queue[Trace]" = queue.Queue(max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def export(self, trace: Trace) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="trace-exporter", daemon=True
+                    )
+                    self._thread.start()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            traces_dropped.inc()
+
+    def flush(self) -> None:
+        """Block until every queued trace is written"""
+        self._queue.join()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.write(batch)
+                traces_exported.inc(len(batch))
+            except Exception:
+                logger.exception("Exporting %d traces failed", len(batch))
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def write(self, traces: List[Trace]) -> None:
+        if self.format == "otlp":
+            payload = json.dumps(to_otlp(traces))
+            if self.endpoint:
+                request = urllib.request.Request(
+                    self.endpoint,
+                    data=payload.encode(),
+                    headers={"Content-Type": "application/json"},
+                )
+                urllib.request.urlopen(request, timeout=10).close()
+                return
+            lines = [payload]
+        else:
+            lines = [json.dumps(to_tree(trace)) for trace in traces]
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+exporter = TraceExporter() if TRACING else None
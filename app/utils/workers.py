@@ -0,0 +1,10 @@
+import os
+
+# Worker processes serving the app. app.server sets it for the workers it
+# starts, so limits configured for the whole server are split between them
+WEB_WORKERS = max(1, int(os.getenv("WEB_WORKERS", "1")))
+
+
+def per_worker(total: int, workers: int = WEB_WORKERS) -> int:
+    """Each worker's share of a server-wide limit, at least 1"""
+    return max(1, total // workers)
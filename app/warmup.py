@@ -0,0 +1,84 @@
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Dict
+
+import nltk
+from fastapi import HTTPException
+from sqlalchemy import text
+
+from app.database import AsyncSessionLocal, async_shard_engines, shard_engines
+from app.models.notes import Note
+from app.schemas.notes import NoteResponse, NoteWithHistory
+from app.services import analytics
+from app.services import notes as notes_service
+from app.utils import text_processing
+from app.utils.serialization import json_response
+
+logger = logging.getLogger(__name__)
+
+# Run the cold paths once at startup, before the worker accepts requests
+WARMUP = os.getenv("WARMUP", "1") == "1"
+
+
+async def _database() -> None:
+    # The first connection also initializes the dialect
+    for async_engine in async_shard_engines:
+        async with async_engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+    for engine in shard_engines:
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+
+
+async def _queries() -> None:
+    # Compiles the hot statements into SQLAlchemy's statement cache
+    async with AsyncSessionLocal() as db:
+        await notes_service.get_all_note_rows_async(db, 0, 1)
+        # Note 0 never exists, so these end in a 404
+        for lookup in (notes_service.get_note_history_async, notes_service.get_note_async):
+            try:
+                await lookup(db, 0)
+            except HTTPException:
+                pass
+
+
+async def _text() -> None:
+    text_processing.tokenize("Warm up the tokenizer")
+    try:
+        analytics.remove_stopwords(["warm", "up"])
+        nltk.word_tokenize("Warm up the tokenizer.")
+    except LookupError:
+        logger.warning("NLTK data is missing; analytics will fail until it is installed")
+
+
+async def _serialization() -> None:
+    now = datetime.now()
+    note = Note(id=0, title="Warm up", content="Warm up", created_at=now, updated_at=now)
+    json_response(NoteResponse, note)
+    json_response(NoteWithHistory, {**NoteResponse.model_validate(note).model_dump(), "history": []})
+
+
+STEPS = {
+    "database": _database,
+    "queries": _queries,
+    "text": _text,
+    "serialization": _serialization,
+}
+
+
+async def warm_up() -> Dict[str, float]:
+    """Run each warm-up step once; returns the seconds each took"""
+    timings = {}
+    for name, step in STEPS.items():
+        start = time.perf_counter()
+        await step()
+        timings[name] = round(time.perf_counter() - start, 3)
+    logger.info(
+        "Worker %s warmed up in %.2fs (%s)",
+        os.getpid(),
+        sum(timings.values()),
+        ", ".join(f"{name} {seconds}s" for name, seconds in timings.items()),
+    )
+    return timings
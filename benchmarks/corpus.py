@@ -0,0 +1,103 @@
+"""
+Seed a database with a synthetic notes corpus for load tests.
+
+Notes and their edit histories come from benchmarks.data, so the same
+seed always gives the same corpus. Rows are written with batched
+executemany inserts.
+
+    python -m benchmarks.corpus --notes 100k --database ./bench_100k.db
+"""
+import argparse
+import itertools
+import time
+from typing import Dict
+
+from sqlalchemy import create_engine, func, select
+
+from app.database import Base, create_schema
+from app.models.notes import Note, NoteHistory
+from benchmarks.data import generate
+
+SIZES = {"1k": 1_000, "100k": 100_000, "1M": 1_000_000}
+
+
+def parse_size(value: str) -> int:
+    """Corpus size from a preset (1k, 100k, 1M) or a plain number"""
+    if value in SIZES:
+        return SIZES[value]
+    return int(value)
+
+
+def seed_database(
+    url: str,
+    count: int,
+    seed: int = 0,
+    batch_size: int = 10_000,
+    reset: bool = False,
+    progress: bool = False,
+) -> Dict:
+    """Fill the database at `url` with `count` notes; returns what was written"""
+    engine = create_engine(url)
+    if reset:
+        Base.metadata.drop_all(bind=engine)
+    create_schema(engine)
+
+    with engine.connect() as conn:
+        existing = conn.execute(select(func.count()).select_from(Note.__table__)).scalar()
+    if existing:
+        raise SystemExit(f"{url} already has {existing} notes; pass --reset to replace them")
+
+    start = time.perf_counter()
+    notes_written = history_written = 0
+    rows = generate(count, seed)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            break
+        notes = [note for note, _ in batch]
+        history = [version for _, versions in batch for version in versions]
+        with engine.begin() as conn:
+            if engine.dialect.name == "sqlite":
+                # Durability is irrelevant while seeding
+                conn.exec_driver_sql("PRAGMA synchronous = OFF")
+            conn.execute(Note.__table__.insert(), notes)
+            if history:
+                conn.execute(NoteHistory.__table__.insert(), history)
+        notes_written += len(notes)
+        history_written += len(history)
+        if progress:
+            print(f"{notes_written}/{count} notes", flush=True)
+    engine.dispose()
+
+    return {
+        "notes": notes_written,
+        "history": history_written,
+        "seconds": round(time.perf_counter() - start, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--notes", default="1k", help="1k, 100k, 1M or a number")
+    parser.add_argument("--database", default="./bench.db")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--reset", action="store_true", help="drop existing tables first")
+    args = parser.parse_args()
+
+    result = seed_database(
+        f"sqlite:///{args.database}",
+        parse_size(args.notes),
+        seed=args.seed,
+        batch_size=args.batch_size,
+        reset=args.reset,
+        progress=True,
+    )
+    print(
+        f"Seeded {result['notes']} notes and {result['history']} history rows "
+        f"in {result['seconds']}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
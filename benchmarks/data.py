@@ -0,0 +1,103 @@
+"""
+Deterministic synthetic notes for benchmarks.
+
+Note lengths follow a log-normal distribution with a long tail, words a
+Zipf distribution over a fixed vocabulary, and about half the notes have
+an edit history of earlier, shorter drafts. The same seed always gives the
+same data.
+"""
+import itertools
+import math
+import random
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Tuple
+
+# Median note length in words and the spread of the log-normal around it
+MEDIAN_WORDS = 120
+WORDS_SIGMA = 0.9
+MAX_WORDS = 5000
+
+# Chance of each further edit; the number of versions is geometric
+EDIT_PROBABILITY = 0.5
+MAX_VERSIONS = 20
+
+VOCABULARY_SIZE = 20_000
+STOPWORDS = (
+    "the", "a", "and", "of", "to", "in", "is", "it", "that", "for", "on",
+    "with", "as", "was", "this", "be", "at", "by", "we", "not",
+)
+SYLLABLES = (
+    "ka", "lo", "mi", "ne", "ra", "su", "ti", "vo", "ze", "an", "el", "is",
+    "or", "un", "ber", "con", "dor", "fen", "gal", "hum", "lin", "mar",
+    "nor", "pel", "quin", "ros", "sen", "tar", "ver", "wil",
+)
+
+START = datetime(2023, 1, 1)
+SPAN_SECONDS = 2 * 365 * 24 * 3600
+
+
+class TextGenerator:
+    """Deterministic text with a Zipf word distribution"""
+
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        words = set()
+        while len(words) < VOCABULARY_SIZE:
+            words.add("".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))))
+        # Stopwords are the most frequent words, as in real text
+        self.vocabulary = list(STOPWORDS) + sorted(words)
+        self.cum_weights = list(
+            itertools.accumulate(1 / rank for rank in range(1, len(self.vocabulary) + 1))
+        )
+
+    def words(self, count: int) -> List[str]:
+        return self.rng.choices(self.vocabulary, cum_weights=self.cum_weights, k=count)
+
+    def title(self) -> str:
+        return " ".join(self.words(self.rng.randint(2, 8))).capitalize()
+
+    def content(self) -> str:
+        count = int(self.rng.lognormvariate(math.log(MEDIAN_WORDS), WORDS_SIGMA))
+        words = self.words(min(max(count, 5), MAX_WORDS))
+        sentences = []
+        start = 0
+        while start < len(words):
+            end = start + self.rng.randint(6, 18)
+            sentences.append(" ".join(words[start:end]).capitalize() + ".")
+            start = end
+        return " ".join(sentences)
+
+
+def generate(count: int, seed: int = 0) -> Iterator[Tuple[Dict, List[Dict]]]:
+    """Yield (note row, history rows) for note ids 1..count"""
+    rng = random.Random(seed)
+    text = TextGenerator(rng)
+    for note_id in range(1, count + 1):
+        created = START + timedelta(seconds=rng.randrange(SPAN_SECONDS))
+        title, content = text.title(), text.content()
+
+        versions = 0
+        while versions < MAX_VERSIONS and rng.random() < EDIT_PROBABILITY:
+            versions += 1
+        history = []
+        edited = created
+        for version in range(versions):
+            edited += timedelta(minutes=rng.randint(1, 60 * 24 * 30))
+            # Earlier drafts are prefixes of the final text
+            cut = max(1, len(content) * (version + 1) // (versions + 1))
+            history.append(
+                {
+                    "note_id": note_id,
+                    "title": title if rng.random() < 0.8 else text.title(),
+                    "content": content[:cut],
+                    "created_at": edited,
+                }
+            )
+        note = {
+            "id": note_id,
+            "title": title,
+            "content": content,
+            "created_at": created,
+            "updated_at": edited,
+        }
+        yield note, history
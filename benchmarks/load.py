@@ -0,0 +1,354 @@
+"""
+HTTP load generator for the notes API.
+
+Sends a weighted mix of requests to the app, either in-process through
+httpx's ASGI transport or over HTTP to a uvicorn server it starts, and
+reports throughput and latency percentiles per endpoint as JSON. AI
+requests use the local summarizer unless SUMMARIZER_BACKEND says
+otherwise, so by default no model is called.
+
+    python -m benchmarks.corpus --notes 100k --database ./bench_100k.db
+    python -m benchmarks.load --database ./bench_100k.db --mode uvicorn \\
+        --duration 30 --concurrency 32 --output results.json
+
+With --rate the load is open-loop: requests are sent on a fixed schedule
+and latency is measured from the scheduled time, so a stalled server is
+not hidden by clients that simply wait for it.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+from sqlalchemy import create_engine, text
+
+from benchmarks.data import TextGenerator
+from benchmarks.stats import summarize_latencies
+
+DEFAULT_MIX = "read=50,list=15,create=8,update=10,history=10,analytics=1,ai=6"
+
+# Operation -> endpoint label, as the route template it exercises
+ENDPOINTS = {
+    "read": "GET /notes/{note_id}",
+    "list": "GET /notes/",
+    "create": "POST /notes/",
+    "update": "PUT /notes/{note_id}",
+    "history": "GET /notes/{note_id}/history",
+    "analytics": "GET /analytics/notes",
+    "ai": "GET /ai/notes/{note_id}/summary",
+}
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(
+                f"Unknown operation {name!r}; expected one of {', '.join(ENDPOINTS)}"
+            )
+        mix[name] = float(weight or 1)
+    return {name: weight for name, weight in mix.items() if weight > 0}
+
+
+class Workload:
+    """Picks the next request according to the mix"""
+
+    def __init__(self, mix: Dict[str, float], max_id: int, seed: int = 0):
+        self.operations = list(mix)
+        self.cum_weights = list(itertools.accumulate(mix.values()))
+        self.max_id = max(max_id, 1)
+        self.text = TextGenerator(random.Random(seed))
+
+    def note_created(self, note_id: int) -> None:
+        self.max_id = max(self.max_id, note_id)
+
+    def next_request(self, rng: random.Random) -> Tuple[str, str, str, Optional[dict]]:
+        """(endpoint label, method, url, JSON body) of the next request"""
+        operation = rng.choices(self.operations, cum_weights=self.cum_weights)[0]
+        note_id = rng.randint(1, self.max_id)
+        label = ENDPOINTS[operation]
+        if operation == "read":
+            return label, "GET", f"/notes/{note_id}", None
+        if operation == "list":
+            # Most listing stays on the first pages
+            skip = 100 * int(rng.expovariate(0.5))
+            return label, "GET", f"/notes/?skip={skip}&limit=100", None
+        if operation == "create":
+            body = {"title": self.text.title(), "content": self.text.content()}
+            return label, "POST", "/notes/", body
+        if operation == "update":
+            return label, "PUT", f"/notes/{note_id}", {"content": self.text.content()}
+        if operation == "history":
+            return label, "GET", f"/notes/{note_id}/history", None
+        if operation == "analytics":
+            return label, "GET", "/analytics/notes", None
+        return label, "GET", f"/ai/notes/{note_id}/summary", None
+
+
+async def run_load(
+    client: httpx.AsyncClient,
+    workload: Workload,
+    concurrency: int,
+    duration: float,
+    warmup: float = 0.0,
+    rate: float = 0.0,
+    seed: int = 0,
+) -> Tuple[Dict[str, dict], float]:
+    """Drive the workload; returns per-endpoint samples and the measured seconds"""
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    measure_from = start + warmup
+    deadline = measure_from + duration
+    slots = itertools.count()
+    results: Dict[str, dict] = defaultdict(
+        lambda: {"latencies": [], "statuses": Counter()}
+    )
+
+    async def worker(number: int) -> None:
+        rng = random.Random(seed * 100_003 + number)
+        while True:
+            if rate > 0:
+                scheduled = start + next(slots) / rate
+                if scheduled >= deadline:
+                    return
+                if scheduled > loop.time():
+                    await asyncio.sleep(scheduled - loop.time())
+            else:
+                scheduled = loop.time()
+                if scheduled >= deadline:
+                    return
+
+            label, method, url, body = workload.next_request(rng)
+            try:
+                response = await client.request(method, url, json=body)
+                status = str(response.status_code)
+                if response.status_code == 201:
+                    workload.note_created(response.json()["id"])
+            except httpx.HTTPError as e:
+                status = type(e).__name__
+            if scheduled >= measure_from:
+                entry = results[label]
+                entry["latencies"].append(loop.time() - scheduled)
+                entry["statuses"][status] += 1
+
+    await asyncio.gather(*(worker(n) for n in range(concurrency)))
+    return results, max(loop.time() - measure_from, 1e-9)
+
+
+def _is_error(status: str) -> bool:
+    return not status.isdigit() or int(status) >= 400
+
+
+def build_report(results: Dict[str, dict], elapsed: float, meta: dict) -> dict:
+    endpoints = {}
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    for label in sorted(results):
+        entry = results[label]
+        count = len(entry["latencies"])
+        latencies.extend(entry["latencies"])
+        statuses.update(entry["statuses"])
+        endpoints[label] = {
+            "requests": count,
+            "errors": sum(n for s, n in entry["statuses"].items() if _is_error(s)),
+            "throughput_rps": round(count / elapsed, 2),
+            **summarize_latencies(entry["latencies"]),
+            "statuses": dict(entry["statuses"]),
+        }
+    total = {
+        "requests": len(latencies),
+        "errors": sum(n for s, n in statuses.items() if _is_error(s)),
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        **summarize_latencies(latencies),
+    }
+    return {**meta, "measured_seconds": round(elapsed, 3), "total": total, "endpoints": endpoints}
+
+
+def _change(before: Optional[float], after: Optional[float]) -> Optional[float]:
+    if not before or after is None:
+        return None
+    return round((after - before) / before * 100, 1)
+
+
+def compare(report: dict, baseline: dict) -> dict:
+    """Percent change of throughput and tail latency against a baseline report"""
+    changes = {}
+    for label, current in {"total": report["total"], **report["endpoints"]}.items():
+        previous = baseline["total"] if label == "total" else baseline["endpoints"].get(label)
+        if previous is None:
+            continue
+        changes[label] = {
+            f"{key}_change_pct": _change(previous.get(key), current.get(key))
+            for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms")
+        }
+    return {"commit": baseline.get("commit"), "changes": changes}
+
+
+def app_environment(database: str) -> Dict[str, str]:
+    """Settings for the app under test; explicit environment values win"""
+    env = {
+        "TFIDF_INDEX_PATH": f"{database}.tfidf.npz",
+        "SQL_ECHO": "0",
+        "SUMMARIZER_BACKEND": "local",
+    }
+    env.update(os.environ)
+    env["DATABASE_URL"] = f"sqlite:///{database}"
+    return env
+
+
+def _max_note_id(database: str) -> int:
+    engine = create_engine(f"sqlite:///{database}")
+    try:
+        with engine.connect() as conn:
+            return conn.execute(text("SELECT max(id) FROM notes")).scalar() or 0
+    finally:
+        engine.dispose()
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def _load(client: httpx.AsyncClient, workload: Workload, args):
+    return await run_load(
+        client, workload, args.concurrency, args.duration, args.warmup, args.rate, args.seed
+    )
+
+
+async def run_inprocess(args, workload: Workload):
+    os.environ.update(app_environment(args.database))
+    # Imported only now, since the app reads its settings at import time
+    from app.main import app
+
+    started = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        startup = time.perf_counter() - started
+        # Unhandled errors become 500s, as they would behind a server
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://bench", timeout=args.timeout
+        ) as client:
+            results, elapsed = await _load(client, workload, args)
+    return startup, results, elapsed
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _wait_until_ready(client: httpx.AsyncClient, server, timeout: float) -> None:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"uvicorn exited with status {server.returncode}")
+        try:
+            if (await client.get("/")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise SystemExit(f"uvicorn did not start within {timeout}s")
+
+
+async def run_uvicorn(args, workload: Workload):
+    port = _free_port()
+    command = [
+        sys.executable, "-m", "uvicorn", "app.main:app",
+        "--host", "127.0.0.1", "--port", str(port),
+        "--log-level", "warning", "--no-access-log",
+    ]
+    started = time.perf_counter()
+    server = subprocess.Popen(command, env=app_environment(args.database))
+    limits = httpx.Limits(
+        max_connections=args.concurrency, max_keepalive_connections=args.concurrency
+    )
+    try:
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{port}", timeout=args.timeout, limits=limits
+        ) as client:
+            await _wait_until_ready(client, server, args.startup_timeout)
+            startup = time.perf_counter() - started
+            results, elapsed = await _load(client, workload, args)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+    return startup, results, elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--database", default="./bench.db", help="seeded with benchmarks.corpus")
+    parser.add_argument("--mode", choices=("inprocess", "uvicorn"), default="inprocess")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="seconds before measuring")
+    parser.add_argument("--rate", type=float, default=0, help="requests per second; 0 for closed-loop")
+    parser.add_argument("--timeout", type=float, default=60, help="per-request seconds")
+    parser.add_argument("--startup-timeout", type=float, default=900)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    parser.add_argument("--baseline", help="earlier JSON report to compare against")
+    args = parser.parse_args()
+    if isinstance(args.mix, str):
+        args.mix = parse_mix(args.mix)
+
+    if not os.path.exists(args.database):
+        raise SystemExit(f"{args.database} not found; seed it with python -m benchmarks.corpus")
+    notes = _max_note_id(args.database)
+    workload = Workload(args.mix, notes, args.seed)
+    runner = run_inprocess if args.mode == "inprocess" else run_uvicorn
+    startup, results, elapsed = asyncio.run(runner(args, workload))
+
+    report = build_report(
+        results,
+        elapsed,
+        {
+            "commit": _commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "mode": args.mode,
+            "database": args.database,
+            "notes": notes,
+            "mix": args.mix,
+            "concurrency": args.concurrency,
+            "rate": args.rate,
+            "warmup_seconds": args.warmup,
+            "startup_seconds": round(startup, 3),
+        },
+    )
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["baseline"] = compare(report, json.load(f))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
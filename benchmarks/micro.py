@@ -0,0 +1,324 @@
+"""
+Micro-benchmarks of the service-layer hot paths.
+
+Times note analytics, the text helpers it uses, the notes service CRUD
+functions on an in-memory SQLite database and response serialization, all
+on deterministic data from benchmarks.data. Each case reports the median
+and best time per call over several rounds, and the peak memory allocated
+by one call as traced by tracemalloc.
+
+    python -m benchmarks.micro                   # run and print
+    python -m benchmarks.micro --save-baseline   # store the results as the baseline
+    python -m benchmarks.micro --check           # exit 1 on regressions against it
+
+A case regresses when its median time or peak memory grows by more than
+its threshold relative to the baseline. Baselines are machine-specific, so
+compare runs made on the same host.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import re
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from app.database import Base
+from app.models.notes import Note, NoteHistory
+from app.schemas.notes import NoteCreate, NoteResponse, NoteUpdate, NoteWithHistory
+from app.services import analytics
+from app.services import notes as notes_service
+from app.utils.serialization import json_response
+from benchmarks.data import generate
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines", "micro.json")
+
+# Allowed slowdown and memory growth before a case counts as a regression
+TIME_THRESHOLD = 0.20
+MEMORY_THRESHOLD = 0.20
+
+# A case's setup returns the function to time and the operations per call
+Setup = Callable[[], Tuple[Callable[[], None], int]]
+
+CASES: Dict[str, Tuple[Setup, float]] = {}
+
+
+def case(name: str, time_threshold: float = TIME_THRESHOLD):
+    def register(setup: Setup) -> Setup:
+        CASES[name] = (setup, time_threshold)
+        return setup
+
+    return register
+
+
+def _notes(count: int, seed: int = 0) -> List[Note]:
+    return [Note(**row) for row, _ in generate(count, seed)]
+
+
+@case("analytics.analyze_notes[500]")
+def _analyze():
+    notes = _notes(500)
+    # One shard's analysis and the merge, as in an unsharded database
+    return lambda: analytics._merge_analyses([analytics._partial_analysis(notes)]), 1
+
+
+@case("analytics.clean_text[200]")
+def _clean_text():
+    contents = [note.content for note in _notes(200)]
+
+    def run():
+        for content in contents:
+            analytics.clean_text(content)
+
+    return run, len(contents)
+
+
+@case("analytics.remove_stopwords[200]")
+def _remove_stopwords():
+    words = [analytics.clean_text(note.content).split() for note in _notes(200)]
+
+    def run():
+        for note_words in words:
+            analytics.remove_stopwords(note_words)
+
+    return run, len(words)
+
+
+def _with_database(count: int, body: Callable, ops: int):
+    """Time `body(session, note_ids)` against an in-memory database of `count` notes"""
+    loop = asyncio.new_event_loop()
+    engine = create_async_engine(
+        "sqlite+aiosqlite://",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+    )
+    session_factory = sessionmaker(
+        bind=engine, class_=AsyncSession, expire_on_commit=False
+    )
+
+    async def seed():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            rows = list(generate(count))
+            await conn.execute(Note.__table__.insert(), [note for note, _ in rows])
+            history = [version for _, versions in rows for version in versions]
+            await conn.execute(NoteHistory.__table__.insert(), history)
+
+    loop.run_until_complete(seed())
+    note_ids = list(range(1, count + 1))
+
+    async def run_once():
+        async with session_factory() as session:
+            await body(session, note_ids)
+
+    return lambda: loop.run_until_complete(run_once()), ops
+
+
+@case("notes.create_note_async", time_threshold=0.30)
+def _create():
+    notes = [
+        NoteCreate(title=note.title, content=note.content) for note in _notes(50, seed=1)
+    ]
+
+    async def body(session, note_ids):
+        for note in notes:
+            await notes_service.create_note_async(session, note)
+
+    return _with_database(1000, body, len(notes))
+
+
+@case("notes.get_note_async", time_threshold=0.30)
+def _get():
+    async def body(session, note_ids):
+        for note_id in note_ids[:200]:
+            await notes_service.get_note_async(session, note_id)
+
+    return _with_database(1000, body, 200)
+
+
+@case("notes.update_note_async", time_threshold=0.30)
+def _update():
+    updates = [NoteUpdate(content=note.content) for note in _notes(50, seed=2)]
+
+    async def body(session, note_ids):
+        for note_id, update in zip(note_ids, updates):
+            await notes_service.update_note_async(session, note_id, update)
+
+    return _with_database(1000, body, len(updates))
+
+
+@case("notes.get_all_note_rows_async[100]", time_threshold=0.30)
+def _list():
+    async def body(session, note_ids):
+        for skip in range(0, 1000, 100):
+            await notes_service.get_all_note_rows_async(session, skip, 100)
+
+    return _with_database(1000, body, 10)
+
+
+@case("notes.get_note_history_async", time_threshold=0.30)
+def _history():
+    async def body(session, note_ids):
+        for note_id in note_ids[:200]:
+            await notes_service.get_note_history_async(session, note_id)
+
+    return _with_database(1000, body, 200)
+
+
+@case("serialization.NoteResponse")
+def _note_response():
+    note = _notes(1)[0]
+    return lambda: json_response(NoteResponse, note).body, 1
+
+
+@case("serialization.NoteWithHistory[20]")
+def _note_with_history():
+    rows = list(generate(200))
+    note, history = max(rows, key=lambda row: len(row[1]))
+    payload = {**note, "history": [NoteHistory(**version) for version in history[:20]]}
+    return lambda: json_response(NoteWithHistory, payload).body, 1
+
+
+def measure(fn: Callable[[], None], ops: int, rounds: int, min_time: float) -> Dict:
+    """Median and best time per operation, and the peak memory of one call"""
+    fn()
+    # Calls per round, so that a round lasts at least min_time
+    start = time.perf_counter()
+    fn()
+    single = max(time.perf_counter() - start, 1e-9)
+    number = max(1, int(min_time / single))
+
+    samples = []
+    gc_was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(rounds):
+            start = time.perf_counter()
+            for _ in range(number):
+                fn()
+            samples.append((time.perf_counter() - start) / number / ops)
+    finally:
+        if gc_was_enabled:
+            gc.enable()
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "median_us": round(statistics.median(samples) * 1e6, 3),
+        "min_us": round(min(samples) * 1e6, 3),
+        "peak_kib": round(peak / 1024, 1),
+        "rounds": rounds,
+        "calls_per_round": number,
+    }
+
+
+def run(
+    selected: Optional[str] = None, rounds: int = 7, min_time: float = 0.2
+) -> Dict[str, Dict]:
+    results = {}
+    for name, (setup, _) in CASES.items():
+        if selected and selected not in name:
+            continue
+        try:
+            fn, ops = setup()
+            results[name] = measure(fn, ops, rounds, min_time)
+        except LookupError as e:
+            # Missing NLTK data, for instance; reported rather than fatal
+            message = re.sub(r"\x1b\[[0-9;]*m", "", str(e))
+            reason = next(
+                (line.strip() for line in message.splitlines() if line.strip("* ")), ""
+            )
+            results[name] = {"skipped": f"{type(e).__name__}: {reason}"}
+    return results
+
+
+def check(results: Dict[str, Dict], baseline: Dict[str, Dict]) -> List[str]:
+    """Descriptions of the cases that regressed against the baseline"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None or "skipped" in current or "skipped" in previous:
+            continue
+        time_threshold = CASES[name][1]
+        time_ratio = current["median_us"] / previous["median_us"]
+        if time_ratio > 1 + time_threshold:
+            regressions.append(
+                f"{name}: {previous['median_us']}us -> {current['median_us']}us "
+                f"(+{(time_ratio - 1) * 100:.0f}%, allowed {time_threshold * 100:.0f}%)"
+            )
+        if previous["peak_kib"] and current["peak_kib"] > previous["peak_kib"] * (1 + MEMORY_THRESHOLD):
+            regressions.append(
+                f"{name}: peak {previous['peak_kib']}KiB -> {current['peak_kib']}KiB"
+            )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("-k", dest="selected", help="only cases whose name contains this")
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--min-time", type=float, default=0.2, help="seconds per round")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--json", action="store_true", help="print results as JSON")
+    args = parser.parse_args()
+
+    results = run(args.selected, args.rounds, args.min_time)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'case':<42}{'median us':>12}{'min us':>12}{'peak KiB':>11}")
+        for name, result in results.items():
+            if "skipped" in result:
+                print(f"{name:<42}  skipped: {result['skipped']}")
+                continue
+            print(
+                f"{name:<42}{result['median_us']:>12}{result['min_us']:>12}"
+                f"{result['peak_kib']:>11}"
+            )
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        # Keep the previous numbers of cases that were skipped this time
+        baseline.update(
+            {name: result for name, result in results.items() if "skipped" not in result}
+        )
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2)
+            f.write("\n")
+        print(f"Baseline saved to {args.baseline}")
+
+    if args.check:
+        if not os.path.exists(args.baseline):
+            raise SystemExit(f"No baseline at {args.baseline}; run with --save-baseline first")
+        with open(args.baseline) as f:
+            regressions = check(results, json.load(f))
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Micro-benchmark of response serialization for the notes endpoints.
+
+Compares FastAPI's default path (response_model validation, then
+jsonable_encoder and json.dumps) with the one the routes use: cached
+TypeAdapters with one validation for single notes, and plain column rows
+for lists, both rendered with orjson.
+
+    python -m benchmarks.serialization [--items 100] [--history 20]
+"""
+import argparse
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Callable, List
+
+from fastapi.responses import JSONResponse, ORJSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from app.models.notes import Note, NoteHistory
+from app.schemas.notes import NoteResponse, NoteWithHistory
+from app.utils.serialization import json_response
+
+
+def _notes(count: int) -> List[Note]:
+    start = datetime(2024, 1, 1)
+    return [
+        Note(
+            id=i,
+            title=f"Note {i}",
+            content="Lorem ipsum dolor sit amet. " * 20,
+            created_at=start + timedelta(minutes=i),
+            updated_at=start + timedelta(minutes=i, seconds=30),
+        )
+        for i in range(count)
+    ]
+
+
+def _history_payload(count: int) -> dict:
+    note = _notes(1)[0]
+    history = [
+        NoteHistory(
+            note_id=note.id,
+            title=f"Version {i}",
+            content="Lorem ipsum dolor sit amet. " * 20,
+            created_at=datetime(2024, 1, 1) + timedelta(hours=i),
+        )
+        for i in range(count)
+    ]
+    return {
+        "id": note.id,
+        "title": note.title,
+        "content": note.content,
+        "created_at": note.created_at,
+        "updated_at": note.updated_at,
+        "history": history,
+    }
+
+
+def _complete(coro):
+    # serialize_response never suspends for async endpoints, so it can be
+    # driven without an event loop and its overhead stays out of the timing
+    try:
+        coro.send(None)
+    except StopIteration as done:
+        return done.value
+    raise RuntimeError("serialize_response suspended")
+
+
+def _default(response_model, content) -> Callable[[], bytes]:
+    field = create_response_field(name="response", type_=response_model)
+
+    def render() -> bytes:
+        body = _complete(serialize_response(field=field, response_content=content))
+        return JSONResponse(body).body
+
+    return render
+
+
+def _timed(render: Callable[[], bytes], rounds: int) -> float:
+    render()
+    start = time.perf_counter()
+    for _ in range(rounds):
+        render()
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def run(items: int = 100, history: int = 20, rounds: int = 300) -> List[dict]:
+    notes = _notes(items)
+    rows = [
+        {c: getattr(n, c) for c in ("id", "title", "content", "created_at", "updated_at")}
+        for n in notes
+    ]
+    payload = _history_payload(history)
+    cases = [
+        (
+            f"list ({items} notes)",
+            _default(List[NoteResponse], notes),
+            lambda: ORJSONResponse(rows).body,
+        ),
+        (
+            "get",
+            _default(NoteResponse, notes[0]),
+            lambda: json_response(NoteResponse, notes[0]).body,
+        ),
+        (
+            f"history ({history} versions)",
+            _default(NoteWithHistory, payload),
+            lambda: json_response(NoteWithHistory, payload).body,
+        ),
+    ]
+
+    results = []
+    for name, default, fast in cases:
+        # Both paths must produce the same document
+        assert json.loads(default()) == json.loads(fast()), name
+        before, after = _timed(default, rounds), _timed(fast, rounds)
+        results.append(
+            {
+                "payload": name,
+                "default_us": round(before, 1),
+                "fast_us": round(after, 1),
+                "speedup": round(before / after, 1),
+            }
+        )
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--items", type=int, default=100)
+    parser.add_argument("--history", type=int, default=20)
+    parser.add_argument("--rounds", type=int, default=300)
+    args = parser.parse_args()
+
+    print(f"{'payload':<24}{'default us':>12}{'fast us':>10}{'speedup':>9}")
+    for row in run(args.items, args.history, args.rounds):
+        print(
+            f"{row['payload']:<24}{row['default_us']:>12}"
+            f"{row['fast_us']:>10}{row['speedup']:>8}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
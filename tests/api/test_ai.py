@@ -1,10 +1,22 @@
+import asyncio
+import json
+import threading
+import time
+from datetime import datetime
+
 import pytest
+from httpx import AsyncClient
 from unittest.mock import patch, MagicMock, AsyncMock
 from fastapi import HTTPException, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi.testclient import TestClient
 
 from app.api.ai import router, summarize_note, get_available_models
+from app.database import get_async_db
+from app.main import app
+from app.services import ai as ai_service
+from app.services import summaries as summaries_service
+from tests.conftest import AsyncTestingSessionLocal
 from app.models.notes import Note
 from app.schemas.notes import NoteSummary
 
@@ -23,14 +35,14 @@ async def test_summarize_note_direct():
 
     # Mock service functions
     with patch("app.api.ai.notes_service.get_note_async", return_value=mock_note) as mock_get_note, \
-         patch("app.api.ai.ai_service.summarize_text_async", return_value="Brief note summary") as mock_summarize:
+         patch("app.api.ai.summaries_service.get_summary_async", return_value="Brief note summary") as mock_summarize:
 
         # Call the function directly
         result = await summarize_note(note_id=1, db=mock_db)
 
         # Verify function calls
         mock_get_note.assert_called_once_with(mock_db, 1)
-        mock_summarize.assert_called_once_with(mock_note.content, mock_note.title)
+        mock_summarize.assert_called_once_with(mock_db, mock_note)
 
         # Check result
         assert result["note_id"] == 1
@@ -73,7 +85,7 @@ async def test_summarize_note_ai_error_direct():
 
     # Mock service functions
     with patch("app.api.ai.notes_service.get_note_async", return_value=mock_note) as mock_get_note, \
-         patch("app.api.ai.ai_service.summarize_text_async",
+         patch("app.api.ai.summaries_service.get_summary_async",
                side_effect=Exception("AI service error")) as mock_summarize:
 
         # Call the function and expect exception
@@ -85,7 +97,7 @@ async def test_summarize_note_ai_error_direct():
 
         # Verify function calls
         mock_get_note.assert_called_once_with(mock_db, 1)
-        mock_summarize.assert_called_once_with(mock_note.content, mock_note.title)
+        mock_summarize.assert_called_once_with(mock_db, mock_note)
 
 
 @pytest.mark.asyncio
@@ -123,6 +135,28 @@ async def test_get_available_models_empty_direct():
         assert result["models"] == []
 
 
+@pytest.mark.asyncio
+async def test_get_available_models_runs_off_the_event_loop():
+    """A slow model discovery does not block the event loop"""
+    loop_thread = threading.get_ident()
+    called_from = []
+
+    def slow_list_models():
+        called_from.append(threading.get_ident())
+        time.sleep(0.1)
+        return ["gemini-pro"]
+
+    with patch("app.api.ai.ai_service.list_available_models", side_effect=slow_list_models):
+        models = asyncio.create_task(get_available_models())
+        started = time.perf_counter()
+        await asyncio.sleep(0.01)
+        assert time.perf_counter() - started < 0.05
+        result = await models
+
+    assert result["models"] == ["gemini-pro"]
+    assert called_from != [loop_thread]
+
+
 # Fixed HTTP client tests
 def test_summarize_note_http(client):
     """Test the summarize_note endpoint via HTTP"""
@@ -134,7 +168,7 @@ def test_summarize_note_http(client):
 
     # Mock service functions
     with patch("app.api.ai.notes_service.get_note_async", return_value=mock_note), \
-         patch("app.api.ai.ai_service.summarize_text_async", return_value="Brief note summary"), \
+         patch("app.api.ai.summaries_service.get_summary_async", return_value="Brief note summary"), \
          patch("app.api.ai.get_async_db"):  # Mock the dependency
 
         # Make HTTP request
@@ -162,3 +196,170 @@ def test_get_available_models_http(client):
         assert response.status_code == 200
         data = response.json()
         assert data["models"] == mock_models
+
+
+@pytest.mark.asyncio
+async def test_crud_latency_unaffected_by_slow_summaries(async_db):
+    """Summaries in flight do not block other requests on the event loop"""
+    # Distinct notes, since identical requests would share one model call
+    notes = [
+        Note(title="Test Title", content=f"Test content for summarization {i}")
+        for i in range(4)
+    ]
+    async_db.add_all(notes)
+    await async_db.flush()
+    note_ids = [note.id for note in notes]
+    await async_db.commit()
+
+    async def slow_generate(prompt):
+        await asyncio.sleep(1.0)
+        response = MagicMock()
+        response.text = "Brief note summary"
+        return response
+
+    slow_model = MagicMock()
+    slow_model.generate_content_async = AsyncMock(side_effect=slow_generate)
+
+    # Concurrent requests need their own sessions
+    async def override_get_async_db():
+        async with AsyncTestingSessionLocal() as session:
+            yield session
+
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    try:
+        with patch("app.services.ai.GEMINI_API_KEY", "fake-key"), \
+             patch("app.services.ai.GEMINI_MODEL", "gemini-pro"), \
+             patch("app.services.ai.genai.GenerativeModel", return_value=slow_model), \
+             patch("app.services.ai.limiter", ai_service.ConcurrencyLimiter(8, 8)) as limiter:
+            async with AsyncClient(app=app, base_url="http://test") as ac:
+                summaries = [
+                    asyncio.create_task(ac.get(f"/ai/notes/{note_id}/summary"))
+                    for note_id in note_ids
+                ]
+                # Wait until every summary is holding a slot on the fake model
+                deadline = time.perf_counter() + 1.0
+                while limiter.stats()["in_flight"] < 4 and time.perf_counter() < deadline:
+                    await asyncio.sleep(0.01)
+                assert limiter.stats()["in_flight"] == 4
+
+                start = time.perf_counter()
+                crud_response = await ac.get(f"/notes/{note_ids[0]}")
+                crud_latency = time.perf_counter() - start
+
+                summary_responses = await asyncio.gather(*summaries)
+    finally:
+        app.dependency_overrides = {}
+        summaries_service.lru.clear()
+
+    assert crud_response.status_code == 200
+    assert crud_latency < 0.2
+    assert all(r.status_code == 200 for r in summary_responses)
+    assert limiter.stats()["completed"] == 4
+    assert limiter.stats()["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_summarize_notes_streams_ndjson():
+    """The batch endpoint streams one JSON line per note"""
+    mock_db = AsyncMock(spec=AsyncSession)
+    notes = [MagicMock(spec=Note, id=1), MagicMock(spec=Note, id=2)]
+
+    stream_db = AsyncMock(spec=AsyncSession)
+    stream_db.__aenter__.return_value = stream_db
+    seen = {}
+
+    async def fake_stream(db, note_ids, loaded, concurrency):
+        seen["db"], seen["client"] = db, ai_service.current_client.get()
+        yield {"note_id": 2, "summary": "second"}
+        yield {"note_id": 1, "error": "AI summarization failed", "status_code": 500}
+
+    async def override_get_async_db():
+        yield mock_db
+
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    try:
+        with patch("app.api.ai.notes_service.get_notes_by_ids_async", return_value=notes) as mock_load, \
+             patch("app.api.ai.AsyncSessionLocal", return_value=stream_db), \
+             patch("app.api.ai.summaries_service.summarize_notes_async", side_effect=fake_stream):
+            async with AsyncClient(app=app, base_url="http://test") as ac:
+                response = await ac.post("/ai/summaries", json={"note_ids": [1, 2]})
+    finally:
+        app.dependency_overrides = {}
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines == [
+        {"note_id": 2, "summary": "second"},
+        {"note_id": 1, "error": "AI summarization failed", "status_code": 500},
+    ]
+    mock_load.assert_called_once_with(mock_db, [1, 2])
+    # Results are stored through a session that outlives the request's,
+    # and model calls are made on behalf of the caller
+    assert seen["db"] is stream_db
+    stream_db.__aexit__.assert_awaited_once()
+    assert seen["client"] == "127.0.0.1"
+
+
+def test_summarize_notes_rejects_empty_batch(client):
+    response = client.post("/ai/summaries", json={"note_ids": []})
+    assert response.status_code == 422
+
+
+def _parse_sse(text):
+    events = []
+    for block in text.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_stream_note_summary_sse(client):
+    """The stream endpoint forwards chunks as Server-Sent Events"""
+    mock_note = MagicMock(spec=Note)
+    mock_note.id = 1
+
+    stream_db = AsyncMock(spec=AsyncSession)
+    stream_db.__aenter__.return_value = stream_db
+    sessions = []
+
+    async def fake_stream(db, note):
+        sessions.append(db)
+        yield "Brief "
+        yield "summary"
+
+    with patch("app.api.ai.notes_service.get_note_async", return_value=mock_note), \
+         patch("app.api.ai.AsyncSessionLocal", return_value=stream_db), \
+         patch("app.api.ai.summaries_service.stream_summary_async", side_effect=fake_stream):
+        response = client.get("/ai/notes/1/summary/stream")
+
+    # The summary is stored through a session opened for the stream
+    assert sessions == [stream_db]
+    stream_db.__aexit__.assert_awaited_once()
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert _parse_sse(response.text) == [
+        ("chunk", {"text": "Brief "}),
+        ("chunk", {"text": "summary"}),
+        ("done", {"note_id": 1}),
+    ]
+
+
+def test_stream_note_summary_sse_error(client):
+    """Failures after the stream started are sent as an error event"""
+    mock_note = MagicMock(spec=Note)
+    mock_note.id = 1
+
+    async def failing_stream(db, note):
+        yield "Partial"
+        raise HTTPException(status_code=504, detail="AI summarization timed out")
+
+    with patch("app.api.ai.notes_service.get_note_async", return_value=mock_note), \
+         patch("app.api.ai.summaries_service.stream_summary_async", side_effect=failing_stream):
+        response = client.get("/ai/notes/1/summary/stream")
+
+    assert _parse_sse(response.text) == [
+        ("chunk", {"text": "Partial"}),
+        ("error", {"detail": "AI summarization timed out", "status_code": 504}),
+    ]
@@ -1 +1,43 @@
-# No test
+import pytest
+from httpx import AsyncClient
+
+from app.database import get_async_db
+from app.main import app
+from app.services import duplicates
+from tests.conftest import AsyncTestingSessionLocal
+
+TEXT = "The quarterly budget review covers travel, hardware and training costs for the team"
+
+
+@pytest.fixture
+def client_app(async_db, monkeypatch):
+    async def override_get_async_db():
+        async with AsyncTestingSessionLocal() as session:
+            yield session
+
+    monkeypatch.setattr(duplicates, "index", duplicates.LshIndex())
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    yield app
+    app.dependency_overrides = {}
+
+
+@pytest.mark.asyncio
+async def test_duplicates_report(client_app):
+    contents = [TEXT, TEXT + " this year", "Hiking trail map for the weekend", TEXT]
+    async with AsyncClient(app=client_app, base_url="http://test") as ac:
+        ids = [
+            (await ac.post("/notes/", json={"title": f"T{i}", "content": content})).json()["id"]
+            for i, content in enumerate(contents)
+        ]
+        strict = await ac.get("/analytics/duplicates", params={"threshold": 1.0})
+        loose = await ac.get("/analytics/duplicates", params={"threshold": 0.6})
+        invalid = await ac.get("/analytics/duplicates", params={"threshold": 2})
+
+    assert strict.status_code == 200
+    assert strict.json() == {
+        "total_notes": 4,
+        "duplicate_notes": 2,
+        "groups": [[ids[0], ids[3]]],
+    }
+    assert loose.json()["groups"] == [[ids[0], ids[1], ids[3]]]
+    assert invalid.status_code == 422
@@ -0,0 +1,116 @@
+import hashlib
+
+import pytest
+from httpx import AsyncClient
+
+from app.database import get_async_db
+from app.main import app
+from app.services import attachments
+from tests.conftest import AsyncTestingSessionLocal
+
+CONTENT = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def client_app(async_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(attachments, "ATTACHMENT_DIR", str(tmp_path))
+
+    async def override_get_async_db():
+        async with AsyncTestingSessionLocal() as session:
+            yield session
+
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    yield app
+    app.dependency_overrides = {}
+
+
+async def _upload(ac, note_id, content=CONTENT, filename="data.bin"):
+    return await ac.post(
+        f"/notes/{note_id}/attachments",
+        params={"filename": filename},
+        content=content,
+        headers={"Content-Type": "application/octet-stream"},
+    )
+
+
+@pytest.mark.asyncio
+async def test_upload_list_download_and_delete(async_db, client_app):
+    async with AsyncClient(app=client_app, base_url="http://test") as ac:
+        note = (await ac.post("/notes/", json={"title": "A", "content": "A"})).json()
+        created = await _upload(ac, note["id"])
+        again = await _upload(ac, note["id"], filename="copy.bin")
+        listed = await ac.get(f"/notes/{note['id']}/attachments")
+        url = f"/notes/{note['id']}/attachments/{created.json()['id']}"
+        whole = await ac.get(url)
+        part = await ac.get(url, headers={"Range": "bytes=100-199"})
+        tail = await ac.get(url, headers={"Range": "bytes=-10"})
+        outside = await ac.get(url, headers={"Range": f"bytes={len(CONTENT)}-"})
+        cached = await ac.get(url, headers={"If-None-Match": whole.headers["etag"]})
+        deleted = await ac.delete(url)
+        gone = await ac.get(url)
+        # The note itself does not carry its attachments
+        fetched = await ac.get(f"/notes/{note['id']}")
+
+    sha256 = hashlib.sha256(CONTENT).hexdigest()
+    assert created.status_code == 201
+    assert created.json()["sha256"] == sha256
+    assert created.json()["size"] == len(CONTENT)
+    assert again.json()["sha256"] == sha256
+    assert [a["filename"] for a in listed.json()] == ["data.bin", "copy.bin"]
+
+    assert whole.status_code == 200
+    assert whole.content == CONTENT
+    assert whole.headers["content-type"] == "application/octet-stream"
+    assert whole.headers["etag"] == f'"{sha256}"'
+    assert part.status_code == 206
+    assert part.content == CONTENT[100:200]
+    assert part.headers["content-range"] == f"bytes 100-199/{len(CONTENT)}"
+    assert tail.content == CONTENT[-10:]
+    assert outside.status_code == 416
+    assert cached.status_code == 304
+
+    assert deleted.status_code == 204
+    assert gone.status_code == 404
+    assert "attachments" not in fetched.json()
+
+
+@pytest.mark.asyncio
+async def test_uploaded_html_is_downloaded_not_rendered(async_db, client_app):
+    async with AsyncClient(app=client_app, base_url="http://test") as ac:
+        note = (await ac.post("/notes/", json={"title": "A", "content": "A"})).json()
+        created = await ac.post(
+            f"/notes/{note['id']}/attachments",
+            params={"filename": "page.html"},
+            content=b"<script>alert(document.cookie)</script>",
+            headers={"Content-Type": "text/html"},
+        )
+        page = await ac.get(f"/notes/{note['id']}/attachments/{created.json()['id']}")
+
+    assert page.headers["content-disposition"] == 'attachment; filename="page.html"'
+    assert page.headers["x-content-type-options"] == "nosniff"
+    assert page.headers["content-security-policy"] == "sandbox"
+
+
+@pytest.mark.asyncio
+async def test_upload_errors(async_db, client_app, monkeypatch):
+    monkeypatch.setattr(attachments, "ATTACHMENT_MAX_BYTES", 100)
+    async with AsyncClient(app=client_app, base_url="http://test") as ac:
+        missing = await _upload(ac, 999, b"x")
+        note = (await ac.post("/notes/", json={"title": "A", "content": "A"})).json()
+        too_large = await _upload(ac, note["id"], b"x" * 101)
+        no_name = await ac.post(f"/notes/{note['id']}/attachments", content=b"x")
+
+    assert missing.status_code == 404
+    assert too_large.status_code == 413
+    assert no_name.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_deleting_a_note_removes_its_attachments(async_db, client_app):
+    async with AsyncClient(app=client_app, base_url="http://test") as ac:
+        note = (await ac.post("/notes/", json={"title": "A", "content": "A"})).json()
+        await _upload(ac, note["id"])
+        await ac.delete(f"/notes/{note['id']}")
+        listed = await ac.get(f"/notes/{note['id']}/attachments")
+
+    assert listed.status_code == 404
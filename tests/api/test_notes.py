@@ -1 +1,195 @@
-# No test
+from datetime import datetime
+
+import pytest
+from httpx import AsyncClient
+
+from app.database import get_async_db
+from app.main import app
+from app.models.notes import Note, NoteHistory
+from app.schemas.notes import NoteResponse, NoteWithHistory
+from app.services import duplicates, similarity
+from tests.conftest import AsyncTestingSessionLocal, assert_max_queries
+
+
+@pytest.fixture
+def client_app(async_db):
+    async def override_get_async_db():
+        async with AsyncTestingSessionLocal() as session:
+            yield session
+
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    yield app
+    app.dependency_overrides = {}
+
+
+async def _add_notes(db, count):
+    notes = [Note(title=f"Note {i}", content=f"Content {i}") for i in range(count)]
+    db.add_all(notes)
+    await db.commit()
+    for note in notes:
+        await db.refresh(note)
+    return notes
+
+
+@pytest.mark.asyncio
+async def test_list_notes_matches_schema(async_db, client_app):
+    notes = await _add_notes(async_db, 3)
+    async with AsyncClient(app=client_app, base_url="http://test") as ac:
+        response = await ac.get("/notes/", params={"limit": 2})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/json"
+    body = response.json()
+    assert [item["id"] for item in body] == [notes[0].id, notes[1].id]
+    # Same payload the response_model would have produced
+    expected = [NoteResponse.model_validate(note).model_dump(mode="json") for note in notes[:2]]
+    assert body == expected
+
+
+@pytest.mark.asyncio
+async def test_create_get_and_update_note(async_db, client_app):
+    async with AsyncClient(app=client_app, base_url="http://test") as ac:
+        created = await ac.post("/notes/", json={"title": "Title", "content": "Body"})
+        note_id = created.json()["id"]
+        fetched = await ac.get(f"/notes/{note_id}")
+        updated = await ac.put(f"/notes/{note_id}", json={"content": "New body"})
+        missing = await ac.get("/notes/999999")
+
+    assert created.status_code == 201
+    assert fetched.status_code == 200
+    assert fetched.json() == created.json()
+    assert set(fetched.json()) == set(NoteResponse.model_fields)
+    assert updated.json()["content"] == "New body"
+    assert missing.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_note_history(async_db, client_app):
+    note = (await _add_notes(async_db, 1))[0]
+    async_db.add(NoteHistory(note_id=note.id, title="Old", content="Old content"))
+    await async_db.commit()
+
+    async with AsyncClient(app=client_app, base_url="http://test") as ac:
+        response = await ac.get(f"/notes/{note.id}/history")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert NoteWithHistory.model_validate(body).id == note.id
+    assert [h["title"] for h in body["history"]] == ["Old"]
+
+
+@pytest.mark.asyncio
+async def test_endpoint_query_budgets(async_db, client_app):
+    note = (await _add_notes(async_db, 3))[0]
+    async with AsyncClient(app=client_app, base_url="http://test") as ac:
+        with assert_max_queries(1):
+            await ac.get(f"/notes/{note.id}")
+        with assert_max_queries(1):
+            await ac.get("/notes/")
+        # The note and its history, without loading the note twice
+        with assert_max_queries(2):
+            await ac.get(f"/notes/{note.id}/history")
+        # The note, its signature and its entry in the change log other
+        # workers follow, then the refresh
+        with assert_max_queries(4):
+            await ac.post("/notes/", json={"title": "New", "content": "Body"})
+
+
+async def _add_dated_notes(db):
+    # Titles and timestamps in different orders; two notes edited at once
+    rows = [
+        ("b", datetime(2024, 1, 1), datetime(2024, 3, 1)),
+        ("c", datetime(2024, 1, 2), datetime(2024, 2, 1)),
+        ("a", datetime(2024, 1, 3), datetime(2024, 3, 1)),
+        ("d", datetime(2024, 1, 4), datetime(2024, 1, 5)),
+    ]
+    notes = [
+        Note(title=title, content=title, created_at=created, updated_at=updated)
+        for title, created, updated in rows
+    ]
+    db.add_all(notes)
+    await db.commit()
+
+
+async def _pages(ac, params):
+    pages, cursor = [], None
+    while True:
+        page_params = {**params, "cursor": cursor} if cursor else params
+        response = await ac.get("/notes/", params=page_params)
+        assert response.status_code == 200
+        pages.append([note["title"] for note in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return pages
+
+
+@pytest.mark.asyncio
+async def test_sorted_listings_and_time_filters(async_db, client_app):
+    await _add_dated_notes(async_db)
+    async with AsyncClient(app=client_app, base_url="http://test") as ac:
+        recent = await _pages(ac, {"sort": "updated_at", "order": "desc", "limit": 1})
+        by_title = await _pages(ac, {"sort": "title", "limit": 3})
+        created = await _pages(ac, {"sort": "created_at", "order": "desc", "limit": 2})
+        since = await ac.get(
+            "/notes/", params={"sort": "updated_at", "updated_since": "2024-02-01T00:00:00"}
+        )
+        before = await ac.get("/notes/", params={"created_before": "2024-01-03", "content": False})
+        # A cursor only continues the sort it came from
+        by_id = await ac.get("/notes/", params={"limit": 1})
+        mismatched = await ac.get(
+            "/notes/", params={"sort": "title", "cursor": by_id.headers["X-Next-Cursor"]}
+        )
+
+    assert recent == [["a"], ["b"], ["c"], ["d"]]
+    assert by_title == [["a", "b", "c"], ["d"]]
+    assert created == [["d", "a"], ["c", "b"]]
+    assert [note["title"] for note in since.json()] == ["c", "b", "a"]
+    assert [note["title"] for note in before.json()] == ["b", "c"]
+    assert "content" not in before.json()[0]
+    assert mismatched.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_related_notes(async_db, client_app, monkeypatch):
+    monkeypatch.setattr(similarity, "index", similarity.TfidfIndex())
+    contents = [
+        "Python asyncio event loop and coroutine scheduling",
+        "Scheduling coroutines on the asyncio event loop in Python",
+        "Baking sourdough bread with a long cold fermentation",
+        "Quarterly budget review meeting notes",
+        "Hiking trail map for the weekend",
+    ]
+    async with AsyncClient(app=client_app, base_url="http://test") as ac:
+        ids = [
+            (await ac.post("/notes/", json={"title": f"T{i}", "content": content})).json()["id"]
+            for i, content in enumerate(contents)
+        ]
+        related = await ac.get(f"/notes/{ids[0]}/related", params={"k": 1})
+        invalid = await ac.get(f"/notes/{ids[0]}/related", params={"k": 0})
+        missing = await ac.get("/notes/999999/related")
+
+    assert related.status_code == 200
+    body = related.json()
+    assert [(item["note_id"], item["title"]) for item in body] == [(ids[1], "T1")]
+    assert 0 < body[0]["score"] <= 1
+    assert invalid.status_code == 422
+    assert missing.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_duplicate_notes(async_db, client_app, monkeypatch):
+    monkeypatch.setattr(duplicates, "index", duplicates.LshIndex())
+    text = "The quarterly budget review covers travel, hardware and training costs"
+    async with AsyncClient(app=client_app, base_url="http://test") as ac:
+        ids = [
+            (await ac.post("/notes/", json={"title": f"T{i}", "content": content})).json()["id"]
+            for i, content in enumerate([text, text, "Hiking trail map for the weekend"])
+        ]
+        found = await ac.get(f"/notes/{ids[0]}/duplicates")
+        unique = await ac.get(f"/notes/{ids[2]}/duplicates")
+        missing = await ac.get("/notes/999999/duplicates")
+
+    assert found.status_code == 200
+    assert found.json() == [{"note_id": ids[1], "title": "T1", "similarity": 1.0}]
+    assert unique.json() == []
+    assert missing.status_code == 404
@@ -0,0 +1,90 @@
+import pytest
+from httpx import AsyncClient
+
+from app.database import get_async_db
+from app.main import app
+from tests.conftest import AsyncTestingSessionLocal, assert_max_queries
+
+
+@pytest.fixture
+def client_app(async_db):
+    async def override_get_async_db():
+        async with AsyncTestingSessionLocal() as session:
+            yield session
+
+    app.dependency_overrides[get_async_db] = override_get_async_db
+    yield app
+    app.dependency_overrides = {}
+
+
+async def _create(ac, title, tags):
+    response = await ac.post("/notes/", json={"title": title, "content": title, "tags": tags})
+    assert response.status_code == 201
+    return response.json()
+
+
+def _titles(response):
+    return [note["title"] for note in response.json()]
+
+
+@pytest.mark.asyncio
+async def test_filter_notes_by_tags(async_db, client_app):
+    async with AsyncClient(app=client_app, base_url="http://test") as ac:
+        await _create(ac, "a", ["work", "urgent"])
+        await _create(ac, "b", ["work"])
+        await _create(ac, "c", ["home", "Urgent"])
+        await _create(ac, "d", [])
+
+        both = await ac.get("/notes/", params={"tag": ["work", "urgent"]})
+        either = await ac.get("/notes/", params={"tag": ["work", "home"], "match": "any"})
+        unknown = await ac.get("/notes/", params={"tag": ["work", "nope"]})
+        with assert_max_queries(2):
+            one = await ac.get("/notes/", params={"tag": "urgent"})
+
+    assert _titles(both) == ["a"]
+    assert both.json()[0]["tags"] == ["urgent", "work"]
+    assert _titles(either) == ["a", "b", "c"]
+    assert unknown.json() == []
+    assert _titles(one) == ["a", "c"]
+
+
+@pytest.mark.asyncio
+async def test_cursor_pagination(async_db, client_app):
+    async with AsyncClient(app=client_app, base_url="http://test") as ac:
+        for i in range(5):
+            await _create(ac, f"n{i}", ["x"] if i % 2 == 0 else ["y"])
+
+        pages, cursor = [], None
+        while True:
+            params = {"tag": ["x", "y"], "match": "any", "limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            response = await ac.get("/notes/", params=params)
+            pages.append(_titles(response))
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                break
+
+        untagged = await ac.get("/notes/", params={"limit": 3})
+        rest = await ac.get("/notes/", params={"cursor": untagged.headers["X-Next-Cursor"]})
+        invalid = await ac.get("/notes/", params={"cursor": "not-a-cursor"})
+
+    assert pages == [["n0", "n1"], ["n2", "n3"], ["n4"]]
+    assert _titles(rest) == ["n3", "n4"]
+    assert invalid.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_tag_counts(async_db, client_app):
+    async with AsyncClient(app=client_app, base_url="http://test") as ac:
+        first = await _create(ac, "a", ["work", "urgent"])
+        second = await _create(ac, "b", ["work"])
+        await ac.put(f"/notes/{first['id']}", json={"tags": ["home"]})
+        await ac.delete(f"/notes/{second['id']}")
+        counts = await ac.get("/tags")
+        fetched = await ac.get(f"/notes/{first['id']}")
+        invalid = await ac.post("/notes/", json={"title": "t", "content": "c", "tags": ["a,b"]})
+
+    assert counts.json() == [{"name": "home", "count": 1}]
+    assert fetched.json()["tags"] == ["home"]
+    assert invalid.status_code == 422
@@ -1,8 +1,10 @@
 import pytest
+import pytest_asyncio
 import os
 import sys
+from contextlib import contextmanager
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from fastapi.testclient import TestClient
@@ -11,6 +13,7 @@ from httpx import AsyncClient
 # Import the main application
 from app.main import app as test_app
 from app.database import Base, get_db, get_async_db
+from app.utils.query_stats import track_queries
 
 # Load environment variables from .env file
 load_dotenv()
@@ -41,7 +44,11 @@ TestingSessionLocal = sessionmaker(
     autocommit=False, autoflush=False, bind=engine
 )
 AsyncTestingSessionLocal = sessionmaker(
-    class_=AsyncSession, autocommit=False, autoflush=False, bind=async_engine
+    class_=AsyncSession,
+    autocommit=False,
+    autoflush=False,
+    expire_on_commit=False,
+    bind=async_engine,
 )
 
 
@@ -64,7 +71,7 @@ def db():
     Base.metadata.drop_all(bind=engine)
 
 
-@pytest.fixture(scope="function")
+@pytest_asyncio.fixture(scope="function")
 async def async_db():
     """
     Create a fresh async database for each test.
@@ -108,7 +115,7 @@ def client(db):
     test_app.dependency_overrides = {}
 
 
-@pytest.fixture(scope="function")
+@pytest_asyncio.fixture(scope="function")
 async def async_client(async_db):
     """
     Create a test client for asynchronous endpoints.
@@ -151,3 +158,38 @@ def test_note_update_data():
         "title": "Updated Test Note",
         "content": "This is updated test note content."
     }
+
+
+@pytest.fixture(autouse=True)
+def reset_ai_resilience():
+    """Keep circuit breaker and latency state from leaking between tests"""
+    from app.services import ai as ai_service
+
+    def reset():
+        ai_service.breaker.reset()
+        ai_service.latencies.clear()
+        for name in ai_service.attempt_stats:
+            ai_service.attempt_stats[name] = 0
+
+    reset()
+    yield
+    reset()
+
+
+@contextmanager
+def assert_max_queries(limit):
+    """Fail if the code in the block runs more than `limit` SQL statements"""
+    with track_queries() as stats:
+        yield stats
+    assert stats.queries <= limit, (
+        f"{stats.queries} queries run, at most {limit} expected:\n"
+        + "\n".join(stats.statements)
+    )
+
+
+def query_plan(query) -> str:
+    """SQLite's EXPLAIN QUERY PLAN for a query on the test database, one step per line"""
+    compiled = query.compile(engine, compile_kwargs={"literal_binds": True})
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+    return "\n".join(row[-1] for row in rows)
@@ -0,0 +1,226 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient
+
+from app.middleware.admission import (
+    HIGH,
+    LOW,
+    AdmissionController,
+    AdmissionMiddleware,
+    Rejected,
+    RouteClass,
+    default_classes,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _app(controller):
+    """App whose routes block until `release` is set"""
+    app = FastAPI()
+    app.state.release = asyncio.Event()
+    app.add_middleware(AdmissionMiddleware, controller=controller)
+
+    @app.get("/notes/{name}")
+    async def crud(name: str):
+        if name == "slow":
+            await app.state.release.wait()
+        return {"ok": True}
+
+    @app.post("/notes/{name}/attachments")
+    async def upload(name: str):
+        if name == "slow":
+            await app.state.release.wait()
+        return {"ok": True}
+
+    @app.get("/ai/{name}")
+    async def ai(name: str):
+        if name == "slow":
+            await app.state.release.wait()
+        return {"ok": True}
+
+    @app.get("/health")
+    async def health():
+        return {"ok": True}
+
+    return app
+
+
+def _controller(**kwargs):
+    classes = [
+        RouteClass("crud", "/notes", limit=4, queue=1, priority=HIGH),
+        RouteClass("ai", "/ai", limit=1, queue=1, priority=LOW),
+    ]
+    options = {"max_in_flight": 10, "queue_timeout": 1.0, "client_rate": 0}
+    options.update(kwargs)
+    return AdmissionController(classes, **options)
+
+
+async def _wait_for(condition):
+    for _ in range(200):
+        if condition():
+            return
+        await asyncio.sleep(0.005)
+    raise AssertionError("condition not reached")
+
+
+@pytest.mark.asyncio
+async def test_full_class_queue_is_rejected_while_crud_is_served():
+    controller = _controller()
+    app = _app(controller)
+    ai_class = controller.classify("/ai/slow")
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        running = asyncio.create_task(ac.get("/ai/slow"))
+        queued = asyncio.create_task(ac.get("/ai/slow"))
+        await _wait_for(lambda: ai_class.in_flight == 1 and ai_class.waiting == 1)
+
+        rejected = await ac.get("/ai/slow")
+        crud = await ac.get("/notes/fast")
+
+        app.state.release.set()
+        responses = await asyncio.gather(running, queued)
+
+    assert rejected.status_code == 503
+    assert rejected.headers["Retry-After"] == "1"
+    assert crud.status_code == 200
+    assert [r.status_code for r in responses] == [200, 200]
+    stats = controller.stats()["ai"]
+    assert stats["queue_full"] == 1
+    assert stats["queued"] == 1
+    assert stats["admitted"] == 2
+    assert stats["in_flight"] == 0
+
+
+@pytest.mark.asyncio
+async def test_queued_request_times_out():
+    controller = _controller(queue_timeout=0.05)
+    app = _app(controller)
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        running = asyncio.create_task(ac.get("/ai/slow"))
+        await _wait_for(lambda: controller.in_flight == 1)
+        timed_out = await ac.get("/ai/slow")
+        app.state.release.set()
+        await running
+
+    assert timed_out.status_code == 503
+    assert controller.stats()["ai"]["queue_timeout"] == 1
+
+
+@pytest.mark.asyncio
+async def test_low_priority_is_shed_before_crud():
+    # Low-priority requests may only run while fewer than 2 are in flight
+    controller = _controller(max_in_flight=4, low_priority_share=0.5)
+    app = _app(controller)
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        slow = [asyncio.create_task(ac.get("/notes/slow")) for _ in range(2)]
+        await _wait_for(lambda: controller.in_flight == 2)
+
+        shed = await ac.get("/ai/fast")
+        crud = await ac.get("/notes/fast")
+
+        app.state.release.set()
+        await asyncio.gather(*slow)
+
+    assert shed.status_code == 503
+    assert crud.status_code == 200
+    assert controller.stats()["ai"]["shed"] == 1
+
+
+@pytest.mark.asyncio
+async def test_clients_are_rate_limited():
+    clock = FakeClock()
+    controller = _controller(client_rate=1.0, client_burst=2, clock=clock)
+    app = _app(controller)
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        allowed = [await ac.get("/notes/fast") for _ in range(2)]
+        limited = await ac.get("/notes/fast")
+        clock.now += 1.0
+        refilled = await ac.get("/notes/fast")
+        health = [await ac.get("/health") for _ in range(5)]
+
+    assert [r.status_code for r in allowed] == [200, 200]
+    assert limited.status_code == 429
+    assert limited.headers["Retry-After"] == "1"
+    assert refilled.status_code == 200
+    # Unclassified routes are not subject to admission control
+    assert all(r.status_code == 200 for r in health)
+    assert controller.stats()["crud"]["rate_limited"] == 1
+
+
+def test_default_classes_cover_every_router():
+    controller = AdmissionController()
+    assert controller.classify("/notes/1").name == "crud"
+    assert controller.classify("/notes/1/attachments", "POST").name == "upload"
+    assert controller.classify("/notes/1/attachments", "GET").name == "crud"
+    assert controller.classify("/notes/1/attachments/2", "GET").name == "crud"
+    assert controller.classify("/tags").name == "crud"
+    assert controller.classify("/tags/work").name == "crud"
+    assert controller.classify("/analytics/notes").name == "analytics"
+    assert controller.classify("/ai/summarize").name == "ai"
+    assert controller.classify("/tagsearch") is None
+    assert controller.classify("/health") is None
+
+
+@pytest.mark.asyncio
+async def test_slow_uploads_do_not_hold_crud_slots():
+    # With one slot and no queue, CRUD is only served while uploads are
+    # counted elsewhere
+    upload_class = RouteClass(
+        "upload",
+        "/notes",
+        limit=1,
+        queue=0,
+        priority=LOW,
+        methods=("POST",),
+        pattern=r"/notes/[^/]+/attachments",
+    )
+    crud_class = RouteClass("crud", "/notes", limit=1, queue=0, priority=HIGH)
+    controller = AdmissionController(
+        [upload_class, crud_class], max_in_flight=10, client_rate=0
+    )
+    app = _app(controller)
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        running = asyncio.create_task(ac.post("/notes/slow/attachments"))
+        await _wait_for(lambda: upload_class.in_flight == 1)
+
+        crud = [await ac.get("/notes/fast") for _ in range(4)]
+        second_upload = await ac.post("/notes/slow/attachments")
+
+        app.state.release.set()
+        await running
+
+    assert [r.status_code for r in crud] == [200] * 4
+    assert second_upload.status_code == 503
+    assert controller.stats()["upload"]["queue_full"] == 1
+    assert controller.stats()["crud"]["admitted"] == 4
+
+
+@pytest.mark.asyncio
+async def test_default_limits_shed_low_priority_while_crud_is_admitted():
+    controller = AdmissionController(default_classes(), client_rate=0)
+    crud = controller.classify("/notes/1")
+    ai = controller.classify("/ai/summarize")
+    analytics = controller.classify("/analytics/notes")
+    for _ in range(ai.limit):
+        await controller.acquire(ai, None)
+    while controller.in_flight < controller.low_priority_limit:
+        await controller.acquire(crud, None)
+    assert crud.in_flight < crud.limit
+
+    for low in (ai, analytics):
+        with pytest.raises(Rejected) as rejected:
+            await controller.acquire(low, None)
+        assert rejected.value.status_code == 503
+    await controller.acquire(crud, None)
+
+    assert controller.stats()["ai"]["shed"] == 1
+    assert controller.stats()["analytics"]["shed"] == 1
+    assert controller.stats()["crud"]["admitted"] == crud.in_flight
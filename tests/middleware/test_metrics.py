@@ -0,0 +1,43 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.middleware.metrics import MetricsMiddleware, http_requests
+
+
+def _count(method, route, status):
+    return http_requests.labels(method, route, status).value
+
+
+def test_requests_are_labelled_by_route_template():
+    test_app = FastAPI()
+    test_app.add_middleware(MetricsMiddleware)
+
+    @test_app.get("/widgets/{widget_id}")
+    async def widget(widget_id: int):
+        return {"id": widget_id}
+
+    client = TestClient(test_app)
+    before = _count("GET", "/widgets/{widget_id}", "200")
+    unmatched = _count("GET", "unmatched", "404")
+    client.get("/widgets/1")
+    client.get("/widgets/2")
+    client.get("/nowhere/3")
+
+    assert _count("GET", "/widgets/{widget_id}", "200") == before + 2
+    assert _count("GET", "unmatched", "404") == unmatched + 1
+
+
+def test_metrics_endpoint_exposes_http_db_and_service_metrics():
+    client = TestClient(app)
+    client.post("/notes/", json={"title": "Metrics", "content": "Counted"})
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    assert 'http_requests_total{method="POST",route="/notes/",status="201"}' in body
+    assert 'db_statements_total{engine="async",operation="INSERT"}' in body
+    assert "# TYPE gemini_requests_total counter" in body
+    assert "summary_cache_entries" in body
+    assert 'admission_in_flight{route_class="crud"}' in body
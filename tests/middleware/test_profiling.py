@@ -0,0 +1,77 @@
+import json
+import pstats
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import profiling as profiling_api
+from app.middleware.profiling import ProfilingMiddleware
+from app.utils import profiling
+
+TOKEN = "secret"
+
+
+@pytest.fixture
+def profiled_app(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILING", True)
+    monkeypatch.setattr(profiling, "PROFILING_TOKEN", TOKEN)
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path))
+    profiling_api.session.update(sampler=None, file=None)
+
+    app = FastAPI()
+    app.add_middleware(ProfilingMiddleware)
+    app.include_router(profiling_api.router)
+
+    @app.get("/work")
+    async def work():
+        return {"total": sum(range(10000))}
+
+    return TestClient(app)
+
+
+def test_requests_without_header_or_token_are_not_profiled(profiled_app, tmp_path):
+    plain = profiled_app.get("/work")
+    wrong = profiled_app.get("/work", headers={"X-Profile": "1", "X-Admin-Token": "no"})
+
+    assert "X-Profile-File" not in plain.headers
+    assert "X-Profile-File" not in wrong.headers
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_profiled_request_writes_pstats(profiled_app, tmp_path):
+    response = profiled_app.get("/work", headers={"X-Profile": "1", "X-Admin-Token": TOKEN})
+
+    assert response.json() == {"total": 49995000}
+    path = tmp_path / response.headers["X-Profile-File"]
+    stats = pstats.Stats(str(path))
+    assert any(name == "work" for _, _, name in stats.stats)
+
+
+def test_profiled_request_writes_speedscope(profiled_app, tmp_path):
+    response = profiled_app.get(
+        "/work", headers={"X-Profile": "speedscope", "X-Admin-Token": TOKEN}
+    )
+
+    document = json.loads((tmp_path / response.headers["X-Profile-File"]).read_text())
+    assert document["profiles"][0]["type"] == "sampled"
+
+
+def test_process_sampling_endpoints(profiled_app):
+    headers = {"X-Admin-Token": TOKEN}
+    assert profiled_app.post("/profiling/sample", params={"seconds": 5}).status_code == 403
+
+    started = profiled_app.post("/profiling/sample", params={"seconds": 5}, headers=headers)
+    again = profiled_app.post("/profiling/sample", params={"seconds": 5}, headers=headers)
+    stopped = profiled_app.delete("/profiling/sample", headers=headers)
+    listed = profiled_app.get("/profiling/profiles", headers=headers)
+    downloaded = profiled_app.get(
+        f"/profiling/profiles/{stopped.json()['file']}", headers=headers
+    )
+
+    assert started.status_code == 202
+    assert started.json()["running"] is True
+    assert again.status_code == 409
+    assert stopped.json()["running"] is False
+    assert [p["file"] for p in listed.json()] == [stopped.json()["file"]]
+    assert downloaded.json()["profiles"][0]["type"] == "sampled"
@@ -0,0 +1,28 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from app.middleware.query_stats import QueryStatsMiddleware
+from tests.conftest import engine
+
+
+def test_sql_accounting_headers():
+    app = FastAPI()
+    app.add_middleware(QueryStatsMiddleware)
+
+    @app.get("/queries/{count}")
+    def run(count: int):
+        with engine.connect() as conn:
+            for _ in range(count):
+                conn.execute(text("SELECT 1"))
+        return {"ok": True}
+
+    client = TestClient(app)
+    # The endpoint runs in the threadpool with a copy of the request context
+    response = client.get("/queries/3")
+    none = client.get("/queries/0")
+
+    assert response.headers["X-DB-Queries"] == "3"
+    assert float(response.headers["X-DB-Time"]) >= 0
+    assert none.headers["X-DB-Queries"] == "0"
+    assert none.headers["X-DB-Rows"] == "0"
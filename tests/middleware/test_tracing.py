@@ -0,0 +1,69 @@
+import json
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.middleware.tracing import TracingMiddleware
+from app.utils import tracing
+
+
+def _app(exporter):
+    app = FastAPI()
+    app.add_middleware(TracingMiddleware, exporter=exporter)
+    engine = create_async_engine("sqlite+aiosqlite://")
+
+    @tracing.traced()
+    async def load(item_id: int):
+        async with engine.connect() as conn:
+            return (await conn.execute(text("SELECT :id"), {"id": item_id})).scalar()
+
+    @app.get("/items/{item_id}")
+    async def get_item(item_id: int):
+        return {"id": await load(item_id)}
+
+    return app
+
+
+def test_server_timing_and_exported_tree(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATE", 1.0)
+    exporter = tracing.TraceExporter(path=str(tmp_path / "traces.jsonl"))
+    client = TestClient(_app(exporter))
+
+    response = client.get("/items/7")
+    exporter.flush()
+
+    assert response.json() == {"id": 7}
+    timing = response.headers["Server-Timing"]
+    assert timing.startswith("total;dur=")
+    assert "service;dur=" in timing
+    assert "db;dur=" in timing
+
+    [line] = (tmp_path / "traces.jsonl").read_text().splitlines()
+    trace = json.loads(line)
+    assert trace["trace_id"] == response.headers["X-Trace-Id"]
+    [root] = trace["spans"]
+    assert root["name"] == "GET /items/{item_id}"
+    assert root["attributes"]["http.status_code"] == 200
+    [service] = root["children"]
+    assert service["name"] == "test_tracing.load"
+    # SQL spans nest under the service call through the async engine
+    assert "db.select" in {child["name"] for child in service["children"]}
+
+
+def test_unsampled_requests_get_timing_only(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATE", 1.0)
+    exporter = tracing.TraceExporter(path=str(tmp_path / "traces.jsonl"))
+    client = TestClient(_app(exporter))
+
+    # The caller's traceparent decided not to sample
+    response = client.get(
+        "/items/1",
+        headers={"traceparent": f"00-{'a' * 32}-{'b' * 16}-00"},
+    )
+    exporter.flush()
+
+    assert "db;dur=" in response.headers["Server-Timing"]
+    assert "X-Trace-Id" not in response.headers
+    assert not (tmp_path / "traces.jsonl").exists()
@@ -1,10 +1,16 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 import pytest
 from unittest.mock import patch, MagicMock, AsyncMock
 import os
 from fastapi import HTTPException
+from google.api_core import exceptions as google_exceptions
 
+from app.services import ai as ai_service
 from app.services.ai import (
     list_available_models,
+    resolve_model_name,
     summarize_text,
     summarize_text_async
 )
@@ -14,6 +20,14 @@ TEST_TEXT = "This is a test text that needs to be summarized."
 TEST_TITLE = "Test Title"
 TEST_SUMMARY = "Summary of the test text."
 
+
+@pytest.fixture(autouse=True)
+def clear_model_cache():
+    """Start every test with an empty model discovery cache"""
+    ai_service.model_cache.clear()
+    yield
+    ai_service.model_cache.clear()
+
 # ============= TESTS FOR list_available_models =============
 
 def test_list_available_models_no_api_key():
@@ -48,12 +62,125 @@ def test_list_available_models_error():
 
 # ============= TESTS FOR summarize_text_async =============
 
+def _async_model(text=TEST_SUMMARY, delay=0.0, error=None):
+    """Fake model whose async generation sleeps before answering"""
+    async def generate_content_async(prompt):
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        response = MagicMock()
+        response.text = text
+        return response
+
+    model = MagicMock()
+    model.generate_content_async = AsyncMock(side_effect=generate_content_async)
+    return model
+
+@pytest.fixture
+def limiter():
+    """Replace the process-wide limiter with a fresh one"""
+    fresh = ai_service.ConcurrencyLimiter(limit=2, per_client=1)
+    with patch('app.services.ai.limiter', fresh):
+        yield fresh
+
+@pytest.mark.asyncio
+async def test_summarize_text_async(limiter):
+    """Test summarize_text_async uses the async generation API"""
+    model = _async_model()
+    with patch('app.services.ai.GEMINI_API_KEY', "fake-key"):
+        with patch('app.services.ai.resolve_model_name', return_value="gemini-pro"):
+            with patch('app.services.ai.genai.GenerativeModel', return_value=model):
+                result = await summarize_text_async(TEST_TEXT, TEST_TITLE)
+
+    assert result == TEST_SUMMARY
+    prompt = model.generate_content_async.call_args[0][0]
+    assert TEST_TITLE in prompt and TEST_TEXT in prompt
+    model.generate_content.assert_not_called()
+    assert limiter.stats()["completed"] == 1
+
+@pytest.mark.asyncio
+async def test_summarize_text_async_no_api_key():
+    """Test summarize_text_async when API key is not set"""
+    with patch('app.services.ai.GEMINI_API_KEY', None):
+        with pytest.raises(HTTPException) as excinfo:
+            await summarize_text_async(TEST_TEXT, TEST_TITLE)
+    assert excinfo.value.status_code == 500
+
 @pytest.mark.asyncio
-async def test_summarize_text_async():
-    """Test summarize_text_async function"""
-    with patch('app.services.ai.summarize_text', return_value=TEST_SUMMARY):
-        result = await summarize_text_async(TEST_TEXT, TEST_TITLE)
-        assert result == TEST_SUMMARY
+async def test_summarize_text_async_error(limiter):
+    """Model errors become a 500 and are counted"""
+    model = _async_model(error=Exception("Generation error"))
+    with patch('app.services.ai.GEMINI_API_KEY', "fake-key"):
+        with patch('app.services.ai.resolve_model_name', return_value="gemini-pro"):
+            with patch('app.services.ai.genai.GenerativeModel', return_value=model):
+                with pytest.raises(HTTPException) as excinfo:
+                    await summarize_text_async(TEST_TEXT, TEST_TITLE)
+
+    assert excinfo.value.status_code == 500
+    assert "Generation error" in excinfo.value.detail
+    assert limiter.stats()["failed"] == 1
+
+@pytest.mark.asyncio
+async def test_summarize_text_async_timeout(limiter):
+    """Slow generations are cut off with a 504"""
+    model = _async_model(delay=1.0)
+    with patch('app.services.ai.GEMINI_API_KEY', "fake-key"), \
+         patch('app.services.ai.AI_REQUEST_TIMEOUT', 0.05), \
+         patch('app.services.ai.resolve_model_name', return_value="gemini-pro"), \
+         patch('app.services.ai.genai.GenerativeModel', return_value=model):
+        with pytest.raises(HTTPException) as excinfo:
+            await summarize_text_async(TEST_TEXT, TEST_TITLE)
+
+    assert excinfo.value.status_code == 504
+    assert limiter.stats()["timeouts"] == 1
+    assert limiter.stats()["in_flight"] == 0
+
+@pytest.mark.asyncio
+async def test_limiter_caps_global_and_per_client_concurrency(limiter):
+    """At most `limit` calls run at once, and `per_client` per client"""
+    peak = {"all": 0, "a": 0}
+    running = {"all": 0, "a": 0}
+
+    async def call(client_id):
+        async with limiter.slot(client_id):
+            running["all"] += 1
+            if client_id == "a":
+                running["a"] += 1
+            peak["all"] = max(peak["all"], running["all"])
+            peak["a"] = max(peak["a"], running["a"])
+            await asyncio.sleep(0.01)
+            running["all"] -= 1
+            if client_id == "a":
+                running["a"] -= 1
+
+    await asyncio.gather(*(call(c) for c in ["a", "a", "a", "b", "c", "d"]))
+
+    assert peak["all"] == 2
+    assert peak["a"] == 1
+    assert limiter.stats()["in_flight"] == 0
+    assert limiter._clients == {}
+
+@pytest.mark.asyncio
+async def test_limiter_rejects_when_queue_wait_exceeds_timeout(limiter):
+    """Callers that cannot get a slot in time get a 503"""
+    release = asyncio.Event()
+
+    async def hold():
+        async with limiter.slot("a"):
+            await release.wait()
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+
+    with pytest.raises(HTTPException) as excinfo:
+        async with limiter.slot("a", timeout=0.01):
+            pass
+
+    release.set()
+    await holder
+    assert excinfo.value.status_code == 503
+    assert limiter.stats()["rejected"] == 1
+    assert limiter._clients == {}
 
 # ============= TESTS FOR summarize_text =============
 
@@ -202,3 +329,258 @@ def test_summarize_text_generate_content_error():
                     assert excinfo.value.status_code == 500
                     assert "AI summarization failed" in excinfo.value.detail
                     assert "Generation error" in excinfo.value.detail
+
+# ============= TESTS FOR model discovery cache =============
+
+def _named(*names):
+    models = []
+    for name in names:
+        model = MagicMock()
+        model.name = name
+        models.append(model)
+    return models
+
+def test_list_available_models_is_cached():
+    """Discovery hits the API once and is then served from the cache"""
+    with patch('app.services.ai.GEMINI_API_KEY', "fake-key"):
+        with patch('app.services.ai.genai.list_models', return_value=_named("models/gemini-pro")) as mock_list:
+            assert list_available_models() == ["models/gemini-pro"]
+            assert list_available_models() == ["models/gemini-pro"]
+            assert mock_list.call_count == 1
+
+def test_model_cache_serves_stale_value_while_refreshing():
+    """An expired entry is returned immediately and refreshed in the background"""
+    cache = ai_service.ModelCache(ttl=0, error_ttl=0)
+    with patch('app.services.ai.genai.list_models', return_value=_named("old")):
+        assert cache.get() == ["old"]
+
+    with patch('app.services.ai.genai.list_models', return_value=_named("new")):
+        with patch('app.services.ai.threading.Thread') as mock_thread:
+            assert cache.get() == ["old"]
+            mock_thread.assert_called_once_with(target=cache.refresh, daemon=True)
+        assert cache.refresh() == ["new"]
+
+def test_cold_model_cache_fetches_once_for_concurrent_callers():
+    """Lookups made while the first fetch runs wait for its result"""
+    cache = ai_service.ModelCache(ttl=60, error_ttl=60)
+
+    def slow_list_models():
+        time.sleep(0.05)
+        return _named("gemini-pro")
+
+    with patch('app.services.ai.genai.list_models', side_effect=slow_list_models) as mock_list:
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(lambda _: cache.get(), range(4)))
+    assert results == [["gemini-pro"]] * 4
+    assert mock_list.call_count == 1
+
+def test_model_cache_keeps_good_list_when_refresh_fails():
+    """A failed refresh does not replace a previously discovered list"""
+    cache = ai_service.ModelCache(ttl=0, error_ttl=0)
+    with patch('app.services.ai.genai.list_models', return_value=_named("gemini-pro")):
+        cache.refresh()
+    with patch('app.services.ai.genai.list_models', side_effect=Exception("API error")):
+        assert cache.refresh() == ["gemini-pro"]
+
+def test_resolve_model_name_skips_discovery_when_pinned():
+    """GEMINI_MODEL bypasses model discovery"""
+    with patch('app.services.ai.GEMINI_MODEL', "gemini-1.5-flash"):
+        with patch('app.services.ai.genai.list_models') as mock_list:
+            assert resolve_model_name() == "gemini-1.5-flash"
+            mock_list.assert_not_called()
+
+def test_summaries_make_one_remote_call_each():
+    """Repeated summaries only call generate_content once the cache is warm"""
+    mock_response = MagicMock()
+    mock_response.text = TEST_SUMMARY
+    mock_model = MagicMock()
+    mock_model.generate_content.return_value = mock_response
+
+    with patch('app.services.ai.GEMINI_API_KEY', "fake-key"):
+        with patch('app.services.ai.genai.list_models', return_value=_named("models/gemini-pro")) as mock_list:
+            with patch('app.services.ai.genai.GenerativeModel', return_value=mock_model):
+                summarize_text(TEST_TEXT, TEST_TITLE)
+                summarize_text(TEST_TEXT, TEST_TITLE)
+
+    assert mock_list.call_count == 1
+    assert mock_model.generate_content.call_count == 2
+
+# ============= TESTS FOR stream_summary_async =============
+
+class _FakeStream:
+    """Async-iterable streaming response that records whether it was closed"""
+
+    def __init__(self, parts, delay=0.0):
+        self.parts = parts
+        self.delay = delay
+        self.closed = False
+
+    async def __aiter__(self):
+        try:
+            for part in self.parts:
+                await asyncio.sleep(self.delay)
+                chunk = MagicMock()
+                chunk.text = part
+                yield chunk
+        finally:
+            self.closed = True
+
+def _streaming_model(stream):
+    model = MagicMock()
+    model.generate_content_async = AsyncMock(return_value=stream)
+    return model
+
+@pytest.mark.asyncio
+async def test_stream_summary_async_yields_chunks(limiter):
+    """Chunks are forwarded as the model produces them"""
+    stream = _FakeStream(["Brief ", "summary."])
+    model = _streaming_model(stream)
+    with patch('app.services.ai.GEMINI_API_KEY', "fake-key"), \
+         patch('app.services.ai.genai.GenerativeModel', return_value=model):
+        chunks = [c async for c in ai_service.stream_summary_async(TEST_TEXT, TEST_TITLE, model_name="gemini-pro")]
+
+    assert chunks == ["Brief ", "summary."]
+    assert model.generate_content_async.call_args.kwargs["stream"] is True
+    assert stream.closed
+    assert limiter.stats()["completed"] == 1
+    assert limiter.stats()["in_flight"] == 0
+
+@pytest.mark.asyncio
+async def test_stream_summary_async_close_cancels_upstream(limiter):
+    """Closing the stream early closes the upstream call and frees the slot"""
+    stream = _FakeStream(["one", "two", "three"], delay=0.01)
+    with patch('app.services.ai.GEMINI_API_KEY', "fake-key"), \
+         patch('app.services.ai.genai.GenerativeModel', return_value=_streaming_model(stream)):
+        agen = ai_service.stream_summary_async(TEST_TEXT, TEST_TITLE, model_name="gemini-pro")
+        assert await agen.__anext__() == "one"
+        await agen.aclose()
+
+    assert stream.closed
+    assert limiter.stats()["in_flight"] == 0
+    assert limiter.stats()["completed"] == 0
+
+@pytest.mark.asyncio
+async def test_stream_summary_async_chunk_timeout(limiter):
+    """A stalled stream is cut off with a 504"""
+    stream = _FakeStream(["late"], delay=1.0)
+    with patch('app.services.ai.GEMINI_API_KEY', "fake-key"), \
+         patch('app.services.ai.AI_REQUEST_TIMEOUT', 0.05), \
+         patch('app.services.ai.genai.GenerativeModel', return_value=_streaming_model(stream)):
+        with pytest.raises(HTTPException) as excinfo:
+            async for _ in ai_service.stream_summary_async(TEST_TEXT, TEST_TITLE, model_name="gemini-pro"):
+                pass
+
+    assert excinfo.value.status_code == 504
+    assert limiter.stats()["timeouts"] == 1
+
+# ============= TESTS FOR resilience =============
+
+
+def _flaky_model(responses):
+    """Fake model that replays delays and errors, one per attempt"""
+    async def generate_content_async(prompt):
+        delay, error = responses.pop(0)
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        response = MagicMock()
+        response.text = TEST_SUMMARY
+        return response
+
+    model = MagicMock()
+    model.generate_content_async = AsyncMock(side_effect=generate_content_async)
+    return model
+
+
+@pytest.fixture
+def gemini():
+    with patch('app.services.ai.GEMINI_API_KEY', "fake-key"), \
+         patch('app.services.ai.AI_RETRY_BASE_DELAY', 0), \
+         patch('app.services.ai.GEMINI_MODEL', "gemini-pro"):
+        yield
+
+
+@pytest.mark.asyncio
+async def test_transient_errors_are_retried(limiter, gemini):
+    model = _flaky_model([
+        (0, google_exceptions.ServiceUnavailable("down")),
+        (0, google_exceptions.TooManyRequests("slow down")),
+        (0, None),
+    ])
+    with patch('app.services.ai.genai.GenerativeModel', return_value=model):
+        assert await summarize_text_async(TEST_TEXT, TEST_TITLE) == TEST_SUMMARY
+
+    assert model.generate_content_async.call_count == 3
+    assert ai_service.attempt_stats["retries"] == 2
+    assert ai_service.breaker.failures == 0
+
+
+@pytest.mark.asyncio
+async def test_permanent_errors_are_not_retried(limiter, gemini):
+    model = _flaky_model([(0, google_exceptions.InvalidArgument("bad prompt"))])
+    with patch('app.services.ai.genai.GenerativeModel', return_value=model):
+        with pytest.raises(HTTPException) as excinfo:
+            await summarize_text_async(TEST_TEXT, TEST_TITLE)
+
+    assert excinfo.value.status_code == 500
+    assert model.generate_content_async.call_count == 1
+    assert ai_service.breaker.failures == 0
+
+
+@pytest.mark.asyncio
+async def test_slow_attempt_is_cut_off_and_retried(limiter, gemini):
+    model = _flaky_model([(1.0, None), (0, None)])
+    with patch('app.services.ai.AI_ATTEMPT_TIMEOUT', 0.05), \
+         patch('app.services.ai.genai.GenerativeModel', return_value=model):
+        assert await summarize_text_async(TEST_TEXT, TEST_TITLE) == TEST_SUMMARY
+
+    assert ai_service.attempt_stats["retries"] == 1
+
+
+@pytest.mark.asyncio
+async def test_open_circuit_fails_fast(limiter, gemini):
+    model = _flaky_model([(0, google_exceptions.ServiceUnavailable("down"))] * 2)
+    with patch('app.services.ai.AI_MAX_RETRIES', 0), \
+         patch('app.services.ai.breaker', ai_service.CircuitBreaker(2, 60)) as breaker, \
+         patch('app.services.ai.genai.GenerativeModel', return_value=model):
+        for _ in range(2):
+            with pytest.raises(HTTPException):
+                await summarize_text_async(TEST_TEXT, TEST_TITLE)
+        with pytest.raises(HTTPException) as excinfo:
+            await summarize_text_async(TEST_TEXT, TEST_TITLE)
+
+    assert excinfo.value.status_code == 503
+    assert model.generate_content_async.call_count == 2
+    assert breaker.state == breaker.OPEN
+
+
+@pytest.mark.asyncio
+async def test_slow_request_is_hedged(limiter, gemini):
+    for _ in range(ai_service.latencies.min_samples):
+        ai_service.latencies.add(0.01)
+    model = _flaky_model([(1.0, None), (0, None)])
+    with patch('app.services.ai.AI_HEDGE', True), \
+         patch('app.services.ai.genai.GenerativeModel', return_value=model):
+        start = asyncio.get_running_loop().time()
+        assert await summarize_text_async(TEST_TEXT, TEST_TITLE) == TEST_SUMMARY
+        elapsed = asyncio.get_running_loop().time() - start
+
+    assert elapsed < 0.5
+    assert ai_service.attempt_stats["hedged"] == 1
+    assert ai_service.attempt_stats["hedge_wins"] == 1
+
+
+@pytest.mark.asyncio
+async def test_gemini_calls_are_counted_by_outcome(limiter, gemini):
+    def count(outcome):
+        return ai_service.gemini_requests.labels("generate", outcome).value
+
+    success, error = count("success"), count("error")
+    model = _flaky_model([(0, None), (0, google_exceptions.InvalidArgument("bad"))])
+    with patch('app.services.ai.genai.GenerativeModel', return_value=model):
+        await summarize_text_async(TEST_TEXT, TEST_TITLE)
+        with pytest.raises(HTTPException):
+            await summarize_text_async(TEST_TEXT, TEST_TITLE)
+
+    assert count("success") == success + 1
+    assert count("error") == error + 1
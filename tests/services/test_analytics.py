@@ -0,0 +1,32 @@
+from collections import Counter
+
+from app.services.analytics import _merge_analyses
+
+
+def test_merge_analyses_of_shards():
+    partials = [
+        {
+            "notes": 2,
+            "words": 30,
+            "counts": Counter({"plan": 2, "trip": 1}),
+            "shortest": [(10, 1), (20, 4)],
+            "longest": [(10, 1), (20, 4)],
+        },
+        {"notes": 0, "words": 0, "counts": Counter(), "shortest": [], "longest": []},
+        {
+            "notes": 2,
+            "words": 50,
+            "counts": Counter({"trip": 3}),
+            "shortest": [(5, 2), (45, 3)],
+            "longest": [(5, 2), (45, 3)],
+        },
+    ]
+    result = _merge_analyses(partials)
+    assert result["total_notes"] == 4
+    assert result["total_words"] == 80
+    assert result["average_note_length"] == 20
+    assert result["most_common_words"] == [("trip", 4), ("plan", 2)]
+    assert result["top_3_shortest_notes"] == [2, 1, 4]
+    assert result["top_3_longest_notes"] == [1, 4, 3]
+
+    assert _merge_analyses([partials[1]])["total_notes"] == 0
@@ -0,0 +1,99 @@
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select
+
+from app.models.notes import Blob, Note, NoteAttachment
+from app.services import attachments
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(attachments, "ATTACHMENT_DIR", str(tmp_path))
+    monkeypatch.setattr(attachments, "WRITE_BUFFER_SIZE", 8)
+    return tmp_path
+
+
+async def _chunks(*parts):
+    for part in parts:
+        yield part
+
+
+async def _note(db):
+    note = Note(title="A", content="A")
+    db.add(note)
+    await db.commit()
+    return note.id
+
+
+@pytest.mark.asyncio
+async def test_identical_content_is_stored_once(async_db, store):
+    note_id = await _note(async_db)
+    first = await attachments.create_attachment_async(
+        async_db, note_id, "a.txt", "text/plain", _chunks(b"hello ", b"world")
+    )
+    second = await attachments.create_attachment_async(
+        async_db, note_id, "b.txt", "text/plain", _chunks(b"hello world")
+    )
+
+    assert first["sha256"] == second["sha256"]
+    assert first["size"] == 11
+    with open(attachments.blob_path(first["sha256"]), "rb") as f:
+        assert f.read() == b"hello world"
+    assert (await async_db.execute(select(Blob))).scalars().all()[0].size == 11
+    listed = await attachments.get_attachments_async(async_db, note_id)
+    assert [a["filename"] for a in listed] == ["a.txt", "b.txt"]
+    # Nothing is left behind in tmp/
+    assert os.listdir(store / "tmp") == []
+
+
+@pytest.mark.asyncio
+async def test_oversized_upload_is_discarded(async_db, store):
+    note_id = await _note(async_db)
+    with pytest.raises(HTTPException) as error:
+        await attachments.create_attachment_async(
+            async_db, note_id, "big", "text/plain", _chunks(b"x" * 6, b"x" * 6), max_bytes=10
+        )
+    assert error.value.status_code == 413
+    assert os.listdir(store / "tmp") == []
+    assert (await async_db.execute(select(Blob))).scalars().all() == []
+
+
+def _blob(db, store, content, sha256, age):
+    db.add(Blob(sha256=sha256, size=len(content), last_used_at=datetime.utcnow() - age))
+    path = attachments.blob_path(sha256)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content)
+    old = time.time() - age.total_seconds()
+    os.utime(path, (old, old))
+    return path
+
+
+def test_garbage_collection_removes_unreferenced_content(db, store):
+    hour = timedelta(hours=1)
+    note = Note(title="A", content="A")
+    db.add(note)
+    db.flush()
+    kept = _blob(db, store, b"kept", "a" * 64, 2 * hour)
+    db.add(NoteAttachment(note_id=note.id, sha256="a" * 64, filename="k", content_type="x"))
+    unused = _blob(db, store, b"unused", "b" * 64, 2 * hour)
+    recent = _blob(db, store, b"recent", "c" * 64, timedelta(0))
+    db.commit()
+    orphan = _blob(db, store, b"orphan", "d" * 64, 2 * hour)
+    db.rollback()
+    os.makedirs(store / "tmp", exist_ok=True)
+    abandoned = store / "tmp" / "upload-1"
+    abandoned.write_bytes(b"partial")
+    os.utime(abandoned, (time.time() - 7200, time.time() - 7200))
+
+    stats = attachments.collect_garbage(db, grace=3600)
+
+    assert stats == {"blobs": 1, "files": 1, "temp_files": 1, "orphan_files": 1}
+    assert os.path.exists(kept) and os.path.exists(recent)
+    assert not os.path.exists(unused) and not os.path.exists(orphan)
+    assert not abandoned.exists()
+    assert set(db.execute(select(Blob.sha256)).scalars()) == {"a" * 64, "c" * 64}
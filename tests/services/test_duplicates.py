@@ -0,0 +1,111 @@
+import numpy as np
+
+from app.models.notes import Note, NoteSignature
+from app.schemas.notes import NoteCreate, NoteUpdate
+from app.services import duplicates
+from app.services.duplicates import (
+    NUM_PERM,
+    LshIndex,
+    backfill_signatures,
+    compute_signature,
+    compute_signatures,
+    signature_from_bytes,
+    signature_to_bytes,
+)
+from app.services.notes import create_note, delete_note, update_note
+from tests.conftest import engine
+
+BASE = (
+    "Quarterly planning notes covering hiring goals, infrastructure budget, "
+    "release schedule for the mobile app and the migration of the billing "
+    "service to the new payments provider before the end of the year"
+)
+
+
+def test_signature_shape_and_round_trip():
+    signature = compute_signature(BASE)
+    assert signature.shape == (NUM_PERM,)
+    assert signature.dtype == np.uint32
+    assert len(signature_to_bytes(signature)) == NUM_PERM * 4
+    assert np.array_equal(signature_from_bytes(signature_to_bytes(signature)), signature)
+
+
+def test_batch_matches_single():
+    texts = [BASE, "short", BASE + " and a tail"]
+    batch = compute_signatures(texts)
+    for text, signature in zip(texts, batch):
+        assert np.array_equal(signature, compute_signature(text))
+
+
+def test_batch_handles_chunk_boundaries(monkeypatch):
+    texts = [BASE, "short note", BASE + " appended words"]
+    expected = compute_signatures(texts)
+    monkeypatch.setattr(duplicates, "_CHUNK", 4)
+    assert np.array_equal(compute_signatures(texts), expected)
+
+
+def test_lsh_finds_near_duplicates_only():
+    index = LshIndex()
+    index.add(1, compute_signature(BASE))
+    index.add(2, compute_signature(BASE + " thanks"))
+    index.add(3, compute_signature("Sourdough bread recipe with rye flour and a long proof"))
+
+    matches = index.duplicates(1, threshold=0.6)
+    assert [note_id for note_id, _ in matches] == [2]
+    assert index.groups(threshold=0.6) == [[1, 2]]
+
+
+def test_lsh_remove():
+    index = LshIndex()
+    index.add(1, compute_signature(BASE))
+    index.add(2, compute_signature(BASE))
+    index.remove(2)
+    assert index.duplicates(1) == []
+    assert len(index) == 1
+
+
+def test_note_writes_maintain_signatures(db):
+    note = create_note(db, NoteCreate(title="A", content=BASE))
+    row = db.query(NoteSignature).filter_by(note_id=note.id).one()
+    assert np.array_equal(signature_from_bytes(row.signature), compute_signature(BASE))
+    assert note.id in duplicates.index
+
+    update_note(db, note.id, NoteUpdate(content="Entirely new content here"))
+    db.refresh(row)
+    assert np.array_equal(
+        signature_from_bytes(row.signature), compute_signature("Entirely new content here")
+    )
+
+    delete_note(db, note.id)
+    assert db.query(NoteSignature).count() == 0
+    assert note.id not in duplicates.index
+
+
+def test_backfill_signatures(db):
+    db.add_all([Note(title="a", content=BASE), Note(title="b", content="other text")])
+    db.commit()
+
+    assert backfill_signatures(db, batch_size=1) == 2
+    assert db.query(NoteSignature).count() == 2
+    assert backfill_signatures(db) == 0
+
+
+def test_backfill_tolerates_rows_written_meanwhile(db, monkeypatch):
+    db.add_all([Note(title="a", content=BASE), Note(title="b", content="other text")])
+    db.commit()
+    ids = [note_id for (note_id,) in db.query(Note.id).order_by(Note.id)]
+    compute = duplicates.compute_signatures
+
+    def compute_while_another_worker_backfills(texts):
+        signatures = compute(texts)
+        # Another worker stores the first note's signature in the meantime
+        with engine.begin() as conn:
+            conn.execute(
+                NoteSignature.__table__.insert(),
+                {"note_id": ids[0], "signature": signature_to_bytes(signatures[0])},
+            )
+        return signatures
+
+    monkeypatch.setattr(duplicates, "compute_signatures", compute_while_another_worker_backfills)
+    assert backfill_signatures(db) == 2
+    assert db.query(NoteSignature).count() == 2
@@ -0,0 +1,38 @@
+from app.services.extractive import rank_sentences, summarize
+from app.utils.text_processing import split_sentences
+
+TEXT = (
+    "Solar panels convert sunlight into electricity. "
+    "Modern solar panels convert more sunlight into electricity than older panels. "
+    "My cat likes to sleep on the sofa. "
+    "Electricity from solar panels can be stored in batteries.\n\n"
+    "Batteries store electricity for use at night."
+)
+
+
+def test_split_sentences_uses_punctuation_and_paragraphs():
+    assert split_sentences("One. Two!\n\nThree") == ["One.", "Two!", "Three"]
+    assert split_sentences("   ") == []
+
+
+def test_rank_sentences_favours_central_sentences():
+    sentences = split_sentences(TEXT)
+    scores = rank_sentences(sentences)
+    assert len(scores) == len(sentences)
+    assert abs(scores.sum() - 1.0) < 1e-6
+    assert scores.argmin() == 2  # the sentence about the cat
+
+
+def test_summarize_keeps_original_order():
+    summary = summarize(TEXT, max_sentences=2)
+    sentences = split_sentences(summary)
+    assert len(sentences) == 2
+    positions = [TEXT.index(sentence) for sentence in sentences]
+    assert positions == sorted(positions)
+    assert "cat" not in summary
+
+
+def test_summarize_is_deterministic_and_handles_short_text():
+    assert summarize(TEXT) == summarize(TEXT)
+    assert summarize("Just one sentence.") == "Just one sentence."
+    assert summarize("") == ""
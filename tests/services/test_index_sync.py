@@ -0,0 +1,87 @@
+import pytest
+from sqlalchemy import delete
+
+from app.models.notes import NoteChange
+from app.schemas.notes import NoteCreate, NoteUpdate
+from app.services import duplicates, index_sync, similarity
+from app.services.notes import create_note, delete_note, update_note
+
+BREAD = "Sourdough bread starter feeding schedule and cold fermentation"
+
+
+@pytest.fixture(autouse=True)
+def fresh_indexes(monkeypatch):
+    monkeypatch.setattr(similarity, "index", similarity.TfidfIndex())
+    monkeypatch.setattr(duplicates, "index", duplicates.LshIndex())
+
+
+def _as_other_worker(monkeypatch, write):
+    """Make a write as another process would, leaving this one's indexes as they were"""
+    tfidf, lsh = similarity.index, duplicates.index
+    monkeypatch.setattr(similarity, "index", similarity.TfidfIndex())
+    monkeypatch.setattr(duplicates, "index", duplicates.LshIndex())
+    with monkeypatch.context() as m:
+        m.setattr(index_sync, "ORIGIN", "other")
+        result = write()
+    monkeypatch.setattr(similarity, "index", tfidf)
+    monkeypatch.setattr(duplicates, "index", lsh)
+    return result
+
+
+def test_follower_applies_writes_of_other_workers(db, monkeypatch):
+    follower = index_sync.ChangeFollower()
+    follower.mark(db)
+    own = create_note(db, NoteCreate(title="Own", content="Notes about hiking trails"))
+    bread = _as_other_worker(
+        monkeypatch, lambda: create_note(db, NoteCreate(title="Bread", content=BREAD))
+    )
+    copy = _as_other_worker(
+        monkeypatch, lambda: create_note(db, NoteCreate(title="Copy", content=BREAD))
+    )
+    assert bread.id not in similarity.index
+
+    # This worker's own write is already in its indexes
+    assert follower.follow(db) == 2
+    assert {bread.id, copy.id, own.id} <= similarity.index.note_ids()
+    assert [note_id for note_id, _ in duplicates.index.duplicates(bread.id)] == [copy.id]
+
+    _as_other_worker(
+        monkeypatch,
+        lambda: update_note(db, copy.id, NoteUpdate(content="Notes about hiking boots")),
+    )
+    _as_other_worker(monkeypatch, lambda: delete_note(db, bread.id))
+    assert follower.follow(db) == 2
+    assert bread.id not in similarity.index
+    assert bread.id not in duplicates.index
+    assert own.id in [note_id for note_id, _ in similarity.index.related(copy.id, max_df_ratio=None)]
+    assert follower.follow(db) == 0
+
+
+def test_follower_rebuilds_after_falling_behind(db, monkeypatch):
+    follower = index_sync.ChangeFollower()
+    create_note(db, NoteCreate(title="First", content="Notes about hiking trails"))
+    follower.mark(db)
+    missed = _as_other_worker(
+        monkeypatch, lambda: create_note(db, NoteCreate(title="Bread", content=BREAD))
+    )
+    # Pruned before this worker read it
+    db.execute(delete(NoteChange))
+    db.commit()
+    seen = _as_other_worker(
+        monkeypatch, lambda: create_note(db, NoteCreate(title="Copy", content=BREAD))
+    )
+
+    follower.follow(db)
+
+    assert follower.rebuilds == 1
+    assert {missed.id, seen.id} <= similarity.index.note_ids()
+    assert missed.id in duplicates.index
+    assert follower.follow(db) == 0
+
+
+def test_old_changes_are_pruned(db):
+    create_note(db, NoteCreate(title="Note", content="Notes about hiking trails"))
+    index_sync.ChangeFollower(retention=3600).prune(db)
+    assert db.query(NoteChange).count() == 1
+    index_sync.ChangeFollower(retention=-60).prune(db)
+    assert db.query(NoteChange).count() == 0
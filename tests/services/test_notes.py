@@ -1,12 +1,16 @@
 import pytest
 from unittest.mock import MagicMock, patch, AsyncMock
 import asyncio
+from datetime import datetime
 from fastapi import HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from tests.conftest import query_plan
+
 from app.models.notes import Note, NoteHistory
 from app.schemas.notes import NoteCreate, NoteUpdate
 from app.services.notes import (
+    note_list_query,
     # Sync functions
     create_note, get_note, get_all_notes,
     update_note, delete_note, get_note_history,
@@ -130,6 +134,23 @@ def test_get_note_history(db):
     assert history[0].title == "Original Title"
     assert history[0].content == "Original Content"
 
+
+def test_get_note_history_of_missing_note(db):
+    note = create_note(db, NoteCreate(title="Title", content="Content"))
+    assert get_note_history(db, note.id) == []
+    with pytest.raises(HTTPException) as excinfo:
+        get_note_history(db, note.id + 1)
+    assert excinfo.value.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_get_note_history_async_of_missing_note(async_db):
+    note = await create_note_async(async_db, NoteCreate(title="Title", content="Content"))
+    assert await get_note_history_async(async_db, note.id) == []
+    with pytest.raises(HTTPException) as excinfo:
+        await get_note_history_async(async_db, note.id + 1)
+    assert excinfo.value.status_code == 404
+
 # ============= ASYNC TESTS =============
 
 @pytest.mark.asyncio
@@ -294,11 +315,9 @@ async def test_get_note_history_async():
     with patch('app.services.notes.get_note_async', autospec=True) as mock_get:
         mock_get.return_value = mock_note
 
-        # Setup mock for execute
+        # Setup mock for execute: the note's id joined to each version
         mock_result = MagicMock()
-        mock_scalars = MagicMock()
-        mock_scalars.all.return_value = mock_history
-        mock_result.scalars.return_value = mock_scalars
+        mock_result.all.return_value = [(1, version) for version in mock_history]
 
         # Set up the execute method to return the mock_result
         mock_db.execute.return_value = mock_result
@@ -312,3 +331,49 @@ async def test_get_note_history_async():
         assert history[0].title == "Original Title"
         assert history[1].title == "Updated Title 1"
         assert mock_db.execute.called
+
+
+# ============= LISTING QUERY PLANS =============
+
+def _notes_steps(plan):
+    return [step for step in plan.splitlines() if " notes " in f"{step} "]
+
+
+@pytest.mark.parametrize("sort", ["updated_at", "created_at", "title"])
+@pytest.mark.parametrize("descending", [False, True])
+def test_listings_without_content_read_only_the_sort_index(db, sort, descending):
+    since = datetime(2024, 1, 1)
+    queries = [
+        note_list_query(0, 20, sort=sort, descending=descending, with_content=False),
+        # The next page, from a cursor
+        note_list_query(
+            0, 20, sort=sort, descending=descending, with_content=False,
+            after=["2024-01-01 00:00:00", 5],
+        ),
+        note_list_query(
+            0, 20, sort=sort, descending=descending, with_content=False,
+            updated_since=since, created_before=since,
+        ),
+    ]
+    for query in queries:
+        plan = query_plan(query)
+        steps = _notes_steps(plan)
+        # Never the table itself, nor a sort of the rows
+        assert steps
+        assert all(f"USING COVERING INDEX ix_notes_{sort}" in step for step in steps)
+        assert "TEMP B-TREE" not in plan
+
+
+def test_time_filters_and_cursors_are_index_ranges(db):
+    since = datetime(2024, 1, 1)
+    plan = query_plan(
+        note_list_query(0, 20, sort="updated_at", updated_since=since, with_content=False)
+    )
+    assert "ix_notes_updated_at (updated_at>?)" in plan
+
+    plan = query_plan(
+        note_list_query(0, 20, sort="created_at", descending=True, after=["2024-01-01", 3])
+    )
+    # With content the rows are read too, but in index order
+    assert "USING INDEX ix_notes_created_at (created_at<?)" in plan
+    assert "TEMP B-TREE" not in plan
@@ -0,0 +1,98 @@
+import asyncio
+from unittest.mock import patch
+
+import pytest
+import pytest_asyncio
+
+from app.schemas.notes import NoteCreate, NoteUpdate
+from app.services import notes as notes_service
+from app.services import precompute, summaries
+from app.services.precompute import SummaryPrecomputer
+from tests.conftest import AsyncTestingSessionLocal
+
+
+@pytest.fixture(autouse=True)
+def pinned_backend():
+    summaries.lru.clear()
+    with patch("app.services.summarizers.SUMMARIZER_BACKEND", "gemini"), \
+            patch("app.services.ai.GEMINI_MODEL", "gemini-pro"):
+        yield
+    summaries.lru.clear()
+
+
+@pytest_asyncio.fixture
+async def precomputer(async_db):
+    """A running precomputer hooked into the notes service"""
+    fresh = SummaryPrecomputer(delay=0.05, workers=2, maxsize=10)
+    await fresh.start(AsyncTestingSessionLocal)
+    with patch.object(precompute, "precomputer", fresh):
+        yield fresh
+    await fresh.stop(timeout=1)
+
+
+async def _wait_until(condition, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+@pytest.mark.asyncio
+async def test_written_note_is_summarized_in_background(async_db, precomputer):
+    with patch("app.services.summaries.ai_service.summarize_text_async",
+               return_value="Precomputed") as mock_summarize:
+        note = await notes_service.create_note_async(
+            async_db, NoteCreate(title="Title", content="Some content")
+        )
+        await _wait_until(lambda: precomputer.completed == 1)
+
+    mock_summarize.assert_called_once()
+    summaries.lru.clear()
+    with patch("app.services.summaries.ai_service.summarize_text_async") as mock_summarize:
+        assert await summaries.get_summary_async(async_db, note) == "Precomputed"
+    mock_summarize.assert_not_called()
+    assert precomputer.stats()["depth"] == 0
+    assert precomputer.stats()["last_lag_seconds"] >= 0.05
+
+
+@pytest.mark.asyncio
+async def test_rapid_edits_are_debounced(async_db, precomputer):
+    with patch("app.services.summaries.ai_service.summarize_text_async",
+               return_value="Summary") as mock_summarize:
+        note = await notes_service.create_note_async(
+            async_db, NoteCreate(title="Title", content="Version 0")
+        )
+        for i in range(1, 4):
+            await notes_service.update_note_async(
+                async_db, note.id, NoteUpdate(content=f"Version {i}")
+            )
+        await _wait_until(lambda: precomputer.completed == 1)
+        await asyncio.sleep(0.1)
+
+    mock_summarize.assert_called_once()
+    assert mock_summarize.call_args[0][0] == "Version 3"
+    assert precomputer.debounced == 3
+
+
+@pytest.mark.asyncio
+async def test_full_queue_drops_notes():
+    fresh = SummaryPrecomputer(delay=60, workers=1, maxsize=2)
+    await fresh.start(AsyncTestingSessionLocal)
+    try:
+        for note_id in range(5):
+            fresh.schedule(note_id)
+        assert fresh.stats()["depth"] == 2
+        assert fresh.dropped == 3
+    finally:
+        await fresh.stop(timeout=1)
+
+    # Notes still waiting out their delay are dropped on shutdown
+    assert fresh.dropped == 5
+    assert not fresh.running
+
+
+def test_schedule_is_a_no_op_when_not_running():
+    fresh = SummaryPrecomputer()
+    fresh.schedule(1)
+    assert fresh.stats()["depth"] == 0
+    assert fresh.scheduled == 0
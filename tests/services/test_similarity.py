@@ -0,0 +1,137 @@
+import pytest
+
+from app.services import similarity
+from app.services.similarity import TfidfIndex
+
+NOTES = {
+    1: "Python asyncio event loop and coroutine scheduling",
+    2: "Scheduling coroutines on the asyncio event loop in Python",
+    3: "Baking sourdough bread with a long cold fermentation",
+    4: "Sourdough starter feeding schedule for better bread",
+    5: "Quarterly budget review meeting notes",
+}
+
+
+@pytest.fixture
+def index():
+    idx = TfidfIndex()
+    idx.rebuild(NOTES.items())
+    return idx
+
+
+def test_related_ranks_similar_notes_first(index):
+    related = index.related(1, k=2)
+    assert related[0][0] == 2
+    assert 0 < related[0][1] <= 1.0
+    assert all(note_id != 1 for note_id, _ in related)
+
+
+def test_related_unknown_note_returns_empty(index):
+    assert index.related(999) == []
+
+
+def test_add_is_visible_before_compaction(index):
+    index.add(6, "Rye sourdough bread recipe with cold fermentation")
+    assert 6 in [note_id for note_id, _ in index.related(3, k=3)]
+
+
+def test_update_replaces_previous_version(index):
+    index.add(5, "Asyncio coroutine event loop internals in Python")
+    assert 5 not in [note_id for note_id, _ in index.related(3, k=4)]
+    assert 5 in [note_id for note_id, _ in index.related(1, k=2)]
+
+
+def test_remove_masks_compiled_rows(index):
+    index.remove(2)
+    assert 2 not in index
+    assert 2 not in [note_id for note_id, _ in index.related(1, k=4)]
+
+
+def test_results_match_after_compaction(index):
+    index.add(6, "Python coroutine scheduling tips")
+    before = index.related(1, k=3)
+    index.compact()
+    after = index.related(1, k=3)
+    assert [i for i, _ in before] == [i for i, _ in after]
+
+
+def test_max_terms_prunes_query(index):
+    assert len(index.related(1, k=4, max_terms=1)) <= len(index.related(1, k=4))
+
+
+def test_save_and_load_round_trip(index, tmp_path):
+    path = str(tmp_path / "index.npz")
+    index.save(path)
+
+    loaded = TfidfIndex()
+    loaded.load(path)
+
+    assert loaded.note_ids() == index.note_ids()
+    assert loaded.related(3, k=2) == index.related(3, k=2)
+
+
+def test_load_index_reconciles_with_database(db, tmp_path):
+    from app.models.notes import Note
+
+    db.add_all([Note(id=1, title="a", content=NOTES[1]), Note(id=2, title="b", content=NOTES[2])])
+    db.commit()
+
+    stale = TfidfIndex()
+    stale.rebuild([(1, NOTES[1]), (3, NOTES[3])])
+    path = str(tmp_path / "index.npz")
+    stale.save(path)
+
+    similarity.load_index(db, path)
+
+    assert similarity.index.note_ids() == {1, 2}
+
+
+def test_writes_during_compaction_stay_visible(index, monkeypatch):
+    compile_snapshot = index._compile
+
+    def compile_while_writing(*snapshot):
+        index.add(6, "Rye sourdough bread recipe with cold fermentation")
+        index.add(2, "Quarterly budget planning spreadsheet")
+        return compile_snapshot(*snapshot)
+
+    monkeypatch.setattr(index, "_compile", compile_while_writing)
+    index.compact()
+
+    assert 6 in [note_id for note_id, _ in index.related(3, k=3)]
+    assert 2 not in [note_id for note_id, _ in index.related(1, k=4)]
+    monkeypatch.undo()
+    index.compact()
+    assert 2 in [note_id for note_id, _ in index.related(5, k=4)]
+
+
+def test_full_delta_compacts_in_background(index, monkeypatch):
+    monkeypatch.setattr(similarity, "COMPACT_MIN", 1)
+    monkeypatch.setattr(similarity, "COMPACT_MAX_PENDING", 1)
+    index.add(6, "Python coroutine scheduling tips")
+    index.add(7, "Sourdough bread crust tips")
+    index._compactor.join(timeout=5)
+    assert not index._pending
+    assert 6 in [note_id for note_id, _ in index.related(1, k=3)]
+
+
+def test_load_index_reindexes_notes_edited_after_save(db, tmp_path):
+    from datetime import datetime, timedelta
+
+    from app.models.notes import Note
+
+    db.add_all([Note(id=i, title=str(i), content=content) for i, content in NOTES.items()])
+    db.commit()
+    saved = TfidfIndex()
+    saved.rebuild(NOTES.items())
+    path = str(tmp_path / "index.npz")
+    saved.save(path)
+
+    # An edit the index never saw, as after a crash
+    note = db.get(Note, 5)
+    note.content = "Sourdough bread starter and cold fermentation"
+    note.updated_at = datetime.utcnow() + timedelta(seconds=5)
+    db.commit()
+
+    similarity.load_index(db, path)
+
+    assert 5 in [note_id for note_id, _ in similarity.index.related(3, k=2)]
@@ -0,0 +1,426 @@
+import asyncio
+import time
+
+import pytest
+from unittest.mock import patch
+from fastapi import HTTPException
+from sqlalchemy.future import select
+
+from app.models.notes import CachedSummary, ChunkSummary, Note
+from app.services import ai as ai_service
+from app.services import summaries
+from app.services.summaries import get_summary_async, summary_key
+from tests.conftest import AsyncTestingSessionLocal
+
+
+@pytest.fixture(autouse=True)
+def clear_lru():
+    summaries.lru.clear()
+    yield
+    summaries.lru.clear()
+
+
+@pytest.fixture(autouse=True)
+def gemini_backend():
+    with patch("app.services.summarizers.SUMMARIZER_BACKEND", "gemini"):
+        yield
+
+
+@pytest.fixture
+def pinned_model():
+    with patch("app.services.ai.GEMINI_MODEL", "gemini-pro"):
+        yield "gemini-pro"
+
+
+async def _add_note(db, title="Title", content="Some content"):
+    note = Note(title=title, content=content)
+    db.add(note)
+    await db.commit()
+    await db.refresh(note)
+    return note
+
+
+def test_summary_key_depends_on_every_part():
+    base = summary_key("t", "c", "m", "1")
+    assert len(base) == 64
+    assert base == summary_key("t", "c", "m", "1")
+    assert base != summary_key("t2", "c", "m", "1")
+    assert base != summary_key("t", "c2", "m", "1")
+    assert base != summary_key("t", "c", "m2", "1")
+    assert base != summary_key("t", "c", "m", "2")
+    assert summary_key("ab", "c", "m", "1") != summary_key("a", "bc", "m", "1")
+
+
+@pytest.mark.asyncio
+async def test_summary_is_generated_once_then_served_from_memory(async_db, pinned_model):
+    note = await _add_note(async_db)
+    with patch("app.services.summaries.ai_service.summarize_text_async",
+               return_value="Short summary") as mock_summarize:
+        assert await get_summary_async(async_db, note) == "Short summary"
+        assert await get_summary_async(async_db, note) == "Short summary"
+
+    mock_summarize.assert_called_once_with("Some content", "Title", model_name=pinned_model)
+    assert summaries.lru.stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_summary_is_served_from_table_after_restart(async_db, pinned_model):
+    note = await _add_note(async_db)
+    with patch("app.services.summaries.ai_service.summarize_text_async",
+               return_value="Short summary"):
+        await get_summary_async(async_db, note)
+
+    summaries.lru.clear()
+    with patch("app.services.summaries.ai_service.summarize_text_async") as mock_summarize:
+        assert await get_summary_async(async_db, note) == "Short summary"
+    mock_summarize.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_editing_a_note_invalidates_its_summary(async_db, pinned_model):
+    note = await _add_note(async_db)
+    with patch("app.services.summaries.ai_service.summarize_text_async",
+               side_effect=["First summary", "Second summary"]) as mock_summarize:
+        assert await get_summary_async(async_db, note) == "First summary"
+        note.content = "Edited content"
+        await async_db.commit()
+        await async_db.refresh(note)
+        assert await get_summary_async(async_db, note) == "Second summary"
+
+    assert mock_summarize.call_count == 2
+    result = await async_db.execute(select(CachedSummary.summary))
+    assert result.scalars().all() == ["Second summary"]
+
+
+async def _collect(agen):
+    return [item async for item in agen]
+
+
+@pytest.mark.asyncio
+async def test_batch_streams_results_in_completion_order(async_db, pinned_model):
+    slow = await _add_note(async_db, "Slow", "slow content")
+    fast = await _add_note(async_db, "Fast", "fast content")
+    broken = await _add_note(async_db, "Broken", "broken content")
+    delays = {"slow content": 0.3, "fast content": 0.1, "broken content": 0.2}
+
+    async def fake_summarize(content, title, model_name=None):
+        await asyncio.sleep(delays[content])
+        if title == "Broken":
+            raise Exception("model exploded")
+        return f"summary of {title}"
+
+    with patch("app.services.summaries.ai_service.summarize_text_async",
+               side_effect=fake_summarize):
+        start = time.perf_counter()
+        results = await _collect(summaries.summarize_notes_async(
+            async_db, [slow.id, fast.id, broken.id, 999], [slow, fast, broken]
+        ))
+        elapsed = time.perf_counter() - start
+
+    assert results[0] == {"note_id": 999, "error": "Note not found", "status_code": 404}
+    assert [r["note_id"] for r in results[1:]] == [fast.id, broken.id, slow.id]
+    assert results[2]["status_code"] == 500
+    assert "model exploded" in results[2]["error"]
+    assert results[3] == {"note_id": slow.id, "summary": "summary of Slow"}
+    # Calls overlap: the batch takes about as long as the slowest one
+    assert elapsed < 0.5
+
+
+@pytest.mark.asyncio
+async def test_batch_serves_cached_summaries_without_model_calls(async_db, pinned_model):
+    note = await _add_note(async_db)
+    with patch("app.services.summaries.ai_service.summarize_text_async",
+               return_value="Short summary"):
+        await get_summary_async(async_db, note)
+
+    summaries.lru.clear()
+    with patch("app.services.summaries.ai_service.summarize_text_async") as mock_summarize:
+        results = await _collect(summaries.summarize_notes_async(async_db, [note.id], [note]))
+
+    assert results == [{"note_id": note.id, "summary": "Short summary"}]
+    mock_summarize.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_batch_respects_concurrency(async_db, pinned_model):
+    notes = [await _add_note(async_db, f"T{i}", f"content {i}") for i in range(5)]
+    running = {"now": 0, "peak": 0}
+
+    async def fake_summarize(content, title, model_name=None):
+        running["now"] += 1
+        running["peak"] = max(running["peak"], running["now"])
+        await asyncio.sleep(0.01)
+        running["now"] -= 1
+        return "ok"
+
+    with patch("app.services.summaries.ai_service.summarize_text_async",
+               side_effect=fake_summarize):
+        results = await _collect(summaries.summarize_notes_async(
+            async_db, [n.id for n in notes], notes, concurrency=2
+        ))
+
+    assert len(results) == 5
+    assert running["peak"] == 2
+
+
+@pytest.mark.asyncio
+async def test_batch_calls_count_against_the_caller(async_db, pinned_model, monkeypatch):
+    notes = [await _add_note(async_db, f"T{i}", f"content {i}") for i in range(4)]
+    running = {"now": 0, "peak": 0}
+    clients = set()
+
+    async def fake_summarize(content, title, model_name=None):
+        clients.add(ai_service.current_client.get())
+        running["now"] += 1
+        running["peak"] = max(running["peak"], running["now"])
+        await asyncio.sleep(0.01)
+        running["now"] -= 1
+        return "ok"
+
+    monkeypatch.setattr(ai_service, "AI_MAX_CONCURRENCY_PER_CLIENT", 1)
+    token = ai_service.current_client.set("10.0.0.1")
+    try:
+        with patch("app.services.summaries.ai_service.summarize_text_async",
+                   side_effect=fake_summarize):
+            results = await _collect(summaries.summarize_notes_async(
+                async_db, [n.id for n in notes], notes, concurrency=4
+            ))
+    finally:
+        ai_service.current_client.reset(token)
+
+    assert len(results) == 4
+    assert clients == {"10.0.0.1"}
+    assert running["peak"] == 1
+
+
+async def _fake_stream(content, title, model_name=None):
+    for part in ["Short ", "summary"]:
+        yield part
+
+
+@pytest.mark.asyncio
+async def test_stream_stores_full_text_in_cache(async_db, pinned_model):
+    note = await _add_note(async_db)
+    with patch("app.services.summaries.ai_service.stream_summary_async",
+               side_effect=_fake_stream):
+        chunks = await _collect(summaries.stream_summary_async(async_db, note))
+
+    assert chunks == ["Short ", "summary"]
+    with patch("app.services.summaries.ai_service.summarize_text_async") as mock_summarize:
+        assert await get_summary_async(async_db, note) == "Short summary"
+    mock_summarize.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_stream_serves_cached_summary_as_one_chunk(async_db, pinned_model):
+    note = await _add_note(async_db)
+    with patch("app.services.summaries.ai_service.summarize_text_async",
+               return_value="Cached summary"):
+        await get_summary_async(async_db, note)
+
+    with patch("app.services.summaries.ai_service.stream_summary_async") as mock_stream:
+        chunks = await _collect(summaries.stream_summary_async(async_db, note))
+
+    assert chunks == ["Cached summary"]
+    mock_stream.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_interrupted_stream_is_not_cached(async_db, pinned_model):
+    note = await _add_note(async_db)
+    with patch("app.services.summaries.ai_service.stream_summary_async",
+               side_effect=_fake_stream):
+        agen = summaries.stream_summary_async(async_db, note)
+        await agen.__anext__()
+        await agen.aclose()
+
+    result = await async_db.execute(select(CachedSummary))
+    assert result.scalars().all() == []
+
+
+@pytest.fixture
+def small_chunks():
+    with patch.object(summaries, "AI_LONG_NOTE_TOKENS", 200), \
+            patch.object(summaries, "AI_CHUNK_TOKENS", 100):
+        yield
+
+
+def _long_content(edited=None):
+    paragraphs = [f"Paragraph {i} talks about topic number {i} in some detail." for i in range(60)]
+    if edited is not None:
+        paragraphs[edited] = "This paragraph was rewritten."
+    return "\n\n".join(paragraphs)
+
+
+async def _fake_summarize(content, title, model_name=None):
+    return f"summary of {content[:20]}"
+
+
+async def _fake_combine(partials, title, client_id=None, model_name=None):
+    return f"combined {len(partials)}"
+
+
+@pytest.mark.asyncio
+async def test_long_note_is_summarized_in_chunks(async_db, pinned_model, small_chunks):
+    note = await _add_note(async_db, content=_long_content())
+    with patch("app.services.summaries.ai_service.summarize_text_async",
+               side_effect=_fake_summarize) as mock_summarize, \
+            patch("app.services.summaries.ai_service.combine_summaries_async",
+                  side_effect=_fake_combine) as mock_combine:
+        summary = await get_summary_async(async_db, note)
+
+    assert summary.startswith("combined")
+    assert mock_summarize.call_count > 1
+    assert all(len(call.args[0]) < len(note.content) for call in mock_summarize.call_args_list)
+    assert mock_combine.called
+    rows = (await async_db.execute(select(ChunkSummary))).scalars().all()
+    assert len(rows) == mock_summarize.call_count
+
+
+@pytest.mark.asyncio
+async def test_editing_a_long_note_only_resummarizes_changed_chunks(
+    async_db, pinned_model, small_chunks
+):
+    note = await _add_note(async_db, content=_long_content())
+    with patch("app.services.summaries.ai_service.summarize_text_async",
+               side_effect=_fake_summarize) as mock_summarize, \
+            patch("app.services.summaries.ai_service.combine_summaries_async",
+                  side_effect=_fake_combine):
+        await get_summary_async(async_db, note)
+        first = mock_summarize.call_count
+
+        summaries.lru.clear()
+        note.content = _long_content(edited=30)
+        await async_db.commit()
+        await async_db.refresh(note)
+        await get_summary_async(async_db, note)
+
+    assert 1 <= mock_summarize.call_count - first <= 3
+
+
+@pytest.mark.asyncio
+async def test_long_note_stream_only_streams_the_combine_step(
+    async_db, pinned_model, small_chunks
+):
+    note = await _add_note(async_db, content=_long_content())
+
+    async def fake_stream_combine(partials, title, client_id=None, model_name=None):
+        for part in ("All ", "combined"):
+            yield part
+
+    with patch("app.services.summaries.ai_service.summarize_text_async",
+               side_effect=_fake_summarize), \
+            patch("app.services.summaries.ai_service.combine_summaries_async",
+                  side_effect=_fake_combine), \
+            patch("app.services.summaries.ai_service.stream_combine_summaries_async",
+                  side_effect=fake_stream_combine):
+        chunks = await _collect(summaries.stream_summary_async(async_db, note))
+
+    assert chunks == ["All ", "combined"]
+    key = summary_key(note.title, note.content, pinned_model)
+    assert summaries.lru.get(key) == "All combined"
+
+
+def test_group_partials_always_shrinks():
+    with patch.object(summaries, "AI_CHUNK_TOKENS", 10):
+        groups = summaries._group_partials(["x" * 100] * 5)
+    assert len(groups) == 3
+
+
+@pytest.mark.asyncio
+async def test_concurrent_requests_share_one_model_call(async_db, pinned_model):
+    note = await _add_note(async_db)
+
+    async def slow_summary(content, title, model_name=None):
+        await asyncio.sleep(0.05)
+        return "Shared summary"
+
+    with patch("app.services.summaries.ai_service.summarize_text_async",
+               side_effect=slow_summary) as mock_summarize:
+        results = await asyncio.gather(
+            *(get_summary_async(async_db, note) for _ in range(5))
+        )
+
+    assert results == ["Shared summary"] * 5
+    mock_summarize.assert_called_once()
+    assert summaries.flight.coalesced >= 4
+
+
+@pytest.mark.asyncio
+async def test_failing_model_falls_back_to_last_summary(async_db, pinned_model):
+    note = await _add_note(async_db)
+    with patch("app.services.summaries.ai_service.summarize_text_async",
+               return_value="Old summary"):
+        await get_summary_async(async_db, note)
+
+    note.content = "Edited content"
+    await async_db.commit()
+    await async_db.refresh(note)
+    with patch("app.services.summaries.ai_service.summarize_text_async",
+               side_effect=HTTPException(status_code=503, detail="unavailable")):
+        assert await get_summary_async(async_db, note) == "Old summary"
+
+    # The fallback is not cached under the new version
+    key = summary_key(note.title, note.content, pinned_model)
+    assert summaries.lru.get(key) is None
+
+
+@pytest.mark.asyncio
+async def test_failing_model_falls_back_to_local_summary(async_db, pinned_model):
+    note = await _add_note(async_db, content="First point. Second point.")
+
+    async def failing_stream(content, title, model_name=None):
+        raise HTTPException(status_code=504, detail="timed out")
+        yield
+
+    with patch("app.services.summaries.ai_service.summarize_text_async",
+               side_effect=HTTPException(status_code=500, detail="failed")):
+        assert await get_summary_async(async_db, note) == "First point. Second point."
+    with patch("app.services.summaries.ai_service.stream_summary_async",
+               side_effect=failing_stream):
+        chunks = await _collect(summaries.stream_summary_async(async_db, note))
+
+    assert chunks == ["First point. Second point."]
+
+
+@pytest.mark.asyncio
+async def test_fallback_shared_with_a_batch_is_not_cached(async_db, pinned_model):
+    note = await _add_note(async_db, content="First point. Second point.")
+
+    async def failing_summary(content, title, model_name=None):
+        await asyncio.sleep(0.1)
+        raise HTTPException(status_code=503, detail="unavailable")
+
+    async def batch():
+        # Joins the single-note request's call once it is in flight
+        await asyncio.sleep(0.02)
+        async with AsyncTestingSessionLocal() as batch_db:
+            return await _collect(
+                summaries.summarize_notes_async(batch_db, [note.id], [note])
+            )
+
+    coalesced = summaries.flight.coalesced
+    with patch("app.services.summaries.ai_service.summarize_text_async",
+               side_effect=failing_summary) as mock_summarize:
+        summary, results = await asyncio.gather(
+            get_summary_async(async_db, note), batch()
+        )
+
+    mock_summarize.assert_called_once()
+    assert summaries.flight.coalesced == coalesced + 1
+    assert summary == "First point. Second point."
+    assert results == [{"note_id": note.id, "summary": summary}]
+    key = summary_key(note.title, note.content, pinned_model)
+    assert summaries.lru.get(key) is None
+    stored = await async_db.execute(select(CachedSummary))
+    assert stored.scalars().all() == []
+
+
+@pytest.mark.asyncio
+async def test_fallback_can_be_disabled(async_db, pinned_model):
+    note = await _add_note(async_db)
+    with patch.object(summaries, "AI_FALLBACK", False), \
+            patch("app.services.summaries.ai_service.summarize_text_async",
+                  side_effect=HTTPException(status_code=503, detail="unavailable")):
+        with pytest.raises(HTTPException):
+            await get_summary_async(async_db, note)
@@ -0,0 +1,71 @@
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from app.models.notes import Note
+from app.services import summarizers
+from app.services.summaries import get_summary_async, stream_summary_async
+from app.services.summarizers import select_summarizer
+
+
+@pytest.mark.parametrize(
+    "backend,api_key,max_words,content,expected",
+    [
+        ("gemini", None, 0, "short", "gemini"),
+        ("local", "key", 0, "short", "local"),
+        ("auto", None, 0, "word " * 500, "local"),
+        ("auto", "key", 0, "short", "gemini"),
+        ("auto", "key", 50, "short note", "local"),
+        ("auto", "key", 50, "word " * 500, "gemini"),
+    ],
+)
+def test_select_summarizer(backend, api_key, max_words, content, expected):
+    with patch.object(summarizers, "SUMMARIZER_BACKEND", backend), \
+            patch.object(summarizers, "LOCAL_SUMMARY_MAX_WORDS", max_words), \
+            patch("app.services.summarizers.ai_service.GEMINI_API_KEY", api_key):
+        assert select_summarizer(content).name == expected
+
+
+@pytest.mark.asyncio
+async def test_local_backend_summarizes_without_gemini(async_db):
+    note = Note(title="Title", content="First point. Second point. Third point. Fourth.")
+    async_db.add(note)
+    await async_db.commit()
+
+    with patch.object(summarizers, "SUMMARIZER_BACKEND", "local"), \
+            patch("app.services.summaries.ai_service.generate_async") as mock_generate:
+        summary = await get_summary_async(async_db, note)
+        chunks = [chunk async for chunk in stream_summary_async(async_db, note)]
+
+    assert summary == "First point. Second point. Third point."
+    assert chunks == [summary]
+    mock_generate.assert_not_called()
+
+
+def test_incomplete_backend_fails_at_construction():
+    class Partial(summarizers.Summarizer):
+        name = "partial"
+
+        async def model_name_async(self) -> str:
+            return "partial"
+
+    with pytest.raises(TypeError, match="stream_async"):
+        Partial()
+
+
+@pytest.mark.asyncio
+async def test_local_summaries_run_off_the_event_loop():
+    loop_thread = threading.get_ident()
+    called_from = []
+
+    def summarize(text, max_sentences):
+        called_from.append(threading.get_ident())
+        return text
+
+    with patch("app.services.summarizers.extractive.summarize", side_effect=summarize):
+        await summarizers.local.summarize_async("Text.", "Title", "local")
+        await summarizers.local.combine_async(["One.", "Two."], "Title", "local")
+
+    assert len(called_from) == 2
+    assert loop_thread not in called_from
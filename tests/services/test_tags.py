@@ -0,0 +1,40 @@
+from sqlalchemy import select
+
+from app.models.notes import NoteTag, Tag
+from app.schemas.notes import NoteCreate, NoteUpdate
+from app.services import tags
+from app.services.notes import create_note, delete_note, get_note, update_note
+from tests.conftest import query_plan
+
+
+def _counts(db):
+    return dict(db.execute(select(Tag.name, Tag.note_count)).all())
+
+
+def test_tags_and_counts_follow_notes(db):
+    first = create_note(db, NoteCreate(title="A", content="A", tags=["Work", "urgent"]))
+    assert first.tags == "urgent,work"
+    second = create_note(db, NoteCreate(title="B", content="B", tags=["work"]))
+
+    assert _counts(db) == {"work": 2, "urgent": 1}
+
+    update_note(db, first.id, NoteUpdate(tags=["home", "work"]))
+    assert _counts(db) == {"work": 2, "urgent": 0, "home": 1}
+    assert get_note(db, first.id).tags.split(",") == ["home", "work"]
+
+    # Leaving tags out keeps them
+    update_note(db, first.id, NoteUpdate(title="A2"))
+    assert sorted(get_note(db, first.id).tags.split(",")) == ["home", "work"]
+
+    delete_note(db, second.id)
+    assert _counts(db) == {"work": 1, "urgent": 0, "home": 1}
+    assert db.query(NoteTag).count() == 2
+
+
+def test_tag_filters_walk_the_indexes(db):
+    for match_all in (True, False):
+        plan = query_plan(tags.tagged_note_ids({1: 10, 2: 3}, match_all, 5, 20))
+        assert "ix_note_tags_tag_id_note_id" in plan
+        # Pages come off the index in order rather than being sorted
+        assert "USE TEMP B-TREE FOR ORDER BY" not in plan.split("COMPOUND")[0]
+        assert "SCAN note_tags" not in plan
@@ -49,3 +49,19 @@ def test_create_tables():
         assert 'notes' in table_names
     finally:
         db.close()
+
+def test_slow_queries_are_logged_with_plan(caplog):
+    from app import database
+
+    database.slow_queries.clear()
+    db = SessionLocal()
+    try:
+        with patch('app.database.SLOW_QUERY_MS', 0.000001):
+            db.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+    finally:
+        db.close()
+
+    entry = database.slow_queries[-1]
+    assert entry["statement"].startswith("SELECT name FROM sqlite_master")
+    assert entry["plan"]
+    assert "Slow query" in caplog.text
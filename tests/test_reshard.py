@@ -0,0 +1,104 @@
+from sqlalchemy import create_engine, select
+
+from app import reshard, sharding
+from app.database import Base
+from app.models.notes import Note, NoteHistory, NoteTag, Tag
+
+
+def _engines(tmp_path, count):
+    engines = [
+        create_engine(f"sqlite:///{tmp_path}/notes.shard{shard}.db") for shard in range(count)
+    ]
+    for engine in engines:
+        Base.metadata.create_all(bind=engine)
+    return engines
+
+
+def _fill(engine, count):
+    with engine.begin() as conn:
+        conn.execute(
+            Note.__table__.insert(),
+            [{"id": i, "title": f"T{i}", "content": f"C{i}"} for i in range(1, count + 1)],
+        )
+        conn.execute(Tag.__table__.insert(), [{"id": 1, "name": "all", "note_count": count}])
+        conn.execute(
+            NoteTag.__table__.insert(),
+            [{"note_id": i, "tag_id": 1} for i in range(1, count + 1)],
+        )
+        conn.execute(
+            NoteHistory.__table__.insert(),
+            [{"note_id": i, "title": "old", "content": "old"} for i in range(1, count + 1)],
+        )
+
+
+def _holdings(engines):
+    held = {}
+    for shard, engine in enumerate(engines):
+        with engine.connect() as conn:
+            held[shard] = {
+                "notes": set(conn.execute(select(Note.id)).scalars()),
+                "history": set(conn.execute(select(NoteHistory.note_id)).scalars()),
+                "tagged": conn.execute(select(Tag.note_count).where(Tag.name == "all")).scalar(),
+            }
+    return held
+
+
+def _assert_each_note_once(engines, shard_map, count):
+    held = _holdings(engines)
+    for note_id in range(1, count + 1):
+        owners = [shard for shard, rows in held.items() if note_id in rows["notes"]]
+        assert owners == [shard_map.shard_of(note_id)]
+    for rows in held.values():
+        assert rows["history"] == rows["notes"]
+        assert (rows["tagged"] or 0) == len(rows["notes"])
+    return held
+
+
+def test_plan_rebalance_is_even_and_moves_little():
+    current = sharding.ShardMap.even(3)
+    planned = reshard.plan_rebalance(current, 4)
+    assert [len(planned.buckets_of(shard)) for shard in range(4)] == [256] * 4
+    moved = sum(a != b for a, b in zip(current.buckets, planned.buckets))
+    assert moved == sharding.SHARD_BUCKETS - 3 * 256
+
+    assert reshard.plan_rebalance(planned, 4).buckets == planned.buckets
+    assert reshard.plan_rebalance(planned, 1).shards == [0]
+
+
+def test_plan_split_moves_every_other_bucket():
+    planned = reshard.plan_split(sharding.ShardMap.even(2), 1, 2)
+    assert len(planned.buckets_of(0)) == 512
+    assert len(planned.buckets_of(1)) == len(planned.buckets_of(2)) == 256
+
+
+def test_rebalance_spreads_existing_notes(tmp_path):
+    engines = _engines(tmp_path, 3)
+    _fill(engines[0], 90)
+    current = reshard.load_map(engines)
+    assert current.shards == [0]
+
+    planned = reshard.plan_rebalance(current, 3)
+    result = reshard.apply(engines, current, planned)
+    assert result["copied"] == result["removed"] == 60
+
+    assert reshard.load_map(engines).buckets == planned.buckets
+    held = _assert_each_note_once(engines, planned, 90)
+    # Sequential ids are spread evenly, not left in one shard
+    assert [len(rows["notes"]) for rows in held.values()] == [30, 30, 30]
+
+
+def test_split_and_rerun(tmp_path):
+    engines = _engines(tmp_path, 3)
+    _fill(engines[0], 40)
+    current = reshard.load_map(engines)
+    planned = reshard.plan_split(current, 0, 2)
+
+    # A run that stopped after copying is completed by running it again
+    with engines[2].begin() as conn:
+        conn.execute(Note.__table__.insert(), [{"id": 2, "title": "T2", "content": "C2"}])
+    reshard.apply(engines, current, planned)
+    reshard.apply(engines, planned, planned)
+
+    held = _assert_each_note_once(engines, planned, 40)
+    assert not held[1]["notes"]
+    assert len(held[0]["notes"]) == len(held[2]["notes"]) == 20
@@ -0,0 +1,43 @@
+import os
+from unittest.mock import patch
+
+from app import server
+
+
+def test_worker_count_defaults_to_cores():
+    with patch("app.server.os.cpu_count", return_value=6):
+        assert server.worker_count(0) == 6
+    assert server.worker_count(3) == 3
+
+
+def test_uvloop_and_httptools_are_used_when_installed():
+    with patch("app.server.importlib.util.find_spec", return_value=None):
+        assert server.event_loop() == "asyncio"
+        assert server.http_protocol() == "h11"
+    with patch("app.server.importlib.util.find_spec", return_value=object()):
+        assert server.event_loop() == "uvloop"
+        assert server.http_protocol() == "httptools"
+
+
+def test_schema_is_created_once_before_workers_start():
+    with patch.dict(os.environ), \
+         patch("app.server.create_schema") as create_schema, \
+         patch("app.server.SessionLocal"), \
+         patch("app.server.duplicates.backfill_signatures") as backfill, \
+         patch("app.server.similarity.load_index") as load_index, \
+         patch("app.server.similarity.save_index") as save_index, \
+         patch("app.server.uvicorn.run") as run, \
+         patch("sys.argv", ["app.server", "--workers", "2"]):
+        server.main()
+        assert os.environ["SCHEMA_CREATED"] == "1"
+        # Workers split the server-wide limits between them
+        assert os.environ["WEB_WORKERS"] == "2"
+
+    create_schema.assert_called_once()
+    # Signatures and the related-notes index are built before the workers
+    # start, so they do not all write them at once
+    backfill.assert_called_once()
+    load_index.assert_called_once()
+    save_index.assert_called_once()
+    assert run.call_args.kwargs["workers"] == 2
+    assert run.call_args.kwargs["timeout_graceful_shutdown"] == server.GRACEFUL_TIMEOUT
@@ -0,0 +1,231 @@
+import asyncio
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import create_engine, delete, func, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app import sharding
+from app.database import Base
+from app.models.notes import Note, NoteHistory, NoteTag
+from app.schemas.notes import NoteCreate, NoteUpdate
+from app.services import notes, tags
+
+SHARDS = 3
+
+
+@pytest.fixture
+def shard_engines(tmp_path):
+    engines = [
+        create_engine(f"sqlite:///{tmp_path}/notes.shard{shard}.db")
+        for shard in range(SHARDS)
+    ]
+    for engine in engines:
+        Base.metadata.create_all(bind=engine)
+    yield engines
+    for engine in engines:
+        engine.dispose()
+
+
+@pytest.fixture
+def catalog(shard_engines):
+    return sharding.ShardCatalog(shard_engines, block=10)
+
+
+@pytest.fixture
+def sharded_db(shard_engines, catalog):
+    session = sharding.ShardedNotesSession(catalog, shards=dict(enumerate(shard_engines)))
+    yield session
+    session.close()
+
+
+@pytest_asyncio.fixture
+async def async_sharded_db(shard_engines, catalog):
+    engines = [
+        create_async_engine(engine.url.set(drivername="sqlite+aiosqlite"))
+        for engine in shard_engines
+    ]
+    session_factory = sessionmaker(
+        class_=AsyncSession,
+        sync_session_class=sharding.ShardedNotesSession,
+        shards={shard: engine.sync_engine for shard, engine in enumerate(engines)},
+        catalog=catalog,
+        expire_on_commit=False,
+    )
+    async with session_factory() as session:
+        yield session
+    for engine in engines:
+        await engine.dispose()
+
+
+def _ids_by_shard(engines):
+    found = {}
+    for shard, engine in enumerate(engines):
+        with engine.connect() as conn:
+            found[shard] = set(conn.execute(select(Note.id)).scalars())
+    return found
+
+
+def test_shard_url():
+    assert sharding.shard_url("sqlite:///./notes.db", 0) == "sqlite:///./notes.db"
+    assert sharding.shard_url("sqlite:///./notes.db", 2) == "sqlite:///./notes.shard2.db"
+
+
+def test_note_ids_reads_where_clause():
+    assert sharding.note_ids(select(Note).where(Note.id == 7)) == {7}
+    assert sharding.note_ids(select(Note).where(Note.id.in_([1, 2]), Note.title == "x")) == {1, 2}
+    assert sharding.note_ids(delete(NoteTag).where(NoteTag.note_id == 3)) == {3}
+    assert sharding.note_ids(select(NoteHistory).where(NoteHistory.note_id == 4)) == {4}
+    # Alternatives or no condition may touch any note
+    assert sharding.note_ids(select(Note).where((Note.id == 1) | (Note.id == 2))) is None
+    assert sharding.note_ids(select(Note)) is None
+    assert sharding.note_ids(select(Note).where(Note.title == "x")) is None
+
+
+def test_new_map_is_even_and_persisted(shard_engines, catalog):
+    shard_map = catalog.shard_map
+    assert shard_map.shards == [0, 1, 2]
+    assert [len(shard_map.buckets_of(shard)) for shard in range(SHARDS)] == [342, 341, 341]
+    with shard_engines[0].connect() as conn:
+        assert sharding.ShardMap.load(conn).buckets == shard_map.buckets
+
+
+def test_existing_notes_keep_shard_zero(tmp_path):
+    engines = [create_engine(f"sqlite:///{tmp_path}/s{shard}.db") for shard in range(2)]
+    for engine in engines:
+        Base.metadata.create_all(bind=engine)
+    with engines[0].begin() as conn:
+        conn.execute(Note.__table__.insert(), [{"title": "old", "content": "old"}])
+
+    catalog = sharding.ShardCatalog(engines)
+    assert catalog.shard_map.shards == [0]
+    # New ids continue after the existing ones
+    assert catalog.next_id("notes") == 2
+
+
+def test_ids_are_unique_across_catalogs(shard_engines):
+    # Two workers reserve separate blocks from the same catalog table
+    first = sharding.ShardCatalog(shard_engines, block=5)
+    second = sharding.ShardCatalog(shard_engines, block=5)
+    ids = [catalog.next_id("notes") for _ in range(8) for catalog in (first, second)]
+    assert len(set(ids)) == len(ids)
+    assert first.next_id("note_attachments") == 1
+
+
+def test_notes_live_in_their_shard(sharded_db, shard_engines, catalog):
+    created = [
+        notes.create_note(sharded_db, NoteCreate(title=f"T{i}", content=f"C{i}", tags=["a"]))
+        for i in range(12)
+    ]
+    ids = [note.id for note in created]
+    assert len(set(ids)) == len(ids)
+
+    found = _ids_by_shard(shard_engines)
+    for note_id in ids:
+        assert [shard for shard, held in found.items() if note_id in held] == [
+            catalog.shard_map.shard_of(note_id)
+        ]
+    assert len([shard for shard, held in found.items() if held]) > 1
+
+    note_id = ids[4]
+    notes.update_note(sharded_db, note_id, NoteUpdate(title="Changed", tags=["b"]))
+    assert notes.get_note(sharded_db, note_id).title == "Changed"
+    assert [h.title for h in notes.get_note_history(sharded_db, note_id)] == ["T4"]
+
+    notes.delete_note(sharded_db, ids[5])
+    assert [note.id for note in notes.get_all_notes(sharded_db, 0, 100)] == sorted(
+        set(ids) - {ids[5]}
+    )
+    assert [note.id for note in notes.get_all_notes(sharded_db, 3, 4)] == sorted(
+        set(ids) - {ids[5]}
+    )[3:7]
+
+
+@pytest.mark.asyncio
+async def test_listings_merge_shards(async_sharded_db, shard_engines):
+    db = async_sharded_db
+    ids = []
+    for i in range(15):
+        note = await notes.create_note_async(
+            db,
+            NoteCreate(
+                title=f"Title {i % 4}",
+                content=f"Content {i}",
+                tags=["all"] + (["odd"] if i % 2 else []),
+            ),
+        )
+        ids.append(note.id)
+    assert len([held for held in _ids_by_shard(shard_engines).values() if held]) > 1
+
+    listed, cursor = [], None
+    while True:
+        rows, cursor = await notes.list_note_rows_async(db, limit=4, cursor=cursor)
+        listed.extend(row["id"] for row in rows)
+        if cursor is None:
+            break
+    assert listed == sorted(ids)
+
+    rows, _ = await notes.list_note_rows_async(db, skip=2, limit=5, sort="title", descending=True)
+    expected = sorted(
+        ((f"Title {i % 4}", note_id) for i, note_id in enumerate(ids)), reverse=True
+    )[2:7]
+    assert [(row["title"], row["id"]) for row in rows] == expected
+
+    rows, _ = await notes.list_note_rows_async(db, limit=100, tag_names=["odd"])
+    assert [row["id"] for row in rows] == [note_id for i, note_id in enumerate(ids) if i % 2]
+    rows, cursor = await notes.list_note_rows_async(db, skip=3, limit=2, tag_names=["odd"])
+    assert [row["id"] for row in rows] == [note_id for i, note_id in enumerate(ids) if i % 2][3:5]
+    assert cursor is not None
+    assert await notes.list_note_rows_async(db, skip=15, limit=5) == ([], None)
+
+    assert [note.id for note in await notes.get_all_notes_async(db, 4, 6)] == sorted(ids)[4:10]
+    assert await notes.get_all_notes_async(db, 15, 5) == []
+
+    counts = await tags.get_tag_counts_async(db)
+    assert counts == [{"name": "all", "count": 15}, {"name": "odd", "count": 7}]
+
+    await notes.delete_note_async(db, ids[1])
+    counts = await tags.get_tag_counts_async(db)
+    assert counts == [{"name": "all", "count": 14}, {"name": "odd", "count": 6}]
+
+
+@pytest.mark.asyncio
+async def test_shards_are_queried_at_once(async_sharded_db):
+    started = []
+    everyone = asyncio.Event()
+
+    async def query(shard_db):
+        # Each shard waits for the others, so reading them one by one hangs
+        started.append(shard_db)
+        if len(started) == SHARDS:
+            everyone.set()
+        await everyone.wait()
+        return (await shard_db.execute(select(func.count()).select_from(Note))).scalar()
+
+    counts = await asyncio.wait_for(sharding.gather_shards(async_sharded_db, query), 5)
+    assert counts == [0] * SHARDS
+    assert len({id(shard_db) for shard_db in started}) == SHARDS
+
+
+def test_on_shard_pins_statements(sharded_db, shard_engines):
+    for i in range(6):
+        notes.create_note(sharded_db, NoteCreate(title=f"T{i}", content="C"))
+    held = _ids_by_shard(shard_engines)
+    for shard in range(SHARDS):
+        with sharding.on_shard(sharded_db, shard):
+            assert sharded_db.execute(select(func.count()).select_from(Note)).scalar() == len(
+                held[shard]
+            )
+    # Unpinned, the counts of every shard come back
+    assert sorted(sharded_db.execute(select(func.count()).select_from(Note)).scalars()) == sorted(
+        len(ids) for ids in held.values()
+    )
+
+
+def test_helpers_are_no_ops_unsharded(db):
+    assert sharding.shard_ids(db) is None
+    assert sharding.new_id(db) is None
+    assert sharding.map_shards(db, lambda shard_db: shard_db) == [db]
+    with sharding.on_shard(db, 1):
+        assert notes.create_note(db, NoteCreate(title="T", content="C")).id == 1
@@ -0,0 +1,11 @@
+import pytest
+
+from app import warmup
+
+
+@pytest.mark.asyncio
+async def test_warm_up_runs_every_step():
+    timings = await warmup.warm_up()
+
+    assert set(timings) == set(warmup.STEPS)
+    assert all(seconds >= 0 for seconds in timings.values())
@@ -0,0 +1,32 @@
+from app.utils.cache import LRUCache
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert len(cache) == 2
+
+
+def test_lru_counts_hits_and_misses():
+    cache = LRUCache()
+    cache.set("a", 1)
+    cache.get("a")
+    cache.get("missing")
+
+    assert cache.stats() == {"size": 1, "maxsize": 1024, "hits": 1, "misses": 1}
+
+
+def test_lru_pop_and_clear():
+    cache = LRUCache()
+    cache.set("a", 1)
+    assert cache.pop("a") == 1
+    assert cache.pop("a", "gone") == "gone"
+    cache.set("b", 2)
+    cache.clear()
+    assert len(cache) == 0
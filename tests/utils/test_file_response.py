@@ -0,0 +1,105 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.utils.file_response import BlobResponse, parse_range
+
+
+@pytest.mark.parametrize(
+    "header, expected",
+    [
+        (None, None),
+        ("bytes=0-3", (0, 3)),
+        ("bytes=4-", (4, 9)),
+        ("bytes=-3", (7, 9)),
+        ("bytes=-30", (0, 9)),
+        ("bytes=5-100", (5, 9)),
+        ("bytes=0-1,4-5", None),
+        ("items=0-1", None),
+    ],
+)
+def test_parse_range(header, expected):
+    assert parse_range(header, 10) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=10-", "bytes=5-2", "bytes=-0"])
+def test_unsatisfiable_ranges(header):
+    with pytest.raises(ValueError):
+        parse_range(header, 10)
+
+
+def _client(tmp_path, chunk_size=4):
+    path = tmp_path / "blob"
+    path.write_bytes(b"0123456789")
+    app = FastAPI()
+
+    @app.api_route("/blob", methods=["GET", "HEAD"])
+    def blob():
+        response = BlobResponse(str(path), 10, "abc", "text/plain", filename="nöte.txt")
+        response.chunk_size = chunk_size
+        return response
+
+    return TestClient(app)
+
+
+def test_whole_file_and_ranges(tmp_path):
+    client = _client(tmp_path)
+
+    whole = client.get("/blob")
+    assert whole.status_code == 200
+    assert whole.content == b"0123456789"
+    assert whole.headers["accept-ranges"] == "bytes"
+    assert whole.headers["etag"] == '"abc"'
+    assert whole.headers["content-disposition"] == "attachment; filename*=utf-8''n%C3%B6te.txt"
+
+    part = client.get("/blob", headers={"Range": "bytes=3-8"})
+    assert part.status_code == 206
+    assert part.content == b"345678"
+    assert part.headers["content-range"] == "bytes 3-8/10"
+    assert part.headers["content-length"] == "6"
+
+    unsatisfiable = client.get("/blob", headers={"Range": "bytes=20-"})
+    assert unsatisfiable.status_code == 416
+    assert unsatisfiable.headers["content-range"] == "bytes */10"
+
+
+@pytest.mark.parametrize(
+    "media_type, disposition",
+    [
+        ("image/png", "inline"),
+        ("IMAGE/JPEG", "inline"),
+        ("application/pdf", "inline"),
+        ("image/svg+xml", "attachment"),
+        ("text/html; charset=utf-8", "attachment"),
+        ("application/xhtml+xml", "attachment"),
+        ("application/octet-stream", "attachment"),
+    ],
+)
+def test_only_safe_types_render_inline(tmp_path, media_type, disposition):
+    path = tmp_path / "blob"
+    path.write_bytes(b"<script>alert(1)</script>")
+    response = BlobResponse(str(path), 25, "abc", media_type, filename="file")
+
+    assert response.headers["content-disposition"] == f'{disposition}; filename="file"'
+    assert response.headers["x-content-type-options"] == "nosniff"
+    assert response.headers["content-security-policy"] == "sandbox"
+
+
+def test_conditional_requests(tmp_path):
+    client = _client(tmp_path)
+
+    assert client.get("/blob", headers={"If-None-Match": '"abc"'}).status_code == 304
+    # A range of other content is ignored and the whole file is sent
+    stale = client.get("/blob", headers={"Range": "bytes=0-1", "If-Range": '"old"'})
+    assert stale.status_code == 200
+    assert stale.content == b"0123456789"
+    fresh = client.get("/blob", headers={"Range": "bytes=0-1", "If-Range": '"abc"'})
+    assert fresh.content == b"01"
+
+
+def test_head_sends_headers_only(tmp_path):
+    response = _client(tmp_path).head("/blob", headers={"Range": "bytes=2-"})
+
+    assert response.status_code == 206
+    assert response.headers["content-length"] == "8"
+    assert response.content == b""
@@ -0,0 +1,69 @@
+import pytest
+
+from app.utils.metrics import Registry
+
+
+def test_counter_renders_total_family_and_labels():
+    registry = Registry()
+    requests = registry.counter("requests", "Requests served", ("route",))
+    requests.labels("/notes").inc()
+    requests.labels("/notes").inc(2)
+    requests.labels('/a"b').inc()
+
+    lines = registry.render().splitlines()
+    assert lines[0] == "# HELP requests_total Requests served"
+    assert lines[1] == "# TYPE requests_total counter"
+    assert 'requests_total{route="/notes"} 3' in lines
+    assert 'requests_total{route="/a\\"b"} 1' in lines
+
+
+def test_gauge_goes_up_and_down():
+    registry = Registry()
+    in_flight = registry.gauge("in_flight", "Requests in flight")
+    in_flight.inc()
+    in_flight.inc()
+    in_flight.dec()
+
+    assert "in_flight 1" in registry.render().splitlines()
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = Registry()
+    latency = registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        latency.observe(value)
+
+    lines = registry.render().splitlines()
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1"} 3' in lines
+    assert 'latency_seconds_bucket{le="+Inf"} 4' in lines
+    assert "latency_seconds_sum 6.05" in lines
+    assert "latency_seconds_count 4" in lines
+
+
+def test_callback_reads_state_at_render_time():
+    registry = Registry()
+    state = {"hit": 1, "miss": 0}
+    registry.callback(
+        "lookups",
+        "Lookups by result",
+        lambda: {(result,): count for result, count in state.items()},
+        ("result",),
+        kind="counter",
+    )
+    state["miss"] = 4
+
+    lines = registry.render().splitlines()
+    assert 'lookups_total{result="hit"} 1' in lines
+    assert 'lookups_total{result="miss"} 4' in lines
+
+    callback = registry.callback("depth", "Queue depth", lambda: 3)
+    with pytest.raises(TypeError):
+        callback.labels()
+
+
+def test_duplicate_names_are_rejected():
+    registry = Registry()
+    registry.gauge("size", "Size")
+    with pytest.raises(ValueError):
+        registry.gauge("size", "Size")
@@ -0,0 +1,64 @@
+import threading
+import time
+from unittest.mock import patch
+
+from app.utils import profiling
+from app.utils.profiling import StackSampler
+
+
+def _busy_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sampler_records_stacks_of_selected_threads():
+    stop = threading.Event()
+    worker = threading.Thread(target=_busy_loop, args=(stop,))
+    worker.start()
+    try:
+        sampler = StackSampler(interval=0.001, thread_ids={worker.ident})
+        sampler.start()
+        time.sleep(0.1)
+        sampler.stop()
+    finally:
+        stop.set()
+        worker.join()
+
+    assert sampler.samples
+    # The innermost frame may be Event.is_set, called from the loop
+    assert all(
+        "_busy_loop" in [name for name, _, _ in stack] for stack in sampler.samples
+    )
+
+
+def test_speedscope_export_references_shared_frames():
+    sampler = StackSampler(interval=0.01)
+    sampler.samples[(("main", "app.py", 1), ("handler", "app.py", 10))] = 3
+    sampler.samples[(("main", "app.py", 1),)] = 1
+
+    document = sampler.speedscope("test")
+    frames = document["shared"]["frames"]
+    profile = document["profiles"][0]
+    assert [frame["name"] for frame in frames] == ["main", "handler"]
+    assert profile["samples"] == [[0, 1], [0]]
+    assert profile["weights"] == [0.03, 0.01]
+
+
+def test_sampling_stops_after_duration_and_calls_back():
+    finished = threading.Event()
+    sampler = StackSampler(interval=0.001, duration=0.05, on_finish=finished.set)
+    sampler.start()
+
+    assert finished.wait(2)
+    assert not sampler.running
+
+
+def test_token_is_required_and_checked():
+    with patch.object(profiling, "PROFILING", True), \
+         patch.object(profiling, "PROFILING_TOKEN", "secret"):
+        assert profiling.token_valid("secret")
+        assert not profiling.token_valid("wrong")
+        assert not profiling.token_valid(None)
+    with patch.object(profiling, "PROFILING", True), \
+         patch.object(profiling, "PROFILING_TOKEN", ""):
+        assert not profiling.token_valid("")
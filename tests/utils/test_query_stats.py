@@ -0,0 +1,21 @@
+from app.utils.query_stats import record, track_queries
+
+
+def test_nothing_is_recorded_outside_tracking():
+    record("SELECT 1", 0.5, 1)
+    with track_queries() as stats:
+        pass
+    assert stats.queries == 0
+
+
+def test_nested_trackers_both_see_statements():
+    with track_queries() as outer:
+        record("SELECT 1", 0.25, 1)
+        with track_queries() as inner:
+            record("SELECT 2", 0.5, 3)
+
+    assert inner.queries == 1
+    assert inner.rows == 3
+    assert outer.queries == 2
+    assert outer.seconds == 0.75
+    assert outer.statements == ["SELECT 1", "SELECT 2"]
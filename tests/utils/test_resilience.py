@@ -0,0 +1,78 @@
+from app.utils.resilience import CircuitBreaker, LatencyWindow, backoff_delay
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=10, clock=FakeClock())
+    for _ in range(2):
+        breaker.record_failure()
+    breaker.record_success()
+    for _ in range(2):
+        breaker.record_failure()
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.allow()
+    assert breaker.stats()["rejected"] == 1
+
+
+def test_breaker_lets_one_probe_through_after_reset_timeout():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+
+    clock.now = 10
+    assert breaker.allow()
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    clock.now = 15
+    assert not breaker.allow()
+
+    clock.now = 20
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow()
+
+
+def test_breaker_replaces_a_probe_that_never_reports():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    clock.now = 10
+    assert breaker.allow()
+    clock.now = 20
+    assert breaker.allow()
+
+
+def test_latency_window_percentile():
+    window = LatencyWindow(size=100, min_samples=10)
+    for i in range(9):
+        window.add(i)
+    assert window.percentile(95) is None
+
+    for i in range(9, 100):
+        window.add(i)
+    assert window.percentile(50) == 50
+    assert window.percentile(95) == 94
+    assert window.percentile(100) == 99
+
+    window.add(1000)
+    assert len(window) == 100
+
+
+def test_backoff_delay_is_jittered_and_capped():
+    delays = [backoff_delay(attempt, base=0.5, cap=2.0) for attempt in range(10)]
+    assert all(0 <= delay <= 2.0 for delay in delays)
+    assert all(0 <= backoff_delay(0, 0.5, 2.0) <= 0.5 for _ in range(50))
@@ -0,0 +1,32 @@
+from datetime import datetime
+from typing import List
+
+import orjson
+
+from app.models.notes import Note
+from app.schemas.notes import NoteResponse
+from app.utils.serialization import get_adapter, json_response, to_jsonable
+
+
+def _note(note_id=1):
+    now = datetime(2024, 1, 2, 3, 4, 5, 678000)
+    return Note(id=note_id, title="Title", content="Body", created_at=now, updated_at=now)
+
+
+def test_adapters_are_cached():
+    assert get_adapter(List[NoteResponse]) is get_adapter(List[NoteResponse])
+
+
+def test_to_jsonable_reads_orm_objects():
+    data = to_jsonable(List[NoteResponse], [_note(1), _note(2)])
+    assert [item["id"] for item in data] == [1, 2]
+    assert set(data[0]) == {"id", "title", "content", "created_at", "updated_at", "tags"}
+
+
+def test_json_response_matches_pydantic_json():
+    note = _note()
+    response = json_response(NoteResponse, note, status_code=201)
+    assert response.status_code == 201
+    assert orjson.loads(response.body) == orjson.loads(
+        NoteResponse.model_validate(note).model_dump_json()
+    )
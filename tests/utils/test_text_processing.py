@@ -0,0 +1,50 @@
+from app.utils.text_processing import (
+    estimate_tokens,
+    get_stopwords,
+    split_into_chunks,
+    tokenize,
+)
+
+
+def test_tokenize_lowercases_and_drops_stopwords():
+    tokens = tokenize("The Quick brown fox, and THE lazy dog!")
+    assert tokens == ["quick", "brown", "fox", "lazy", "dog"]
+
+
+def test_tokenize_skips_numbers_and_single_letters():
+    assert tokenize("a 42 b meeting_notes x2") == ["meeting", "notes"]
+
+
+def test_tokenize_empty_text():
+    assert tokenize("") == []
+
+
+def test_get_stopwords_is_cached():
+    assert get_stopwords() is get_stopwords()
+    assert "the" in get_stopwords()
+
+
+def _paragraphs(n):
+    return [f"Paragraph {i} talks about topic number {i} in some detail." for i in range(n)]
+
+
+def test_split_into_chunks_respects_budget_and_keeps_text():
+    paragraphs = _paragraphs(60)
+    chunks = split_into_chunks("\n\n".join(paragraphs), 100)
+    assert len(chunks) > 1
+    assert all(estimate_tokens(chunk) <= 100 for chunk in chunks)
+    assert "\n\n".join(chunks).split("\n\n") == paragraphs
+
+
+def test_split_into_chunks_splits_oversized_paragraphs():
+    chunks = split_into_chunks("word " * 1000, 50)
+    assert all(estimate_tokens(chunk) <= 50 for chunk in chunks)
+    assert " ".join(chunks).split() == ["word"] * 1000
+
+
+def test_split_into_chunks_is_stable_after_an_edit():
+    paragraphs = _paragraphs(60)
+    before = split_into_chunks("\n\n".join(paragraphs), 100)
+    paragraphs[30] = "This paragraph was rewritten."
+    after = split_into_chunks("\n\n".join(paragraphs), 100)
+    assert len(set(before) & set(after)) >= len(before) - 3
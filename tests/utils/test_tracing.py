@@ -0,0 +1,157 @@
+import asyncio
+import json
+
+import pytest
+
+from app.utils import tracing
+
+
+@tracing.traced()
+async def _lookup(value):
+    with tracing.span("lookup.inner", "db"):
+        return value
+
+
+def _spans(trace):
+    return {span.name: span for span in trace.spans}
+
+
+def test_spans_are_no_ops_outside_a_trace():
+    with tracing.span("orphan") as span:
+        pass
+    tracing.record_span("orphan", "db", 0.0)
+
+    assert span is None
+    assert asyncio.run(_lookup(3)) == 3
+
+
+def test_span_tree_and_phases():
+    trace = tracing.Trace(sampled=True)
+    with tracing.activate(trace):
+        with tracing.span("GET /notes", "server"):
+            with tracing.span("outer", "service"):
+                with tracing.span("inner", "service"):
+                    tracing.record_span("db.select", "db", 0.0, 0.25)
+
+    spans = _spans(trace)
+    assert spans["inner"].parent_id == spans["outer"].span_id
+    assert spans["db.select"].parent_id == spans["inner"].span_id
+    assert spans["GET /notes"].parent_id is None
+    # The nested service span is not counted twice
+    assert trace.phases["service"][1] == 1
+    assert trace.phases["db"] == [0.25, 1]
+    assert tracing.current_trace() is None
+
+
+def test_unsampled_traces_keep_phases_only():
+    trace = tracing.Trace(sampled=False)
+    with tracing.activate(trace):
+        with tracing.span("work", "service"):
+            pass
+
+    assert trace.spans == []
+    assert trace.phases["service"][1] == 1
+
+
+def test_span_records_errors():
+    trace = tracing.Trace(sampled=True)
+    with tracing.activate(trace), pytest.raises(ValueError):
+        with tracing.span("failing"):
+            raise ValueError
+
+    assert trace.spans[0].error == "ValueError"
+
+
+@pytest.mark.asyncio
+async def test_context_propagates_to_concurrent_tasks():
+    trace = tracing.Trace(sampled=True)
+    with tracing.activate(trace):
+        with tracing.span("root", "server"):
+            await asyncio.gather(_lookup(1), _lookup(2))
+
+    root = _spans(trace)["root"]
+    services = [span for span in trace.spans if span.name == "test_tracing._lookup"]
+    inner = [span for span in trace.spans if span.name == "lookup.inner"]
+    assert [span.parent_id for span in services] == [root.span_id] * 2
+    assert {span.parent_id for span in inner} == {span.span_id for span in services}
+
+
+def test_start_trace_sampling_and_traceparent(monkeypatch):
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATE", 0.0)
+    assert not tracing.start_trace().sampled
+    monkeypatch.setattr(tracing, "TRACE_SAMPLE_RATE", 1.0)
+    assert tracing.start_trace().sampled
+
+    trace_id, parent_id = "4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7"
+    followed = tracing.start_trace(f"00-{trace_id}-{parent_id}-00")
+    assert followed.trace_id_hex == trace_id
+    assert followed.parent_id == int(parent_id, 16)
+    assert not followed.sampled
+
+    invalid = tracing.start_trace(f"00-{'0' * 32}-{parent_id}-01")
+    assert invalid.trace_id_hex != "0" * 32
+    assert invalid.parent_id is None
+
+
+def test_server_timing_header():
+    trace = tracing.Trace(sampled=False)
+    with tracing.activate(trace):
+        tracing.record_span("db.select", "db", 0.0, 0.002)
+        tracing.record_span("db.insert", "db", 0.0, 0.001)
+
+    assert tracing.server_timing(trace, 0.01) == (
+        'total;dur=10.000, db;dur=3.000;desc="2 spans"'
+    )
+
+
+def _sample_trace():
+    trace = tracing.Trace(sampled=True)
+    with tracing.activate(trace):
+        with tracing.span("GET /notes/{note_id}", "server", **{"http.method": "GET"}):
+            with tracing.span("notes.get_note_async"):
+                tracing.record_span("db.select", "db", 0.0, 0.001)
+    return trace
+
+
+def test_tree_export():
+    tree = tracing.to_tree(_sample_trace())
+
+    [root] = tree["spans"]
+    assert root["name"] == "GET /notes/{note_id}"
+    assert root["attributes"] == {"http.method": "GET"}
+    [service] = root["children"]
+    assert service["name"] == "notes.get_note_async"
+    assert service["children"][0]["name"] == "db.select"
+
+
+def test_otlp_export():
+    trace = _sample_trace()
+    request = tracing.to_otlp([trace])
+
+    [resource] = request["resourceSpans"]
+    spans = resource["scopeSpans"][0]["spans"]
+    assert {span["traceId"] for span in spans} == {trace.trace_id_hex}
+    by_name = {span["name"]: span for span in spans}
+    root = by_name["GET /notes/{note_id}"]
+    assert root["kind"] == 2
+    assert root["parentSpanId"] == ""
+    assert by_name["notes.get_note_async"]["parentSpanId"] == root["spanId"]
+    assert int(root["endTimeUnixNano"]) >= int(root["startTimeUnixNano"])
+
+
+@pytest.mark.parametrize("format", ["jsonl", "otlp"])
+def test_exporter_writes_lines(tmp_path, format):
+    path = tmp_path / "traces" / "out.jsonl"
+    exporter = tracing.TraceExporter(format=format, path=str(path))
+
+    exporter.export(_sample_trace())
+    exporter.export(_sample_trace())
+    exporter.flush()
+
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    if format == "jsonl":
+        assert len(lines) == 2
+        assert all(line["spans"][0]["name"] == "GET /notes/{note_id}" for line in lines)
+    else:
+        spans = [s for line in lines for s in line["resourceSpans"][0]["scopeSpans"][0]["spans"]]
+        assert len(spans) == 6
@@ -0,0 +1,11 @@
+from app.utils.workers import per_worker
+
+
+def test_limits_are_split_between_workers():
+    assert per_worker(64, workers=4) == 16
+    assert per_worker(10, workers=4) == 2
+
+
+def test_every_worker_gets_at_least_one():
+    assert per_worker(2, workers=8) == 1
+    assert per_worker(0, workers=1) == 1